@@ -1,54 +1,72 @@
-from argparse import ArgumentParser
-
 from flask import Flask, jsonify, request
 
 from cc_agency.commons.helper import create_flask_response
 from cc_agency.version import VERSION as AGENCY_VERSION
 from cc_agency.commons.conf import Conf
-from cc_agency.commons.db import Mongo
 from cc_agency.broker.auth import Auth
 
 from cc_cloud.version import VERSION as CLOUD_VERSION
-from cc_cloud.service.file_service import FileService
+from cc_cloud.db import LazyMongo
 from cc_cloud.routes.routes import cloud_routes
 from cc_cloud.service.cloud_service import CloudService
 
 
 DESCRIPTION = 'CC-Cloud webinterface'
 
-app = Flask('cc-cloud')
-app.config['UPLOAD_FOLDER'] = '/home/user/cloud'
-application = app
-
-parser = ArgumentParser(description=DESCRIPTION)
-parser.add_argument(
-    '-c', '--conf-file', action='store', type=str, metavar='CONF_FILE',
-    help='CONF_FILE (yaml) as local path.'
-)
-args = parser.parse_args()
-
-conf = Conf(args.conf_file)
-mongo = Mongo(conf)
-auth = Auth(conf, mongo)
-file_manager = FileService(conf)
-cloud = CloudService(conf, mongo)
-
-@app.route('/', methods=['GET'])
-def get_root():
-    return jsonify({'Hello': 'World'})
-
-
-@app.route('/version', methods=['GET'])
-def get_version():
-    user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
-
-    return create_flask_response(
-        {
-            'agencyVersion': AGENCY_VERSION,
-            'cloudVersion': CLOUD_VERSION
-        },
-        auth,
-        user.authentication_cookie
-    )
-    
-cloud_routes(app, auth, cloud)
+
+def create_app(conf_file=None, conf=None):
+    """Create the cc-cloud flask app. Creating the app has no side effects:
+    the database connection is opened on first use, file systems are mounted
+    on demand and the background work starts with the first request of each worker.
+    The file systems can be mounted once before the workers are forked, see cc_cloud.startup.
+
+    :param conf_file: Path to the configuration file (yaml), defaults to None
+    :type conf_file: str, optional
+    :param conf: Loaded configuration, used instead of conf_file, defaults to None
+    :type conf: cc_agency.commons.conf.Conf, optional
+    :return: The flask app
+    :rtype: flask.Flask
+    """
+    if conf is None:
+        conf = Conf(conf_file)
+
+    app = Flask('cc-cloud')
+    app.config['UPLOAD_FOLDER'] = '/home/user/cloud'
+
+    # 'x-sendfile' lets uwsgi or the front server send downloads, 'x-accel-redirect' is used by nginx
+    app.config['DOWNLOAD_OFFLOAD'] = conf.d.get('download_offload')
+    app.config['DOWNLOAD_OFFLOAD_PREFIX'] = conf.d.get('download_offload_prefix', '/protected')
+    app.config['USE_X_SENDFILE'] = app.config['DOWNLOAD_OFFLOAD'] == 'x-sendfile'
+    # only applies to downloads that are not offloaded, offloaded downloads can be compressed by the front server
+    app.config['COMPRESSION_ENABLED'] = conf.d.get('compression_enabled', False)
+    app.config['COMPRESSION_LEVEL'] = conf.d.get('compression_level', 3)
+    app.config['COMPRESSION_THREADS'] = conf.d.get('compression_threads', 0)
+    app.config['DECOMPRESSION_MAX_RATIO'] = conf.d.get('decompression_max_ratio', 100)
+
+    mongo = LazyMongo(conf)
+    auth = Auth(conf, mongo)
+    cloud = CloudService(conf, mongo)
+
+    @app.before_request
+    def start_cloud_service():
+        cloud.start()
+
+    @app.route('/', methods=['GET'])
+    def get_root():
+        return jsonify({'Hello': 'World'})
+
+    @app.route('/version', methods=['GET'])
+    def get_version():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+
+        return create_flask_response(
+            {
+                'agencyVersion': AGENCY_VERSION,
+                'cloudVersion': CLOUD_VERSION
+            },
+            auth,
+            user.authentication_cookie
+        )
+
+    cloud_routes(app, auth, cloud)
+    return app
@@ -0,0 +1,31 @@
+import sys
+from argparse import ArgumentParser
+
+from cc_agency.commons.conf import Conf
+
+from cc_cloud.db import LazyMongo
+from cc_cloud.service.key_service import KeyService
+
+
+DESCRIPTION = "Prints the public ssh-keys of a cloud user. Used as sshd's AuthorizedKeysCommand."
+
+
+def main(argv=None):
+    parser = ArgumentParser(description=DESCRIPTION)
+    parser.add_argument(
+        '-c', '--conf-file', action='store', type=str, metavar='CONF_FILE',
+        help='CONF_FILE (yaml) as local path.'
+    )
+    parser.add_argument('ssh_user', help='Name of the local Linux user (%%u in sshd_config).')
+    args = parser.parse_args(argv)
+
+    conf = Conf(args.conf_file)
+    # sshd waits for this command on every login, so a database that is down must fail fast
+    timeout = conf.d.get('authorized_keys_mongo_timeout', 2)
+    key_service = KeyService(conf, LazyMongo(conf, server_selection_timeout=timeout))
+    for key in key_service.lookup(args.ssh_user):
+        sys.stdout.write(key + '\n')
+
+
+if __name__ == '__main__':
+    main()
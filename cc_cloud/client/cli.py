@@ -0,0 +1,52 @@
+import os
+import sys
+import json
+import getpass
+from argparse import ArgumentParser
+
+from cc_cloud.client.client import CloudClient
+
+
+DESCRIPTION = 'Transfers files between a local directory and the CC-Cloud storage of a cc-agency user.'
+
+
+def create_parser():
+    parser = ArgumentParser(description=DESCRIPTION)
+    parser.add_argument('--url', required=True, help='Base url of CC-Cloud, e.g. https://example.com:5051.')
+    parser.add_argument('--username', required=True, help='Name of the cc-agency user.')
+    parser.add_argument(
+        '--password', help='Password of the cc-agency user. Defaults to $CC_CLOUD_PASSWORD, otherwise it is prompted.'
+    )
+    parser.add_argument('--workers', type=int, default=8, help='Number of concurrent transfers.')
+    parser.add_argument('--retries', type=int, default=3, help='Number of retries of a failed request.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, help_text in (
+        ('push', 'Upload new and changed files of LOCAL to REMOTE.'),
+        ('pull', 'Download new and changed files of REMOTE to LOCAL.'),
+        ('sync', 'Transfer new and changed files in both directions, the newer file wins.'),
+    ):
+        subparser = subparsers.add_parser(command, help=help_text)
+        subparser.add_argument('local', metavar='LOCAL', help='Path of the local directory.')
+        subparser.add_argument('remote', metavar='REMOTE', nargs='?', default='', help='Path of the remote directory.')
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    password = args.password or os.environ.get('CC_CLOUD_PASSWORD') or getpass.getpass()
+
+    with CloudClient(args.url, args.username, password, workers=args.workers, retries=args.retries) as client:
+        if args.command == 'push':
+            report = client.push(args.local, args.remote)
+        elif args.command == 'pull':
+            report = client.pull(args.remote, args.local)
+        else:
+            report = client.sync(args.local, args.remote)
+
+    json.dump(report, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,481 @@
+import os
+import time
+import uuid
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 1024 * 1024
+MTIME_TOLERANCE = 0.001
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+
+class CloudClientError(Exception):
+    pass
+
+
+class TransferSlots:
+
+    def __init__(self, limit):
+        """Create a new instance of TransferSlots. The slots limit the number of concurrent
+        requests that transfer file content. The server counts each of them against the
+        transfer limit of the user, so the limit is lowered whenever the server rejects
+        a transfer with 429 Too Many Requests.
+
+        :param limit: Initial number of slots
+        :type limit: int
+        """
+        self.limit = limit
+        self.active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def reduce(self):
+        """Lowers the limit to the number of transfers the server accepted. Must be
+        called while the slot of the rejected transfer is held.
+        """
+        with self._condition:
+            self.limit = max(1, min(self.limit, self.active - 1))
+
+
+class MultipartBody:
+
+    def __init__(self, files, chunk_size=CHUNK_SIZE):
+        """Create a new instance of MultipartBody. The body is a multipart/form-data
+        request with one part per file, the files are read while the body is sent.
+        Its length is known in advance, so the request is not sent chunked.
+
+        :param files: Local path, remote path, size and mtime of each file
+        :type files: list[tuple[str, str, int, float]]
+        :param chunk_size: Number of bytes read at once, defaults to CHUNK_SIZE
+        :type chunk_size: int, optional
+        """
+        self.files = files
+        self.chunk_size = chunk_size
+        self.boundary = uuid.uuid4().hex
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self._headers = [self._part_header(remote_path, mtime) for _, remote_path, _, mtime in files]
+        self._end = f'--{self.boundary}--\r\n'.encode()
+
+    def _part_header(self, remote_path, mtime):
+        name = remote_path.replace('\\', '\\\\').replace('"', '\\"')
+        filename = posixpath.basename(name)
+        return (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n'
+            f'X-Mtime: {mtime!r}\r\n\r\n'
+        ).encode()
+
+    def __len__(self):
+        return sum(len(header) + size + 2 for header, (_, _, size, _) in zip(self._headers, self.files)) + len(self._end)
+
+    def __iter__(self):
+        for header, (local_path, _, size, _) in zip(self._headers, self.files):
+            yield header
+            with open(local_path, 'rb') as file:
+                remaining = size
+                while remaining > 0:
+                    chunk = file.read(min(self.chunk_size, remaining))
+                    if not chunk:
+                        raise CloudClientError(f'{local_path} changed while it was uploaded')
+                    remaining -= len(chunk)
+                    yield chunk
+            yield b'\r\n'
+        yield self._end
+
+
+class CloudClient:
+
+    def __init__(self, url, username, password, workers=8, retries=3, chunk_size=8 * CHUNK_SIZE,
+                 batch_size=64, timeout=60, session=None):
+        """Create a new instance of CloudClient. The client transfers files between a
+        local directory and the cloud storage of the user. All requests share a pooled
+        keep-alive session. The credentials are only sent until the server returned the
+        authentication cookie, afterwards the cookie is used. Files are transferred
+        concurrently by workers threads, files smaller than chunk_size are uploaded
+        in batches and larger files are downloaded in ranges of chunk_size bytes.
+        Each upload and each range is a transfer for the server, if it rejects
+        transfers because the user reached its limit, the client lowers its concurrency.
+
+        :param url: Base url of cc-cloud, e.g. 'https://example.com:5051'
+        :type url: str
+        :param username: Name of the cc-agency user
+        :type username: str
+        :param password: Password of the cc-agency user
+        :type password: str
+        :param workers: Number of concurrent transfers, defaults to 8
+        :type workers: int, optional
+        :param retries: Number of retries of a failed request, defaults to 3
+        :type retries: int, optional
+        :param chunk_size: Size of the download ranges and of the upload batches, defaults to 8 MiB
+        :type chunk_size: int, optional
+        :param batch_size: Maximum number of files in an upload batch, defaults to 64
+        :type batch_size: int, optional
+        :param timeout: Seconds to wait for the server, defaults to 60
+        :type timeout: float, optional
+        :param session: Session used for the requests, defaults to None (a new pooled session)
+        :type session: requests.Session, optional
+        """
+        self.url = url.rstrip('/')
+        self.credentials = (username, password)
+        self.workers = workers
+        self.retries = retries
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.timeout = timeout
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2 * workers, max_retries=0)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+        self.session = session
+        self.slots = TransferSlots(workers)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.range_executor = ThreadPoolExecutor(max_workers=workers)
+
+
+    def close(self):
+        self.executor.shutdown()
+        self.range_executor.shutdown()
+        self.session.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def request(self, method, path, data=None, slots=None, **kwargs):
+        """Sends a request and retries it, if the connection failed or the server is busy.
+
+        :param method: The http method
+        :type method: str
+        :param path: Path of the endpoint, e.g. '/file'
+        :type path: str
+        :param data: Body of the request or a function creating the body for each attempt, defaults to None
+        :type data: bytes or callable, optional
+        :param slots: Slots limiting the request, if it transfers file content, defaults to None.
+            The slot is held while the request is sent, the caller releases it after reading the response.
+        :type slots: TransferSlots, optional
+        :raises CloudClientError: if the request failed after all retries
+        :return: The response
+        :rtype: requests.Response
+        """
+        error = None
+        wait = 0
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(max(min(2 ** (attempt - 1), 30), wait))
+            if slots is not None:
+                slots.acquire()
+            accepted = False
+            try:
+                auth = None if self.session.cookies else self.credentials
+                try:
+                    response = self.session.request(
+                        method, self.url + path, auth=auth, timeout=self.timeout,
+                        data=data() if callable(data) else data, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+                    continue
+
+                if response.status_code == 401 and auth is None:
+                    # the cookie expired, the next attempt sends the credentials
+                    self.session.cookies.clear()
+                    error = CloudClientError('authentication cookie expired')
+                    continue
+                if response.status_code in RETRY_STATUS_CODES:
+                    error = CloudClientError(f'{method} {path} failed with status {response.status_code}')
+                    if response.status_code == 429 and slots is not None:
+                        slots.reduce()
+                    retry_after = response.headers.get('Retry-After', '')
+                    wait = int(retry_after) if retry_after.isdigit() else 0
+                    continue
+                if response.status_code >= 400:
+                    raise CloudClientError(f'{method} {path} failed with status {response.status_code}')
+                accepted = True
+                return response
+            finally:
+                if slots is not None and not accepted:
+                    slots.release()
+        raise CloudClientError(f'{method} {path} failed after {self.retries + 1} attempts: {error}')
+
+
+    def list_remote(self, remote_dir=''):
+        """Lists the files inside a remote directory recursively.
+
+        :param remote_dir: Path of the remote directory, defaults to '' (all files)
+        :type remote_dir: str, optional
+        :return: size and mtime of each file, by path relative to remote_dir
+        :rtype: dict
+        """
+        files = self.request('GET', '/files', params={'path': remote_dir}).json()
+        if not isinstance(files, list):
+            # the directory does not exist
+            return {}
+        prefix = remote_dir.strip('/')
+        entries = {}
+        for entry in files:
+            path = entry['path']
+            if prefix and path.startswith(prefix + '/'):
+                path = path[len(prefix) + 1:]
+            elif path == prefix:
+                path = posixpath.basename(path)
+            entries[path] = entry
+        return entries
+
+
+    def list_local(self, local_dir):
+        """Lists the files inside a local directory recursively.
+
+        :param local_dir: Path of the local directory
+        :type local_dir: str
+        :return: size and mtime of each file, by path relative to local_dir
+        :rtype: dict
+        """
+        entries = {}
+        for root, _, files in os.walk(local_dir):
+            for filename in files:
+                if filename.endswith('.cc-cloud-partial'):
+                    continue
+                filepath = os.path.join(root, filename)
+                stat = os.stat(filepath)
+                path = os.path.relpath(filepath, local_dir).replace(os.sep, '/')
+                entries[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns / 1e9}
+        return entries
+
+
+    def push(self, local_dir, remote_dir=''):
+        """Uploads the files of the local directory, that are missing or differ in the remote directory.
+
+        :param local_dir: Path of the local directory
+        :type local_dir: str
+        :param remote_dir: Path of the remote directory, defaults to ''
+        :type remote_dir: str, optional
+        :return: uploaded, downloaded and skipped paths and the error of each failed path
+        :rtype: dict
+        """
+        remote = self.list_remote(remote_dir)
+        local = self.list_local(local_dir)
+        uploads = [path for path, entry in local.items() if not is_same(entry, remote.get(path))]
+        return self.transfer(local_dir, remote_dir, local, remote, uploads, [])
+
+
+    def pull(self, remote_dir, local_dir):
+        """Downloads the files of the remote directory, that are missing or differ in the local directory.
+
+        :param remote_dir: Path of the remote directory
+        :type remote_dir: str
+        :param local_dir: Path of the local directory
+        :type local_dir: str
+        :return: uploaded, downloaded and skipped paths and the error of each failed path
+        :rtype: dict
+        """
+        remote = self.list_remote(remote_dir)
+        local = self.list_local(local_dir)
+        downloads = [path for path, entry in remote.items() if not is_same(entry, local.get(path))]
+        return self.transfer(local_dir, remote_dir, local, remote, [], downloads)
+
+
+    def sync(self, local_dir, remote_dir=''):
+        """Synchronizes the local and the remote directory in both directions. If a file
+        differs, the newer version wins. Deleted files are not synchronized.
+
+        :param local_dir: Path of the local directory
+        :type local_dir: str
+        :param remote_dir: Path of the remote directory, defaults to ''
+        :type remote_dir: str, optional
+        :return: uploaded, downloaded and skipped paths and the error of each failed path
+        :rtype: dict
+        """
+        remote = self.list_remote(remote_dir)
+        local = self.list_local(local_dir)
+        uploads, downloads = [], []
+        for path in set(local) | set(remote):
+            if is_same(local.get(path), remote.get(path)):
+                continue
+            if path not in remote or (path in local and local[path]['mtime'] >= remote[path]['mtime']):
+                uploads.append(path)
+            else:
+                downloads.append(path)
+        return self.transfer(local_dir, remote_dir, local, remote, uploads, downloads)
+
+
+    def transfer(self, local_dir, remote_dir, local, remote, uploads, downloads):
+        report = {'uploaded': [], 'downloaded': [], 'skipped': [], 'failed': {}}
+        report['skipped'] = sorted((set(local) | set(remote)) - set(uploads) - set(downloads))
+
+        # large files first, small files are packed into batches
+        uploads = sorted(uploads, key=lambda path: -local[path]['size'])
+        futures = []
+        for batch in self.create_batches(uploads, local):
+            files = [
+                (os.path.join(local_dir, path), posixpath.join(remote_dir, path), local[path]['size'], local[path]['mtime'])
+                for path in batch
+            ]
+            futures.append((batch, 'uploaded', self.executor.submit(self.upload_files, files)))
+        for path in downloads:
+            future = self.executor.submit(
+                self.download_file, posixpath.join(remote_dir, path), os.path.join(local_dir, path),
+                remote[path]['size'], remote[path]['mtime'])
+            futures.append(([path], 'downloaded', future))
+
+        for paths, action, future in futures:
+            try:
+                errors = future.result() or {}
+            except (CloudClientError, OSError, ValueError) as e:
+                errors = {posixpath.join(remote_dir, path): str(e) for path in paths}
+            for path in paths:
+                error = errors.get(posixpath.join(remote_dir, path))
+                if error:
+                    report['failed'][path] = error
+                else:
+                    report[action].append(path)
+        return report
+
+
+    def create_batches(self, paths, entries):
+        """Packs the files smaller than chunk_size into batches of at most batch_size
+        files and chunk_size bytes. Larger files are uploaded alone.
+
+        :param paths: Paths of the files, the largest first
+        :type paths: list[str]
+        :param entries: size of each file
+        :type entries: dict
+        :return: Generator yielding the paths of each batch
+        :rtype: collections.abc.Iterator[list[str]]
+        """
+        batch, batch_bytes = [], 0
+        for path in paths:
+            size = entries[path]['size']
+            if size >= self.chunk_size:
+                yield [path]
+                continue
+            if batch and (len(batch) >= self.batch_size or batch_bytes + size > self.chunk_size):
+                yield batch
+                batch, batch_bytes = [], 0
+            batch.append(path)
+            batch_bytes += size
+        if batch:
+            yield batch
+
+
+    def upload_files(self, files):
+        """Uploads the files with a single request.
+
+        :param files: Local path, remote path, size and mtime of each file
+        :type files: list[tuple[str, str, int, float]]
+        :return: The error of each remote path that was not saved
+        :rtype: dict
+        """
+        body = MultipartBody(files, CHUNK_SIZE)
+        response = self.request(
+            'PUT', '/file', data=lambda: body, slots=self.slots, headers={'Content-Type': body.content_type})
+        try:
+            results = response.json()
+        finally:
+            self.slots.release()
+        if not isinstance(results, dict):
+            raise CloudClientError(str(results))
+        errors = {}
+        for _, remote_path, _, _ in files:
+            result = results.get(remote_path, {'status': 'error', 'error': 'not saved'})
+            if result['status'] not in ('saved', 'unchanged'):
+                errors[remote_path] = result.get('error', result['status'])
+        return errors
+
+
+    def download_file(self, remote_path, local_path, size, mtime):
+        """Downloads a file. Files larger than chunk_size are downloaded in parallel ranges.
+        The file is written to a temporary file first and gets the mtime of the remote file.
+
+        :param remote_path: Path of the remote file
+        :type remote_path: str
+        :param local_path: Path of the local file
+        :type local_path: str
+        :param size: Size of the remote file
+        :type size: int
+        :param mtime: Modification time of the remote file
+        :type mtime: float
+        """
+        os.makedirs(os.path.dirname(local_path) or '.', exist_ok=True)
+        temp_path = local_path + '.cc-cloud-partial'
+        fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            if size > self.chunk_size:
+                os.ftruncate(fd, size)
+                ranges = [(start, min(start + self.chunk_size, size)) for start in range(0, size, self.chunk_size)]
+                futures = [self.range_executor.submit(self.download_range, remote_path, fd, start, end) for start, end in ranges]
+                for future in futures:
+                    future.result()
+            else:
+                self.download_range(remote_path, fd)
+        except BaseException:
+            os.close(fd)
+            os.remove(temp_path)
+            raise
+        os.close(fd)
+        mtime_ns = int(mtime * 1e9)
+        os.utime(temp_path, ns=(mtime_ns, mtime_ns))
+        os.replace(temp_path, local_path)
+
+
+    def download_range(self, remote_path, fd, start=None, end=None):
+        """Downloads the file or a range of the file and writes it at its offset.
+
+        :param remote_path: Path of the remote file
+        :type remote_path: str
+        :param fd: File descriptor of the local file
+        :type fd: int
+        :param start: First byte of the range, defaults to None (the whole file)
+        :type start: int, optional
+        :param end: End of the range (exclusive), defaults to None
+        :type end: int, optional
+        """
+        headers = {'Range': f'bytes={start}-{end - 1}'} if start is not None else {}
+        response = self.request(
+            'GET', '/file', params={'path': remote_path}, slots=self.slots, headers=headers, stream=True)
+        try:
+            with response:
+                if 'Content-Disposition' not in response.headers:
+                    raise CloudClientError(str(response.json()))
+                if start is not None and response.status_code != 206:
+                    raise CloudClientError('the server does not support range requests')
+                offset = start or 0
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+        finally:
+            self.slots.release()
+        if end is not None and offset != end:
+            raise CloudClientError(f'incomplete range of {remote_path}')
+
+
+def is_same(entry, other):
+    """Check if two files have the same size and mtime.
+
+    :param entry: size and mtime of the first file or None
+    :type entry: dict or None
+    :param other: size and mtime of the second file or None
+    :type other: dict or None
+    :return: Returns True if both files exist and are equal
+    :rtype: bool
+    """
+    return entry is not None and other is not None and entry['size'] == other['size'] \
+        and abs(entry['mtime'] - other['mtime']) < MTIME_TOLERANCE
@@ -0,0 +1,72 @@
+import threading
+
+import pymongo
+from cc_agency.commons.db import Mongo
+
+
+class LazyMongo:
+
+    def __init__(self, conf, server_selection_timeout=None):
+        """Create a new instance of LazyMongo. The connection to the database is
+        created on first use, so no client (and no monitoring thread) exists
+        before the application server forks its workers.
+
+        :param conf: Configuration to load the mongo settings from
+        :type conf: cc_agency.commons.conf.Conf
+        :param server_selection_timeout: Seconds to wait for a reachable database before an operation fails,
+        defaults to pymongo's default of 30 seconds
+        :type server_selection_timeout: float, optional
+        """
+        self.conf = conf
+        self.server_selection_timeout = server_selection_timeout
+        self._mongo = None
+        self._lock = threading.Lock()
+
+
+    def connect(self):
+        """Get the connected Mongo instance and connect on first use.
+
+        :return: The connected Mongo instance
+        :rtype: cc_agency.commons.db.Mongo
+        """
+        if self._mongo is None:
+            with self._lock:
+                if self._mongo is None:
+                    self._mongo = self._create()
+        return self._mongo
+
+
+    def _create(self):
+        if self.server_selection_timeout is None:
+            return Mongo(self.conf)
+
+        # Mongo does not accept client options, so the client is created with the same settings here
+        mongo_conf = self.conf.d['mongo']
+        mongo = Mongo.__new__(Mongo)
+        mongo.client = pymongo.MongoClient(
+            host=mongo_conf.get('host', 'localhost'),
+            port=mongo_conf.get('port', 27017),
+            username=mongo_conf['username'],
+            password=mongo_conf['password'],
+            authSource=mongo_conf['db'],
+            serverSelectionTimeoutMS=int(self.server_selection_timeout * 1000)
+        )
+        mongo.db = mongo.client[mongo_conf['db']]
+        return mongo
+
+
+    @property
+    def client(self):
+        return self.connect().client
+
+
+    @property
+    def db(self):
+        return self.connect().db
+
+
+    def __getattr__(self, name):
+        # is only called for attributes that are not defined here, e.g. write_file
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.connect(), name)
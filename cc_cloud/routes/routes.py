@@ -1,6 +1,167 @@
-from flask import request, send_file
+import os
+import mimetypes
+from urllib.parse import quote
+
+from flask import request, Response
+from werkzeug.utils import send_file
+from werkzeug.wsgi import get_input_stream
 from cc_agency.commons.helper import create_flask_response
 
+from cc_cloud.service.digest_index import HASH_FUNCTIONS
+from cc_cloud.service.fair_share import LIMIT_FIELDS, ThrottledStream
+from cc_cloud.service.compression import supported_encodings, is_compressible, compress_file, DecompressingStream
+
+
+def get_response_encoding(config, filepath):
+    """Negotiates the content encoding of a download with the Accept-Encoding header.
+    Range requests and files that are already compressed are not compressed. If downloads are
+    offloaded to the front server, they are never compressed here, the front server may compress them instead.
+
+    :param config: The configuration of the flask app
+    :type config: flask.Config
+    :param filepath: Absolute path of the file to send
+    :type filepath: str
+    :return: 'zstd', 'gzip' or None if the file is sent uncompressed
+    :rtype: str or None
+    """
+    if not config.get('COMPRESSION_ENABLED') or config.get('DOWNLOAD_OFFLOAD'):
+        return None
+    if 'Range' in request.headers or not is_compressible(filepath):
+        return None
+    return request.accept_encodings.best_match(supported_encodings())
+
+
+def create_compressed_response(filepath, encoding, config):
+    """Creates a response that compresses the file while it is sent.
+
+    :param filepath: Absolute path of the file to send
+    :type filepath: str
+    :param encoding: 'zstd' or 'gzip'
+    :type encoding: str
+    :param config: The configuration of the flask app
+    :type config: flask.Config
+    :return: A flask response object
+    """
+    mimetype = mimetypes.guess_type(filepath)[0] or 'application/octet-stream'
+    data = compress_file(filepath, encoding, config.get('COMPRESSION_LEVEL', 3), config.get('COMPRESSION_THREADS', 0))
+    response = Response(data, mimetype=mimetype)
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers.set('Content-Disposition', 'attachment', filename=os.path.basename(filepath))
+    return response
+
+
+def limit_response(response, transfer):
+    """Limits the bandwidth of a download response and holds the transfer until
+    the response is closed, also if its body is never sent (HEAD requests, 304
+    responses). Downloads offloaded to nginx are limited with the
+    X-Accel-Limit-Rate header and released immediately, so the number of concurrent
+    transfers is not limited while nginx sends them. X-Sendfile downloads are released
+    immediately as well, they are only offloaded if the user is not restricted.
+
+    :param response: The download response
+    :type response: flask.Response
+    :param transfer: The transfer of the download
+    :type transfer: cc_cloud.service.fair_share.Transfer
+    :return: The limited response
+    :rtype: flask.Response
+    """
+    if 'X-Accel-Redirect' in response.headers:
+        if transfer.is_limited:
+            response.headers['X-Accel-Limit-Rate'] = str(int(transfer.bucket.rate))
+        transfer.release()
+    elif 'X-Sendfile' in response.headers:
+        transfer.release()
+    elif transfer.scheduler is not None:
+        response.response = transfer.iterate(response.response)
+        # a passed through body is closed by the server, the close hooks only run if the response is closed
+        response.direct_passthrough = False
+        response.call_on_close(transfer.release)
+    return response
+
+
+def throttle_request(transfer):
+    """Limits the bandwidth of the current request while its body is read.
+    Must be called before the body is accessed.
+
+    :param transfer: The transfer of the upload
+    :type transfer: cc_cloud.service.fair_share.Transfer
+    """
+    if transfer.scheduler is None:
+        return
+    request.environ['wsgi.input'] = ThrottledStream(get_input_stream(request.environ), transfer)
+    request.environ['wsgi.input_terminated'] = True
+
+
+def parse_limit(value):
+    """Parses a transfer limit of a query string.
+
+    :param value: A non-negative integer or 'default'
+    :type value: str
+    :return: The limit, None for 'default'
+    :rtype: int or None
+    :raises ValueError: if the value is invalid
+    """
+    if value == 'default':
+        return None
+    return int(value)
+
+
+def decompress_request(config, max_size):
+    """Decompresses the body of the current request while it is read, if the
+    request has a Content-Encoding header. Must be called before the body is accessed.
+
+    :param config: The configuration of the flask app
+    :type config: flask.Config
+    :param max_size: Maximal number of decompressed bytes
+    :type max_size: int
+    :return: Returns False if the content encoding is not supported
+    :rtype: bool
+    """
+    encoding = request.headers.get('Content-Encoding', 'identity').strip().lower()
+    if encoding == 'identity':
+        return True
+    if encoding not in supported_encodings():
+        return False
+    
+    stream = get_input_stream(request.environ)
+    request.environ['wsgi.input'] = DecompressingStream(stream, encoding, max_size, config.get('DECOMPRESSION_MAX_RATIO'))
+    request.environ['wsgi.input_terminated'] = True
+    request.environ.pop('CONTENT_LENGTH', None)
+    return True
+
+
+def get_request_size():
+    """Gets the size of the request body for the fair share scheduler. The Content-Length of a
+    compressed body does not limit the decompressed size, so the size is unknown in this case.
+
+    :return: Number of bytes or None if unknown
+    :rtype: int or None
+    """
+    if request.headers.get('Content-Encoding', 'identity').strip().lower() != 'identity':
+        return None
+    return request.content_length
+
+
+def create_offload_response(filepath, offload_prefix, base_dir):
+    """Creates a response without body, that tells the front server (e.g. nginx) to
+    send the file itself via the X-Accel-Redirect header.
+
+    :param filepath: Absolute path of the file to send
+    :type filepath: str
+    :param offload_prefix: Internal location of the front server that serves base_dir
+    :type offload_prefix: str
+    :param base_dir: Directory that is served by the internal location
+    :type base_dir: str
+    :return: A flask response object
+    """
+    relative_path = os.path.relpath(filepath, base_dir)
+    mimetype = mimetypes.guess_type(filepath)[0] or 'application/octet-stream'
+    response = Response(mimetype=mimetype)
+    response.headers['X-Accel-Redirect'] = quote(offload_prefix.rstrip('/') + '/' + relative_path)
+    response.headers.set('Content-Disposition', 'attachment', filename=os.path.basename(filepath))
+    return response
+
 
 def cloud_routes(app, auth, cloud_service):
     """
@@ -9,6 +170,8 @@ def cloud_routes(app, auth, cloud_service):
     :param app: The flask app to attach to
     :param auth: The authorization module to use
     :type auth: Auth
+    :param cloud_service: The cloud service to use
+    :type cloud_service: cc_cloud.service.cloud_service.CloudService
     """
     
     @app.route('/file', methods=['GET'])
@@ -22,7 +185,48 @@ def cloud_routes(app, auth, cloud_service):
             return create_flask_response("invalid path", auth, user.authentication_cookie)
         
         try:
-            return send_file(file, as_attachment=True)
+            if os.path.isfile(file):
+                transfer = cloud_service.start_transfer(user, 'download', os.path.getsize(file))
+                try:
+                    response = send_download(user, file, transfer)
+                except BaseException:
+                    transfer.release()
+                    raise
+                response = limit_response(response, transfer)
+            else:
+                response = send_download(user, file)
+        except BaseException:
+            cloud_service.release_filesystem(user)
+            raise
+        
+        # the filesystem stays mounted until the response is closed, the close hooks only run without passthrough
+        response.direct_passthrough = False
+        response.call_on_close(lambda: cloud_service.release_filesystem(user))
+        return response
+    
+    
+    def send_download(user, file, transfer=None):
+        offload = app.config.get('DOWNLOAD_OFFLOAD')
+        use_x_sendfile = app.config.get('USE_X_SENDFILE', False)
+        if use_x_sendfile and transfer is not None and transfer.is_restricted:
+            # uwsgi ignores the limits of X-Sendfile downloads, they are sent and limited here
+            use_x_sendfile = False
+        encoding = get_response_encoding(app.config, file)
+        if offload or encoding:
+            if os.path.isdir(file):
+                return create_flask_response("cannot download directorys", auth, user.authentication_cookie)
+            if not os.path.isfile(file):
+                return create_flask_response("file not found", auth, user.authentication_cookie)
+            if encoding:
+                return create_compressed_response(file, encoding, app.config)
+            if offload == 'x-accel-redirect':
+                return create_offload_response(file, app.config['DOWNLOAD_OFFLOAD_PREFIX'], cloud_service.home_dir)
+        
+        try:
+            return send_file(
+                file, request.environ, as_attachment=True, use_x_sendfile=use_x_sendfile,
+                response_class=app.response_class, max_age=app.get_send_file_max_age
+            )
         except FileNotFoundError:
             return create_flask_response("file not found", auth, user.authentication_cookie)
         except IsADirectoryError:
@@ -33,9 +237,85 @@ def cloud_routes(app, auth, cloud_service):
     def upload_file():
         user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
         
-        cloud_service.upload_file(user, request.files)
+        with cloud_service.start_transfer(user, 'upload', get_request_size()) as transfer:
+            throttle_request(transfer)
+            if not decompress_request(app.config, cloud_service.get_free_size(user)):
+                return create_flask_response("unsupported content encoding", auth, user.authentication_cookie)
+            
+            saved = cloud_service.upload_file(user, request.files)
+        
+        return create_flask_response(saved, auth, user.authentication_cookie)
+    
+    
+    @app.route('/file/signature', methods=['GET'])
+    def get_signature():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        path = request.args.get('path')
+        block_size = request.args.get('block_size', type=int)
+        
+        signature = cloud_service.get_signature(user, path, block_size)
+        if signature is None:
+            return create_flask_response("file not found", auth, user.authentication_cookie)
         
-        return create_flask_response("ok", auth, user.authentication_cookie)
+        return create_flask_response(signature, auth, user.authentication_cookie)
+    
+    
+    @app.route('/file/delta', methods=['PUT'])
+    def upload_delta():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        path = request.args.get('path')
+        block_size = request.args.get('block_size', type=int)
+        expected_digests = {
+            algorithm: request.args[algorithm] for algorithm in HASH_FUNCTIONS if algorithm in request.args
+        }
+        
+        with cloud_service.start_transfer(user, 'upload', get_request_size()) as transfer:
+            throttle_request(transfer)
+            if not decompress_request(app.config, cloud_service.get_free_size(user)):
+                return create_flask_response("unsupported content encoding", auth, user.authentication_cookie)
+            
+            digests = cloud_service.upload_delta(user, path, request.stream, block_size, expected_digests)
+        if digests is None:
+            return create_flask_response("invalid delta", auth, user.authentication_cookie)
+        
+        return create_flask_response({'status': 'saved', 'digests': digests}, auth, user.authentication_cookie)
+    
+    
+    @app.route('/files', methods=['GET'])
+    def list_files():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        path = request.args.get('path', '')
+        
+        files = cloud_service.list_files(user, path)
+        if files is None:
+            return create_flask_response("invalid path", auth, user.authentication_cookie)
+        
+        return create_flask_response(files, auth, user.authentication_cookie)
+    
+    
+    @app.route('/files/check', methods=['POST'])
+    def check_files():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        entries = request.get_json(silent=True)
+        
+        if not isinstance(entries, list):
+            return create_flask_response("invalid request", auth, user.authentication_cookie)
+        
+        results = cloud_service.check_files(user, entries)
+        
+        return create_flask_response(results, auth, user.authentication_cookie)
+    
+    
+    @app.route('/checksum', methods=['GET'])
+    def get_checksum():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        path = request.args.get('path')
+        
+        digests = cloud_service.get_checksum(user, path)
+        if digests is None:
+            return create_flask_response("file not found", auth, user.authentication_cookie)
+        
+        return create_flask_response(digests, auth, user.authentication_cookie)
     
     
     @app.route('/file', methods=['DELETE'])
@@ -49,6 +329,43 @@ def cloud_routes(app, auth, cloud_service):
         return create_flask_response(response_string, auth, user.authentication_cookie)
     
     
+    @app.route('/authorized_keys', methods=['GET'])
+    def get_authorized_keys():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        
+        keys = cloud_service.get_authorized_keys(user)
+        
+        return create_flask_response(keys, auth, user.authentication_cookie)
+    
+    
+    @app.route('/authorized_keys', methods=['POST'])
+    def add_authorized_key():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        data = request.get_json(silent=True)
+        
+        if not isinstance(data, dict) or not isinstance(data.get('key'), str):
+            return create_flask_response("invalid request", auth, user.authentication_cookie)
+        
+        added = cloud_service.set_local_user_authorized_key(user, data['key'])
+        response_string = 'key added' if added else 'could not add key'
+        
+        return create_flask_response(response_string, auth, user.authentication_cookie)
+    
+    
+    @app.route('/authorized_keys', methods=['DELETE'])
+    def remove_authorized_key():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        data = request.get_json(silent=True)
+        
+        if not isinstance(data, dict) or not isinstance(data.get('key'), str):
+            return create_flask_response("invalid request", auth, user.authentication_cookie)
+        
+        removed = cloud_service.remove_authorized_key(user, data['key'])
+        response_string = 'key removed' if removed else 'key not found'
+        
+        return create_flask_response(response_string, auth, user.authentication_cookie)
+    
+    
     @app.route('/create_user', methods=['GET'])
     def create_user():
         user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
@@ -69,4 +386,116 @@ def cloud_routes(app, auth, cloud_service):
         response_string = 'user removed' if removed else 'could not remove user'
         
         return create_flask_response(response_string, auth, user.authentication_cookie)
-        
\ No newline at end of file
+    
+    
+    @app.route('/resize_user', methods=['GET'])
+    def resize_user():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        resize_username = request.args.get('username')
+        size = request.args.get('size', type=int)
+        
+        resized = cloud_service.resize_user(user, resize_username, size)
+        response_string = 'user resized' if resized else 'could not resize user'
+        
+        return create_flask_response(response_string, auth, user.authentication_cookie)
+    
+    
+    @app.route('/transfer_limits', methods=['GET'])
+    def set_transfer_limits():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        limits_username = request.args.get('username')
+        
+        try:
+            limits = {field: parse_limit(request.args[field]) for field in LIMIT_FIELDS if field in request.args}
+        except ValueError:
+            return create_flask_response('invalid limit', auth, user.authentication_cookie)
+        
+        changed = cloud_service.set_transfer_limits(user, limits_username, limits)
+        response_string = 'transfer limits changed' if changed else 'could not change transfer limits'
+        
+        return create_flask_response(response_string, auth, user.authentication_cookie)
+    
+    
+    @app.route('/transfer_metrics', methods=['GET'])
+    def transfer_metrics():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        
+        metrics = cloud_service.transfer_metrics(user)
+        if metrics is None:
+            return create_flask_response('could not get transfer metrics', auth, user.authentication_cookie)
+        
+        return create_flask_response(metrics, auth, user.authentication_cookie)
+    
+    
+    @app.route('/trim_filesystems', methods=['GET'])
+    def trim_filesystems():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        
+        trimmed = cloud_service.trim_filesystems(user)
+        if trimmed is None:
+            return create_flask_response('could not trim filesystems', auth, user.authentication_cookie)
+        
+        return create_flask_response(trimmed, auth, user.authentication_cookie)
+    
+    
+    @app.route('/storage_report', methods=['GET'])
+    def storage_report():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        
+        report = cloud_service.storage_report(user)
+        if report is None:
+            return create_flask_response('could not create storage report', auth, user.authentication_cookie)
+        
+        return create_flask_response(report, auth, user.authentication_cookie)
+    
+    
+    @app.route('/backup', methods=['GET'])
+    def backup():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        backup_username = request.args.get('username')
+        incremental = request.args.get('full', 'false').lower() != 'true'
+        
+        result = cloud_service.backup(user, backup_username, incremental)
+        if result is None:
+            return create_flask_response('could not create backup', auth, user.authentication_cookie)
+        
+        return create_flask_response(result, auth, user.authentication_cookie)
+    
+    
+    @app.route('/backup/archive', methods=['GET'])
+    def backup_archive():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        backup_username = request.args.get('username')
+        
+        archive = cloud_service.backup_archive(user, backup_username)
+        if archive is None:
+            return create_flask_response('could not create backup archive', auth, user.authentication_cookie)
+        
+        response = Response(archive, mimetype='application/gzip')
+        response.headers.set('Content-Disposition', 'attachment', filename=f'{backup_username}.tar.gz')
+        return response
+    
+    
+    @app.route('/restore', methods=['GET'])
+    def restore():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        restore_username = request.args.get('username')
+        
+        restored = cloud_service.restore(user, restore_username)
+        response_string = 'user restored' if restored else 'could not restore user'
+        
+        return create_flask_response(response_string, auth, user.authentication_cookie)
+    
+    
+    @app.route('/reconcile', methods=['GET'])
+    def reconcile():
+        user = auth.verify_user(request.authorization, request.cookies, request.remote_addr)
+        
+        if request.args.get('run') == 'true':
+            report = cloud_service.reconcile(user)
+        else:
+            report = cloud_service.reconcile_report(user)
+        if report is None:
+            return create_flask_response('no reconcile report available', auth, user.authentication_cookie)
+        
+        return create_flask_response(report, auth, user.authentication_cookie)
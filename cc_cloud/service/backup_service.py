@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import errno
+import logging
+import threading
+import subprocess
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def iter_data_ranges(fd, size):
+    """Get the allocated extents of a sparse file with SEEK_DATA and SEEK_HOLE.
+    If the filesystem does not support seeking for data, the whole file is returned.
+
+    :param fd: File descriptor of the file
+    :type fd: int
+    :param size: Size of the file
+    :type size: int
+    :return: Generator yielding the offset and the length of each extent
+    :rtype: collections.abc.Iterator[tuple[int, int]]
+    """
+    offset = 0
+    while offset < size:
+        try:
+            data = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # no data after offset, the rest of the file is a hole
+                return
+            if e.errno == errno.EINVAL and offset == 0:
+                yield 0, size
+                return
+            raise
+        hole = os.lseek(fd, data, os.SEEK_HOLE)
+        yield data, hole - data
+        offset = hole
+
+
+def copy_range(src_fd, dst_fd, offset, length):
+    """Copies a range of a file to the same offset of another file. copy_file_range
+    is used if possible, so the data does not pass through user space.
+
+    :param src_fd: File descriptor of the source file
+    :type src_fd: int
+    :param dst_fd: File descriptor of the destination file
+    :type dst_fd: int
+    :param offset: Offset of the range
+    :type offset: int
+    :param length: Length of the range
+    :type length: int
+    """
+    end = offset + length
+    while offset < end:
+        count = min(end - offset, 64 * CHUNK_SIZE)
+        try:
+            copied = os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+        except (AttributeError, OSError) as e:
+            if isinstance(e, OSError) and e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL):
+                raise
+            copied = os.pwrite(dst_fd, os.pread(src_fd, min(count, CHUNK_SIZE), offset), offset)
+        if copied == 0:
+            break
+        offset += copied
+
+
+def copy_sparse(src_path, dst_path):
+    """Copies a file without reading or writing its holes. The copy is written to a
+    hidden temporary file next to dst_path first and gets the modification time of the source.
+
+    :param src_path: Path to the source file
+    :type src_path: str
+    :param dst_path: Path to the copy
+    :type dst_path: str
+    """
+    temp_path = os.path.join(os.path.dirname(dst_path), '.' + os.path.basename(dst_path) + '.partial')
+    src_fd = os.open(src_path, os.O_RDONLY)
+    try:
+        stat = os.fstat(src_fd)
+        dst_fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(dst_fd, stat.st_size)
+            for offset, length in iter_data_ranges(src_fd, stat.st_size):
+                copy_range(src_fd, dst_fd, offset, length)
+            os.fsync(dst_fd)
+        finally:
+            os.close(dst_fd)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    finally:
+        os.close(src_fd)
+    os.utime(temp_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(temp_path, dst_path)
+
+
+class BackupService:
+
+    def __init__(self, conf, filesystem_service, mount_manager):
+        """Create a new instance of BackupService. The service copies the filesystem
+        images of the users into the backup directory. Only the allocated extents of
+        the images are copied and the copies stay sparse.
+
+        :param conf: Configuration to load values from
+        :type conf: cc_agency.commons.conf.Conf
+        :param filesystem_service: The service that manages the images
+        :type filesystem_service: cc_cloud.service.filesystem_service.FilesystemService
+        :param mount_manager: The manager that mounts the images
+        :type mount_manager: cc_cloud.service.mount_manager.MountManager
+        """
+        self.filesystem_service = filesystem_service
+        self.mount_manager = mount_manager
+        self.backup_dir = conf.d.get('backup_directory', '/var/lib/cc_cloud/backups')
+        self.workers = conf.d.get('backup_workers', 2)
+        self._manifest_lock = threading.Lock()
+
+
+    def get_backup_path(self, fs_name):
+        """Get the path to the backup of the filesystem.
+
+        :param fs_name: Name of the filesystem
+        :type fs_name: str
+        :return: Path to the backup
+        :rtype: str
+        """
+        return os.path.join(self.backup_dir, fs_name)
+
+
+    def read_manifest(self):
+        """Get the source size and mtime of each backup.
+
+        :return: size, mtime_ns and time of the backup for each filesystem
+        :rtype: dict
+        """
+        try:
+            with open(os.path.join(self.backup_dir, 'manifest.json')) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+
+    def update_manifest(self, fs_name, entry):
+        with self._manifest_lock:
+            manifest = self.read_manifest()
+            manifest[fs_name] = entry
+            manifest_path = os.path.join(self.backup_dir, 'manifest.json')
+            with open(manifest_path + '.partial', 'w') as file:
+                json.dump(manifest, file)
+            os.replace(manifest_path + '.partial', manifest_path)
+
+
+    @contextmanager
+    def freeze(self, fs_name):
+        """Keeps the mounted filesystem in a consistent state. The filesystem is frozen
+        with fsfreeze, if this fails it is remounted read-only.
+
+        :param fs_name: Name of the filesystem
+        :type fs_name: str
+        :raises OSError: if the filesystem could neither be frozen nor remounted read-only
+        """
+        if not self.filesystem_service.is_mounted(fs_name):
+            yield
+            return
+
+        mountpoint = self.filesystem_service.get_mountpoint(fs_name)
+        if os.system(f"fsfreeze -f '{mountpoint}'") == 0:
+            try:
+                yield
+            finally:
+                os.system(f"fsfreeze -u '{mountpoint}'")
+        else:
+            if os.system(f"mount -o remount,ro '{mountpoint}'") != 0:
+                raise OSError(f'could not freeze {fs_name}')
+            try:
+                yield
+            finally:
+                os.system(f"mount -o remount,rw '{mountpoint}'")
+
+
+    def backup(self, fs_name, incremental=True):
+        """Copies the image of the filesystem into the backup directory.
+
+        :param fs_name: Name of the filesystem
+        :type fs_name: str
+        :param incremental: Skip the image if it did not change since the last backup, defaults to True
+        :type incremental: bool, optional
+        :return: 'copied', 'unchanged' or 'failed'
+        :rtype: str
+        """
+        filepath = self.filesystem_service.get_filepath(fs_name)
+        os.makedirs(self.backup_dir, exist_ok=True)
+        try:
+            with self.filesystem_service.lock(fs_name), self.freeze(fs_name):
+                stat = os.stat(filepath)
+                entry = self.read_manifest().get(fs_name)
+                if incremental and entry and os.path.isfile(self.get_backup_path(fs_name)) \
+                        and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                    return 'unchanged'
+                copy_sparse(filepath, self.get_backup_path(fs_name))
+        except Exception:
+            logger.exception(f'backup of {fs_name} failed')
+            return 'failed'
+
+        self.update_manifest(fs_name, {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'time': time.time()})
+        return 'copied'
+
+
+    def backup_all(self, incremental=True):
+        """Copies the images of all filesystems on a bounded pool of backup_workers threads.
+
+        :param incremental: Skip images that did not change since the last backup, defaults to True
+        :type incremental: bool, optional
+        :return: 'copied', 'unchanged' or 'failed' for each filesystem
+        :rtype: dict
+        """
+        filesystems = self.filesystem_service.find_all_filesystems()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = executor.map(lambda fs_name: self.backup(fs_name, incremental), filesystems)
+            return dict(zip(filesystems, results))
+
+
+    def restore(self, fs_name):
+        """Replaces the image of the filesystem with its backup. The filesystem is
+        unmounted during the restore and mounted afterwards, mounting sets the
+        ownership of the image and the mountpoint with set_directory_owner.
+        If the filesystem can't be unmounted (e.g. a download still reads from it),
+        the image is not replaced.
+
+        :param fs_name: Name of the filesystem
+        :type fs_name: str
+        :return: Returns False if no backup exists or the filesystem is in use or busy
+        :rtype: bool
+        """
+        backup_path = self.get_backup_path(fs_name)
+        if not os.path.isfile(backup_path):
+            return False
+
+        with self.filesystem_service.lock(fs_name):
+            if self.filesystem_service.is_in_use(fs_name):
+                return False
+            self.mount_manager.forget(fs_name)
+            if self.filesystem_service.is_mounted(fs_name):
+                self.filesystem_service.umount(fs_name)
+                if self.filesystem_service.is_mounted(fs_name):
+                    # track the mount again, so it is counted and unmounted when idle
+                    self.mount_manager.acquire(fs_name)
+                    return False
+            copy_sparse(backup_path, self.filesystem_service.get_filepath(fs_name))
+            self.mount_manager.acquire(fs_name)
+        return True
+
+
+    def stream_archive(self, fs_name):
+        """Streams a gzip compressed tar archive of the backup of the filesystem.
+        The image is stored as a sparse file in the archive.
+
+        :param fs_name: Name of the filesystem
+        :type fs_name: str
+        :return: Generator yielding the archive
+        :rtype: collections.abc.Iterator[bytes]
+        """
+        process = subprocess.Popen(
+            ['tar', '-S', '-czf', '-', '-C', self.backup_dir, fs_name],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            for chunk in iter(lambda: process.stdout.read(CHUNK_SIZE), b''):
+                yield chunk
+        finally:
+            process.stdout.close()
+            if process.poll() is None:
+                process.kill()
+            process.wait()
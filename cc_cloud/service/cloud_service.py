@@ -1,6 +1,14 @@
+import threading
 
 from cc_cloud.service.filesystem_service import FilesystemService
+from cc_cloud.service.directory_filesystem_service import DirectoryFilesystemService
 from cc_cloud.service.file_service import FileService
+from cc_cloud.service.digest_index import DigestIndex
+from cc_cloud.service.mount_manager import MountManager
+from cc_cloud.service.reconciler import Reconciler
+from cc_cloud.service.key_service import KeyService
+from cc_cloud.service.fair_share import FairShareScheduler, LIMIT_FIELDS
+from cc_cloud.service.backup_service import BackupService
 from cc_cloud.system.local_user import LocalUser
 from cc_agency.broker.auth import Auth
 
@@ -9,28 +17,75 @@ class CloudService:
     
     file_service: FileService
     filesystem_service: FilesystemService
+    mount_manager: MountManager
+    reconciler: Reconciler
+    key_service: KeyService
+    fair_share: FairShareScheduler
+    backup_service: BackupService
     
     user_prefix = 'cloud'
     
+    storage_backends = {
+        'loop': FilesystemService,
+        'directory': DirectoryFilesystemService,
+    }
+    
     def __init__(self, conf, mongo):
-        """Create a new instance of CloudService.
-        All existing file systems of the user are automatically mounted.
+        """Create a new instance of CloudService. Creating the instance has no
+        side effects: file systems are mounted on demand, by mount_filesystems
+        (usually called once by cc_cloud.startup) and the background work is
+        started by start.
 
         :param conf: Configuration to load values from
         :type conf: cc_agency.commons.conf.Conf
+        :param mongo: The database, usually a cc_cloud.db.LazyMongo
+        :type mongo: cc_agency.commons.db.Mongo
         """
-        self.file_service = FileService(conf)
-        self.filesystem_service = FilesystemService(conf)
+        storage_backend = self.storage_backends[conf.d.get('storage_backend', 'loop')]
+        self.filesystem_service = storage_backend(conf)
+        self.digest_index = DigestIndex(conf.d.get('digest_index_file', '/var/lib/cc_cloud/digests.sqlite'))
+        self.file_service = FileService(conf, self.filesystem_service, self.digest_index)
+        self.mount_manager = MountManager(
+            self.filesystem_service,
+            conf.d.get('max_mounted_filesystems'),
+            conf.d.get('mount_idle_timeout'))
+        self.backup_service = BackupService(conf, self.filesystem_service, self.mount_manager)
         self.home_dir = conf.d.get('userhome_directory', '/var/lib/cc_cloud/home')
         self.mongo = mongo
-        self.mount_filesystems()
+        self.key_service = KeyService(conf, mongo)
+        self.fair_share = FairShareScheduler(conf, mongo)
+        self.provisioned = set()
+        self.reconciler = Reconciler(
+            self,
+            conf.d.get('reconcile_interval', 300),
+            conf.d.get('reconcile_delete_orphans', False))
+        self._started = False
+        self._start_lock = threading.Lock()
+    
+    
+    def start(self):
+        """Prepare the service in the current worker process. The file systems that are
+        already mounted are tracked by the mount manager and the reconciler is started.
+        Only the first call has an effect.
+        """
+        if self._started:
+            return
+        with self._start_lock:
+            if self._started:
+                return
+            mounted = set(self.filesystem_service.find_mounted_filesystems())
+            self.mount_manager.adopt(sorted(mounted))
+            self.reconciler.start()
+            self._started = True
     
     
     def mount_filesystems(self):
-        """Mount all existing file systems of the users.
+        """Mount all existing file systems of the users, up to max_mounted_filesystems.
         """
         for fs in self.filesystem_service.find_all_filesystems():
-            self.filesystem_service.exists_or_create(fs)
+            if not self.mount_manager.has_capacity():
+                break
+            self.mount_manager.acquire(fs)
     
     
     def get_user_ref(self, user):
@@ -77,24 +132,57 @@ class CloudService:
     
     ## cloud storage actions
     
-    def file_action(self, user, func, *args):
+    def file_action(self, user, func, *args, keep_pinned=False):
         """Check if the local user and the filesystem exists. If not create
         the user and the filesystem. Then execute the given functions.
+        If the reconciler runs in the background, it repairs drift, so users
+        that were already checked (or verified by the reconciler) and filesystems
+        tracked by the mount manager are not checked again. Otherwise both are
+        checked on every request. The filesystem is pinned in the mount manager
+        while func runs, so it is not unmounted by other requests.
 
         :param user: the user for whom the file action is executed
         :type user: cc_agency.broker.auth.Auth.User
         :param func: the function to be executed
         :type func: callable
+        :param keep_pinned: Keep the filesystem pinned if func returns a result, the caller
+        must call release_filesystem afterwards, defaults to False
+        :type keep_pinned: bool, optional
         :return: result of the method func
         """
-        user_ref, _ = self.local_user_exists_or_create(user)
-        self.filesystem_service.exists_or_create(user_ref)
-        return func(user_ref, *args)
+        user_ref = self.get_user_ref(user)
+        reconciled = bool(self.reconciler.interval)
+        if user_ref not in self.provisioned:
+            self.local_user_exists_or_create(user)
+            if reconciled:
+                self.provisioned.add(user_ref)
+        with self.filesystem_service.lock(user_ref):
+            if not reconciled and not self.filesystem_service.is_mounted(user_ref):
+                self.mount_manager.forget(user_ref)
+            self.mount_manager.acquire(user_ref, pin=True)
+        result = None
+        try:
+            result = func(user_ref, *args)
+        finally:
+            if not (keep_pinned and result):
+                self.mount_manager.unpin(user_ref)
+        return result
+    
+    
+    def release_filesystem(self, user):
+        """Release the filesystem of the user that was kept pinned by a file action,
+        e.g. after a download was sent.
+
+        :param user: the user whose filesystem is released
+        :type user: cc_agency.broker.auth.Auth.User
+        """
+        self.mount_manager.unpin(self.get_user_ref(user))
     
     
     def download_file(self, user, path):
         """Checks if the user is allowed to access the file. If the path is available and
-        the user is allowed the access, the absolute filepath will be returned.
+        the user is allowed the access, the absolute filepath will be returned. The filesystem
+        stays mounted until release_filesystem is called, so the file can be sent.
 
         :param user: The user that wants to access the file
         :type user: cc_agency.broker.auth.Auth.User
@@ -103,7 +191,24 @@ class CloudService:
         :return: Absolute filepath
         :rtype: str
         """
-        return self.file_action(user, self.file_service.download_file, path)
+        return self.file_action(user, self.file_service.download_file, path, keep_pinned=True)
+    
+    
+    def start_transfer(self, user, direction, size=None):
+        """Start an upload or download of the user. The number of concurrent transfers
+        and the bandwidth of each user are limited by the fair share scheduler.
+
+        :param user: The user that transfers data
+        :type user: cc_agency.broker.auth.Auth.User
+        :param direction: 'upload' or 'download'
+        :type direction: str
+        :param size: Number of bytes if known in advance, defaults to None
+        :type size: int, optional
+        :raises werkzeug.exceptions.TooManyRequests: if the user reached the limit of concurrent transfers
+        :return: The transfer, must be released when it is done
+        :rtype: cc_cloud.service.fair_share.Transfer
+        """
+        return self.fair_share.start(user.username, direction, size)
     
     
     def upload_file(self, user, files):
@@ -113,8 +218,94 @@ class CloudService:
         :type user: cc_agency.broker.auth.Auth.User
         :param files: One or multiple files that should be saved
         :type files: werkzeug.datastructures.structures.ImmutableMultiDict
+        :return: Status and digests of each saved file
+        :rtype: dict
+        """
+        return self.file_action(user, self.file_service.upload_file, files)
+    
+    
+    def check_files(self, user, entries):
+        """Checks which files of the user already exist with the expected size and digests.
+
+        :param user: The user that wants to check the files
+        :type user: cc_agency.broker.auth.Auth.User
+        :param entries: Entries containing path, optional size and a hex digest
+        :type entries: list[dict]
+        :return: path and status for each entry
+        :rtype: list[dict]
+        """
+        return self.file_action(user, self.file_service.check_files, entries)
+    
+    
+    def get_signature(self, user, path, block_size=None):
+        """Get the block signature of a file of the user for a delta upload.
+
+        :param user: The user that wants to get the signature
+        :type user: cc_agency.broker.auth.Auth.User
+        :param path: Path to the file
+        :type path: str
+        :param block_size: Block size of the signature, defaults to None
+        :type block_size: int, optional
+        :return: The signature or None if the path is invalid or no file
+        :rtype: dict or None
+        """
+        return self.file_action(user, self.file_service.get_signature, path, block_size)
+    
+    
+    def upload_delta(self, user, path, delta, block_size, expected_digests=None):
+        """Reconstructs a new version of a file of the user from a delta.
+
+        :param user: The user that uploads the delta
+        :type user: cc_agency.broker.auth.Auth.User
+        :param path: Path to the file
+        :type path: str
+        :param delta: Binary stream with the delta
+        :type delta: io.RawIOBase
+        :param block_size: Block size of the signature the delta is based on
+        :type block_size: int
+        :param expected_digests: Digests the new version must have, defaults to None
+        :type expected_digests: dict, optional
+        :return: Digests of the new version or None if the delta was not applied
+        :rtype: dict or None
+        """
+        return self.file_action(user, self.file_service.upload_delta, path, delta, block_size, expected_digests)
+    
+    
+    def list_files(self, user, path=''):
+        """Lists the files inside a directory of the user recursively.
+
+        :param user: The user whose files are listed
+        :type user: cc_agency.broker.auth.Auth.User
+        :param path: Path to a directory or a file, defaults to '' (all files)
+        :type path: str, optional
+        :return: path, size and mtime of each file, None if the path is invalid or does not exist
+        :rtype: list[dict] or None
+        """
+        return self.file_action(user, self.file_service.list_files, path)
+    
+    
+    def get_free_size(self, user):
+        """Get the space left in the storage of the user.
+
+        :param user: The user whose storage is checked
+        :type user: cc_agency.broker.auth.Auth.User
+        :return: Free space in bytes
+        :rtype: int
+        """
+        return self.file_action(user, self.filesystem_service.get_free_size)
+    
+    
+    def get_checksum(self, user, path):
+        """Get the digests of a file of the user.
+
+        :param user: The user that wants to get the checksum
+        :type user: cc_agency.broker.auth.Auth.User
+        :param path: Path to the file
+        :type path: str
+        :return: Digests of the file or None if the path is invalid or no file
+        :rtype: dict or None
         """
-        self.file_action(user, self.file_service.upload_file, files)
+        return self.file_action(user, self.file_service.get_checksum, path)
     
     
     def delete_file(self, user, path):
@@ -134,15 +325,42 @@ class CloudService:
     
     def set_local_user_authorized_key(self, user, pub_key):
         """Check if the user exists. If not create the user.
-        Then add the public ssh-key to the users authorized_keys file.
+        Then add the public ssh-key to the keys of the user.
 
         :param user: user for whom the ssh-key will be added
         :type user: cc_agency.broker.auth.Auth.User
-        :param pub_key: public ssh-key, that will be added to the authorized_keys file
+        :param pub_key: public ssh-key, that will be added to the keys of the user
+        :type pub_key: str
+        :return: Returns False if the key is invalid or the user has too many keys
+        :rtype: bool
+        """
+        user_ref, _ = self.local_user_exists_or_create(user)
+        self.provisioned.add(user_ref)
+        return self.key_service.add_key(user.username, user_ref, pub_key)
+    
+    
+    def get_authorized_keys(self, user):
+        """Get the public ssh-keys of the user.
+
+        :param user: user whose keys are returned
+        :type user: cc_agency.broker.auth.Auth.User
+        :return: The public ssh-keys
+        :rtype: list[str]
+        """
+        return self.key_service.get_keys(user.username)
+    
+    
+    def remove_authorized_key(self, user, pub_key):
+        """Remove the public ssh-key from the keys of the user.
+
+        :param user: user whose key will be removed
+        :type user: cc_agency.broker.auth.Auth.User
+        :param pub_key: public ssh-key to remove
         :type pub_key: str
+        :return: Returns False if the user has no such key
+        :rtype: bool
         """
-        _, local_user = self.local_user_exists_or_create(user)
-        local_user.set_authorized_key(pub_key)
+        return self.key_service.remove_key(user.username, self.get_user_ref(user), pub_key)
     
     
     ## only for admin users
@@ -153,11 +371,233 @@ class CloudService:
         
         create_user = Auth.User(create_username, False)
         user_ref, _ = self.local_user_exists_or_create(create_user)
-        self.filesystem_service.exists_or_create(user_ref)
+        self.mount_manager.acquire(user_ref)
+        
+        return True
+    
+    
+    def resize_user(self, user, resize_username, size):
+        """Resize the filesystem of the user (resize_username) and store the
+        new size as size_limit of the user. If the filesystem was mounted and
+        the resize unmounted it, it is mounted again through the mount manager.
+        The action will only be performed if user is admin.
+
+        :param user: user who wants to perform the action
+        :type user: cc_agency.broker.auth.Auth.User
+        :param resize_username: the user whose filesystem will be resized
+        :type resize_username: str
+        :param size: new size of the filesystem in bytes
+        :type size: int
+        :return: if succeded returns true, otherwise false
+        :rtype: bool
+        """
+        if not user.is_admin or not size or size <= 0:
+            return False
+        
+        resize_user = Auth.User(resize_username, False)
+        user_ref = self.get_user_ref(resize_user)
+        
+        # requests of the user wait until the filesystem is mounted again
+        with self.filesystem_service.lock(user_ref):
+            was_mounted = self.filesystem_service.is_mounted(user_ref)
+            resized = self.filesystem_service.resize(user_ref, size)
+            if was_mounted and not self.filesystem_service.is_mounted(user_ref):
+                self.mount_manager.forget(user_ref)
+                self.mount_manager.acquire(user_ref)
+        if not resized:
+            return False
+        
+        self.mongo.db['cloud_users'].update_one(
+            {'username': resize_user.username},
+            {'$set': {'size_limit': size}}
+        )
+        return True
+    
+    
+    def set_transfer_limits(self, user, limits_username, limits):
+        """Override the transfer limits of the user (limits_username). The overrides are
+        stored next to the size_limit of the user. A value of None removes the override,
+        a value of 0 removes the limit.
+        The action will only be performed if user is admin.
+
+        :param user: user who wants to perform the action
+        :type user: cc_agency.broker.auth.Auth.User
+        :param limits_username: the user whose limits are changed
+        :type limits_username: str
+        :param limits: new values of max_transfers, upload_rate_limit and download_rate_limit
+        :type limits: dict
+        :return: if succeded returns true, otherwise false
+        :rtype: bool
+        """
+        if not user.is_admin or not limits_username or not limits or not set(limits) <= set(LIMIT_FIELDS):
+            return False
+        
+        update = {}
+        values = {field: value for field, value in limits.items() if value is not None}
+        removed = {field: '' for field, value in limits.items() if value is None}
+        if any(value < 0 for value in values.values()):
+            return False
+        if values:
+            update['$set'] = values
+        if removed:
+            update['$unset'] = removed
+        
+        self.mongo.db['cloud_users'].update_one({'username': limits_username}, update)
+        self.fair_share.invalidate(limits_username)
+        return True
+    
+    
+    def transfer_metrics(self, user):
+        """Get the throttling metrics of the fair share scheduler.
+        The action will only be performed if user is admin.
+
+        :param user: user who wants to perform the action
+        :type user: cc_agency.broker.auth.Auth.User
+        :return: metrics of each user, None if the user is not admin
+        :rtype: dict or None
+        """
+        if not user.is_admin:
+            return None
+        
+        return self.fair_share.metrics()
+    
+    
+    def trim_filesystems(self, user):
+        """Discard the unused blocks of all mounted filesystems.
+        The action will only be performed if user is admin.
+
+        :param user: user who wants to perform the action
+        :type user: cc_agency.broker.auth.Auth.User
+        :return: names of the trimmed filesystems, None if the user is not admin
+        :rtype: list[str] or None
+        """
+        if not user.is_admin:
+            return None
+        
+        return [fs for fs in self.filesystem_service.find_all_filesystems() if self.filesystem_service.trim(fs)]
+    
+    
+    def storage_report(self, user):
+        """Get the apparent and allocated size of every filesystem.
+        The action will only be performed if user is admin.
+
+        :param user: user who wants to perform the action
+        :type user: cc_agency.broker.auth.Auth.User
+        :return: disk usage for each filesystem, None if the user is not admin
+        :rtype: dict or None
+        """
+        if not user.is_admin:
+            return None
+        
+        report = {}
+        for fs in self.filesystem_service.find_all_filesystems():
+            try:
+                report[fs] = self.filesystem_service.get_disk_usage(fs)
+            except FileNotFoundError:
+                pass
+        return report
+    
+    
+    def backup(self, user, backup_username=None, incremental=True):
+        """Copy the filesystem image of the user (backup_username) or of all users
+        into the backup directory. Only images with loop backend can be backed up.
+        The action will only be performed if user is admin.
+
+        :param user: user who wants to perform the action
+        :type user: cc_agency.broker.auth.Auth.User
+        :param backup_username: the user whose image is copied, defaults to None (all users)
+        :type backup_username: str, optional
+        :param incremental: skip images that did not change since the last backup, defaults to True
+        :type incremental: bool, optional
+        :return: 'copied', 'unchanged' or 'failed' for each filesystem, None if the user is not admin
+        :rtype: dict or None
+        """
+        if not user.is_admin or isinstance(self.filesystem_service, DirectoryFilesystemService):
+            return None
+        
+        if backup_username is None:
+            return self.backup_service.backup_all(incremental)
+        
+        user_ref = self.get_user_ref(Auth.User(backup_username, False))
+        if not self.filesystem_service.filessystem_exists(user_ref):
+            return None
+        return {user_ref: self.backup_service.backup(user_ref, incremental)}
+    
+    
+    def restore(self, user, restore_username):
+        """Replace the filesystem image of the user (restore_username) with its backup.
+        The action will only be performed if user is admin.
+
+        :param user: user who wants to perform the action
+        :type user: cc_agency.broker.auth.Auth.User
+        :param restore_username: the user whose image is restored
+        :type restore_username: str
+        :return: if succeded returns true, otherwise false
+        :rtype: bool
+        """
+        if not user.is_admin or not restore_username or isinstance(self.filesystem_service, DirectoryFilesystemService):
+            return False
+        
+        user_ref = self.get_user_ref(Auth.User(restore_username, False))
+        if not self.backup_service.restore(user_ref):
+            return False
         
+        self.digest_index.remove(user_ref)
         return True
     
     
+    def backup_archive(self, user, backup_username):
+        """Get a compressed sparse archive of the backup of the user (backup_username).
+        The backup is updated first.
+        The action will only be performed if user is admin.
+
+        :param user: user who wants to perform the action
+        :type user: cc_agency.broker.auth.Auth.User
+        :param backup_username: the user whose backup is archived
+        :type backup_username: str
+        :return: generator yielding the archive, None if the backup failed or the user is not admin
+        :rtype: collections.abc.Iterator[bytes] or None
+        """
+        if not backup_username:
+            return None
+        
+        result = self.backup(user, backup_username)
+        if not result or 'failed' in result.values():
+            return None
+        
+        return self.backup_service.stream_archive(self.get_user_ref(Auth.User(backup_username, False)))
+    
+    
+    def reconcile(self, user):
+        """Run the reconciler immediately.
+        The action will only be performed if user is admin.
+
+        :param user: user who wants to perform the action
+        :type user: cc_agency.broker.auth.Auth.User
+        :return: report of the reconciler, None if the user is not admin
+        :rtype: dict or None
+        """
+        if not user.is_admin:
+            return None
+        
+        return self.reconciler.reconcile()
+    
+    
+    def reconcile_report(self, user):
+        """Get the report of the last reconciler run.
+        The action will only be performed if user is admin.
+
+        :param user: user who wants to perform the action
+        :type user: cc_agency.broker.auth.Auth.User
+        :return: report of the last run, None if the user is not admin or nothing was reconciled yet
+        :rtype: dict or None
+        """
+        if not user.is_admin:
+            return None
+        
+        return self.reconciler.last_report
+    
+    
     def remove_user(self, user, remove_username):
         """Delete the users (remove_username) filesystem and the local linux user.
         The action will only be performed if user is admin. 
@@ -177,8 +617,12 @@ class CloudService:
         
         self.mongo.db['cloud_users'].delete_one({'username': remove_user.username})
         
+        self.provisioned.discard(user_ref)
+        self.mount_manager.forget(user_ref)
         self.filesystem_service.umount(user_ref)
         self.filesystem_service.delete(user_ref)
+        self.digest_index.remove(user_ref)
+        self.key_service.forget(user_ref)
         
         local_user = LocalUser(user_ref, self.home_dir)
         if local_user.exists():
@@ -0,0 +1,138 @@
+import os
+import gzip
+import zlib
+
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+try:
+    import zstandard
+    DECOMPRESSION_ERRORS = (OSError, EOFError, zlib.error, zstandard.ZstdError)
+except ImportError:
+    zstandard = None
+    DECOMPRESSION_ERRORS = (OSError, EOFError, zlib.error)
+
+CHUNK_SIZE = 1024 * 1024
+
+# files of these types are already compressed and are sent as they are
+COMPRESSED_EXTENSIONS = {
+    '.gz', '.tgz', '.zst', '.bz2', '.xz', '.lz4', '.zip', '.7z', '.rar',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.mp3', '.mp4', '.mkv', '.avi', '.mov',
+    '.pdf', '.docx', '.xlsx', '.pptx', '.parquet', '.bam', '.cram',
+}
+
+
+def supported_encodings():
+    """Get the content encodings that can be used.
+
+    :return: Supported encodings, preferred encoding first
+    :rtype: list[str]
+    """
+    return ['zstd', 'gzip'] if zstandard is not None else ['gzip']
+
+
+def is_compressible(filepath):
+    """Check if it is worth to compress the file.
+
+    :param filepath: Path to the file
+    :type filepath: str
+    :return: Returns False if the file type is already compressed
+    :rtype: bool
+    """
+    return os.path.splitext(filepath)[1].lower() not in COMPRESSED_EXTENSIONS
+
+
+def compress_file(filepath, encoding, level, threads=0):
+    """Reads the file and compresses it while streaming.
+
+    :param filepath: Path to the file
+    :type filepath: str
+    :param encoding: 'gzip' or 'zstd'
+    :type encoding: str
+    :param level: Compression level
+    :type level: int
+    :param threads: Number of zstd worker threads, defaults to 0 (compress in the calling thread)
+    :type threads: int, optional
+    :return: Generator yielding the compressed data
+    :rtype: collections.abc.Iterator[bytes]
+    """
+    with open(filepath, 'rb') as file:
+        if encoding == 'zstd':
+            compressor = zstandard.ZstdCompressor(level=level, threads=threads)
+            yield from compressor.read_to_iter(file, read_size=CHUNK_SIZE, write_size=CHUNK_SIZE)
+            return
+
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class CountingReader:
+
+    def __init__(self, stream):
+        """Create a new instance of CountingReader, that counts the bytes read from stream.
+
+        :param stream: The stream to read from
+        :type stream: io.RawIOBase
+        """
+        self.stream = stream
+        self.read_size = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.read_size += len(data)
+        return data
+
+
+class DecompressingStream:
+
+    def __init__(self, stream, encoding, max_size, max_ratio=None, min_size=CHUNK_SIZE):
+        """Create a new instance of DecompressingStream. The stream decompresses a
+        request body while it is read. To protect against decompression bombs reading
+        fails, if more than max_size bytes are decompressed or if the ratio between
+        decompressed and compressed data exceeds max_ratio.
+
+        :param stream: Stream with the compressed data
+        :type stream: io.RawIOBase
+        :param encoding: 'gzip' or 'zstd'
+        :type encoding: str
+        :param max_size: Maximal number of decompressed bytes, e.g. the space left for the user
+        :type max_size: int
+        :param max_ratio: Maximal ratio between decompressed and compressed data, defaults to None (no limit)
+        :type max_ratio: float, optional
+        :param min_size: The ratio is only checked after min_size bytes were decompressed, defaults to CHUNK_SIZE
+        :type min_size: int, optional
+        """
+        self.max_size = max_size
+        self.max_ratio = max_ratio
+        self.min_size = min_size
+        self.decompressed_size = 0
+        self._compressed = CountingReader(stream)
+        if encoding == 'zstd':
+            self._reader = zstandard.ZstdDecompressor().stream_reader(self._compressed, read_size=CHUNK_SIZE)
+        else:
+            self._reader = gzip.GzipFile(fileobj=self._compressed, mode='rb')
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(CHUNK_SIZE), b''))
+        # the decompressed data is read in bounded steps, so a bomb never fills the memory
+        try:
+            data = self._reader.read(size)
+        except DECOMPRESSION_ERRORS:
+            raise BadRequest(description='invalid compressed content')
+        self.decompressed_size += len(data)
+        if self.decompressed_size > self.max_size:
+            raise RequestEntityTooLarge(description='decompressed content exceeds the available storage')
+        if self.max_ratio and self.decompressed_size > self.min_size \
+                and self.decompressed_size > self.max_ratio * self._compressed.read_size:
+            raise RequestEntityTooLarge(description='decompression ratio exceeds the limit')
+        return data
@@ -0,0 +1,185 @@
+import os
+import zlib
+import struct
+import hashlib
+
+ADLER_MODULUS = 65521
+COPY_INSTRUCTION = b'C'
+LITERAL_INSTRUCTION = b'L'
+MAX_LITERAL_SIZE = 1024 * 1024
+
+# The delta is a stream of instructions. Each instruction starts with one byte:
+#   'C' followed by the block index as unsigned 64 bit big endian integer copies a block of the old file
+#   'L' followed by the length as unsigned 64 bit big endian integer and the data appends literal data
+INDEX_STRUCT = struct.Struct('>Q')
+
+
+def strong_checksum(data):
+    """Computes the strong checksum of a block.
+
+    :param data: Content of the block
+    :type data: bytes
+    :return: Hex digest of the block
+    :rtype: str
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def compute_signature(filepath, block_size):
+    """Computes the signature of a file. For each block the weak (adler32)
+    and strong checksum is computed.
+
+    :param filepath: Path to the file
+    :type filepath: str
+    :param block_size: Size of a block in bytes
+    :type block_size: int
+    :return: Signature with block_size, size and the checksums of the blocks
+    :rtype: dict
+    """
+    blocks = []
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            blocks.append([zlib.adler32(block), strong_checksum(block)])
+        size = file.tell()
+    return {'block_size': block_size, 'size': size, 'blocks': blocks}
+
+
+def encode_copy(index):
+    return COPY_INSTRUCTION + INDEX_STRUCT.pack(index)
+
+
+def encode_literal(data):
+    return LITERAL_INSTRUCTION + INDEX_STRUCT.pack(len(data)) + bytes(data)
+
+
+def compute_delta(signature, file):
+    """Computes the delta between the file described by the signature and the
+    content of file. Blocks are found at any offset with the rolling adler32 checksum.
+
+    :param signature: Signature of the old file, see compute_signature
+    :type signature: dict
+    :param file: Binary file object with the new content
+    :type file: io.BufferedReader
+    :return: Generator yielding the encoded instructions
+    :rtype: collections.abc.Iterator[bytes]
+    """
+    block_size = signature['block_size']
+    blocks = {}
+    for index, (weak, strong) in enumerate(signature['blocks']):
+        blocks.setdefault(weak, {}).setdefault(strong, index)
+    last_index = len(signature['blocks']) - 1
+    last_size = signature['size'] - last_index * block_size
+
+    buffer = bytearray()
+    start = 0
+    literal = bytearray()
+    checksum = None
+    eof = False
+
+    while True:
+        # keep one byte more than a block in the buffer to roll the checksum
+        while not eof and len(buffer) - start <= block_size:
+            chunk = file.read(max(block_size, 1024 * 1024))
+            if chunk:
+                buffer += chunk
+            else:
+                eof = True
+        if len(buffer) - start < block_size:
+            break
+
+        end = start + block_size
+        if checksum is None:
+            weak = zlib.adler32(buffer[start:end])
+            a, b = weak & 0xffff, weak >> 16
+        candidates = blocks.get((b << 16) | a)
+        index = candidates.get(strong_checksum(buffer[start:end])) if candidates else None
+
+        if index is not None and (index != last_index or last_size == block_size):
+            if literal:
+                yield encode_literal(literal)
+                literal = bytearray()
+            yield encode_copy(index)
+            del buffer[:end]
+            start = 0
+            checksum = None
+            continue
+
+        removed = buffer[start]
+        literal.append(removed)
+        start += 1
+        if end < len(buffer):
+            added = buffer[end]
+            a = (a - removed + added) % ADLER_MODULUS
+            b = (b - block_size * removed - 1 + a) % ADLER_MODULUS
+            checksum = True
+        else:
+            checksum = None
+        if len(literal) >= MAX_LITERAL_SIZE:
+            yield encode_literal(literal)
+            literal = bytearray()
+        if start >= MAX_LITERAL_SIZE:
+            del buffer[:start]
+            start = 0
+
+    tail = buffer[start:]
+    if tail and last_index >= 0 and len(tail) == last_size \
+            and blocks.get(zlib.adler32(tail), {}).get(strong_checksum(tail)) == last_index:
+        if literal:
+            yield encode_literal(literal)
+            literal = bytearray()
+        yield encode_copy(last_index)
+    else:
+        literal += tail
+    if literal:
+        yield encode_literal(literal)
+
+
+def apply_delta(old_filepath, delta, new_file, block_size):
+    """Reconstructs the new file from the old file and the delta.
+
+    :param old_filepath: Path to the old file or None if the file does not exist
+    :type old_filepath: str or None
+    :param delta: Binary stream with the encoded instructions
+    :type delta: io.RawIOBase
+    :param new_file: File object the new content is written to
+    :type new_file: io.BufferedWriter
+    :param block_size: Size of a block in bytes
+    :type block_size: int
+    :raise ValueError: If the delta is invalid or references a block that does not exist
+    """
+    old_fd = os.open(old_filepath, os.O_RDONLY) if old_filepath else None
+    try:
+        old_size = os.fstat(old_fd).st_size if old_fd is not None else 0
+        while True:
+            instruction = delta.read(1)
+            if not instruction:
+                break
+            value = read_exactly(delta, INDEX_STRUCT.size)
+            (value,) = INDEX_STRUCT.unpack(value)
+            if instruction == COPY_INSTRUCTION:
+                offset = value * block_size
+                if offset >= old_size:
+                    raise ValueError(f'block {value} does not exist')
+                new_file.write(os.pread(old_fd, min(block_size, old_size - offset), offset))
+            elif instruction == LITERAL_INSTRUCTION:
+                while value > 0:
+                    data = delta.read(min(value, MAX_LITERAL_SIZE))
+                    if not data:
+                        raise ValueError('literal data is incomplete')
+                    new_file.write(data)
+                    value -= len(data)
+            else:
+                raise ValueError(f'unknown instruction {instruction!r}')
+    finally:
+        if old_fd is not None:
+            os.close(old_fd)
+
+
+def read_exactly(stream, size):
+    data = b''
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise ValueError('delta is incomplete')
+        data += chunk
+    return data
@@ -0,0 +1,214 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+
+HASH_FUNCTIONS = {
+    'sha256': hashlib.sha256,
+    'blake2b': hashlib.blake2b,
+}
+
+try:
+    import xxhash
+    HASH_FUNCTIONS['xxh3'] = xxhash.xxh3_128
+except ImportError:
+    pass
+
+try:
+    import blake3
+    HASH_FUNCTIONS['blake3'] = blake3.blake3
+except ImportError:
+    pass
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class HashingWriter:
+
+    def __init__(self, file, algorithms, max_size=None):
+        """Create a new instance of HashingWriter. Everything written to the
+        writer is written to file and hashed with the given algorithms.
+
+        :param file: File object the data is written to
+        :type file: io.BufferedWriter
+        :param algorithms: Names of the hash algorithms, see HASH_FUNCTIONS
+        :type algorithms: list[str]
+        :param max_size: Writing more than max_size bytes fails, defaults to None (no limit)
+        :type max_size: int, optional
+        """
+        self.file = file
+        self.hashes = {algorithm: HASH_FUNCTIONS[algorithm]() for algorithm in algorithms}
+        self.max_size = max_size
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise ValueError('content exceeds the storage limit')
+        for hash_object in self.hashes.values():
+            hash_object.update(data)
+        return self.file.write(data)
+
+    def hexdigests(self):
+        """Get the digests of the written data.
+
+        :return: Hex digest for each algorithm
+        :rtype: dict
+        """
+        return {algorithm: hash_object.hexdigest() for algorithm, hash_object in self.hashes.items()}
+
+
+def hash_file(filepath, algorithms):
+    """Hashes the content of the file with the given algorithms.
+
+    :param filepath: Path to the file
+    :type filepath: str
+    :param algorithms: Names of the hash algorithms, see HASH_FUNCTIONS
+    :type algorithms: list[str]
+    :return: Hex digest for each algorithm
+    :rtype: dict
+    """
+    hashes = {algorithm: HASH_FUNCTIONS[algorithm]() for algorithm in algorithms}
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            for hash_object in hashes.values():
+                hash_object.update(chunk)
+    return {algorithm: hash_object.hexdigest() for algorithm, hash_object in hashes.items()}
+
+
+class DigestIndex:
+
+    def __init__(self, index_file):
+        """Create a new instance of DigestIndex. The index stores the digests and
+        block signatures of the files of each user together with the inode, size and
+        mtime of the file, so changes made by other means (e.g. SFTP) invalidate the entry.
+
+        :param index_file: Path to the sqlite database of the index
+        :type index_file: str
+        """
+        self.index_file = index_file
+        self._local = threading.local()
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.index_file) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.index_file, timeout=30)
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS digests ('
+                'user_ref TEXT, path TEXT, inode INTEGER, size INTEGER, mtime_ns INTEGER, digests TEXT, '
+                'PRIMARY KEY (user_ref, path))'
+            )
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS signatures ('
+                'user_ref TEXT, path TEXT, block_size INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, signature TEXT, '
+                'PRIMARY KEY (user_ref, path, block_size))'
+            )
+            self._local.connection = connection
+        return connection
+
+    def get(self, user_ref, path, stat, algorithms):
+        """Get the digests of the file, if the file did not change since they were stored.
+
+        :param user_ref: The user the file belongs to
+        :type user_ref: str
+        :param path: Absolute path of the file
+        :type path: str
+        :param stat: Current stat result of the file
+        :type stat: os.stat_result
+        :param algorithms: Names of the hash algorithms that are required
+        :type algorithms: list[str]
+        :return: Hex digest for each algorithm or None if no valid entry exists
+        :rtype: dict or None
+        """
+        row = self._connect().execute(
+            'SELECT digests FROM digests WHERE user_ref = ? AND path = ? AND inode = ? AND size = ? AND mtime_ns = ?',
+            (user_ref, path, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+        if row is None:
+            return None
+        digests = json.loads(row[0])
+        if not all(algorithm in digests for algorithm in algorithms):
+            return None
+        return digests
+
+    def put(self, user_ref, path, stat, digests):
+        """Stores the digests of the file.
+
+        :param user_ref: The user the file belongs to
+        :type user_ref: str
+        :param path: Absolute path of the file
+        :type path: str
+        :param stat: Stat result of the file, the digests belong to
+        :type stat: os.stat_result
+        :param digests: Hex digest for each algorithm
+        :type digests: dict
+        """
+        connection = self._connect()
+        with connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)',
+                (user_ref, path, stat.st_ino, stat.st_size, stat.st_mtime_ns, json.dumps(digests))
+            )
+
+    def get_signature(self, user_ref, path, stat, block_size):
+        """Get the block signature of the file, if the file did not change since it was stored.
+
+        :param user_ref: The user the file belongs to
+        :type user_ref: str
+        :param path: Absolute path of the file
+        :type path: str
+        :param stat: Current stat result of the file
+        :type stat: os.stat_result
+        :param block_size: Block size of the signature
+        :type block_size: int
+        :return: The signature or None if no valid entry exists
+        :rtype: dict or None
+        """
+        row = self._connect().execute(
+            'SELECT signature FROM signatures WHERE user_ref = ? AND path = ? AND block_size = ? '
+            'AND inode = ? AND size = ? AND mtime_ns = ?',
+            (user_ref, path, block_size, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put_signature(self, user_ref, path, stat, signature):
+        """Stores the block signature of the file. Signatures with other block sizes are replaced.
+
+        :param user_ref: The user the file belongs to
+        :type user_ref: str
+        :param path: Absolute path of the file
+        :type path: str
+        :param stat: Stat result of the file, the signature belongs to
+        :type stat: os.stat_result
+        :param signature: The signature, see cc_cloud.service.delta.compute_signature
+        :type signature: dict
+        """
+        connection = self._connect()
+        with connection:
+            connection.execute('DELETE FROM signatures WHERE user_ref = ? AND path = ?', (user_ref, path))
+            connection.execute(
+                'INSERT INTO signatures VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (user_ref, path, signature['block_size'], stat.st_ino, stat.st_size, stat.st_mtime_ns, json.dumps(signature))
+            )
+
+    def remove(self, user_ref, path=None):
+        """Removes the entries of a file or of all files inside a directory.
+
+        :param user_ref: The user the files belong to
+        :type user_ref: str
+        :param path: Absolute path of the file or directory, defaults to None (all files of the user)
+        :type path: str, optional
+        """
+        connection = self._connect()
+        with connection:
+            for table in ('digests', 'signatures'):
+                if path is None:
+                    connection.execute(f'DELETE FROM {table} WHERE user_ref = ?', (user_ref,))
+                else:
+                    path = path.rstrip('/')
+                    connection.execute(
+                        f'DELETE FROM {table} WHERE user_ref = ? AND (path = ? OR substr(path, 1, ?) = ?)',
+                        (user_ref, path, len(path) + 1, path + '/')
+                    )
@@ -0,0 +1,232 @@
+import os
+import json
+import shutil
+import threading
+
+from cc_cloud.service.filesystem_service import FilesystemService
+
+
+class DirectoryFilesystemService(FilesystemService):
+    """Stores the data of each user in a plain directory instead of a loop mounted
+    image. The storage limit is enforced by a usage index, which is updated by the
+    writes of the FileService. The limit of each user is kept in a small quota file
+    inside the filesystem directory, so no loop device or privileged container is needed.
+    """
+
+    def __init__(self, conf):
+        """Create a new instance of DirectoryFilesystemService
+
+        :param conf: Configuration to load values from
+        :type conf: cc_agency.commons.conf.Conf
+        """
+        super().__init__(conf)
+        self._usage = {}
+        self._usage_lock = threading.Lock()
+
+    def create(self, fs_name, size=None):
+        """Creates the upload directory of the user and the quota file.
+
+        :param fs_name: Creates a filesystem with the name fs_name
+        :type fs_name: str
+        :param size: Storage limit of the user, defaults to None
+        :type size: int, optional
+        """
+        if size == None:
+            size = self.user_storage_limit
+
+        os.makedirs(self.filesystem_dir, exist_ok=True)
+        os.makedirs(self.get_mountpoint(fs_name), exist_ok=True)
+        self.set_size_limit(fs_name, size)
+
+    def set_directory_owner(self, username):
+        """Sets the owner of the users home directory to root and the
+        owner of the upload directory to the cloud user.
+
+        :param username: Name of the cloud user
+        :type username: str
+        """
+        home_dir = os.path.join(self.userhome_directory, username)
+        shutil.chown(home_dir, 'root', 'root')
+        os.chmod(home_dir, 0o751)
+        shutil.chown(self.get_mountpoint(username), username, username)
+
+    def mount(self, fs_name):
+        """Makes sure the upload directory exists and belongs to the user.
+
+        :param fs_name: Mount the filesystem with the name fs_name
+        :type fs_name: str
+        """
+        os.makedirs(self.get_mountpoint(fs_name), exist_ok=True)
+        self.set_directory_owner(fs_name)
+
+    def umount(self, fs_name):
+        """Directories do not need to be unmounted.
+
+        :param fs_name: Umount the filesystem with the name fs_name
+        :type fs_name: str
+        :return: Always True
+        :rtype: bool
+        """
+        return True
+
+    def is_mounted(self, fs_name):
+        """Check if the upload directory of the user exists.
+
+        :param fs_name: Check the filesystem with the name fs_name
+        :type fs_name: str
+        :return: Return True if the upload directory exists
+        :rtype: bool
+        """
+        return os.path.isdir(self.get_mountpoint(fs_name))
+
+    def find_mounted_filesystems(self):
+        """Get all filesystems whose upload directory exists.
+
+        :return: Names of the filesystems
+        :rtype: list[str]
+        """
+        return [fs for fs in self.find_all_filesystems() if self.is_mounted(fs)]
+
+    def delete(self, fs_name):
+        """Delete the quota file and the upload directory.
+
+        :param fs_name: Delete the filesystem with the name fs_name
+        :type fs_name: str
+        """
+        super().delete(fs_name)
+        with self._usage_lock:
+            self._usage.pop(fs_name, None)
+
+    def trim(self, fs_name):
+        """Directories do not allocate unused space.
+
+        :param fs_name: Trim the filesystem with the name fs_name
+        :type fs_name: str
+        :return: Always False
+        :rtype: bool
+        """
+        return False
+
+    def resize(self, fs_name, size):
+        """Sets the storage limit of the user, if the stored data fits into it.
+
+        :param fs_name: Resize the filesystem with the name fs_name
+        :type fs_name: str
+        :param size: The new storage limit
+        :type size: int
+        :return: Returns True if the limit was changed
+        :rtype: bool
+        """
+        with self.lock(fs_name):
+            if not self.filessystem_exists(fs_name) or self.get_used_size(fs_name) > size:
+                return False
+            self.set_size_limit(fs_name, size)
+            return True
+
+    def set_size_limit(self, fs_name, size):
+        """Writes the storage limit of the user to the quota file.
+
+        :param fs_name: Name of the filesystem
+        :type fs_name: str
+        :param size: The storage limit
+        :type size: int
+        """
+        with open(self.get_filepath(fs_name), 'w') as file:
+            json.dump({'size': size}, file)
+
+    def get_size(self, fs_name):
+        """Get the storage limit of the user.
+
+        :param fs_name: Get size of the filesystem with the name fs_name
+        :type fs_name: str
+        :return: Storage limit in bytes
+        :rtype: int
+        """
+        with open(self.get_filepath(fs_name)) as file:
+            return json.load(file)['size']
+
+    def get_disk_usage(self, fs_name):
+        """Get the storage limit and the space used by the user.
+
+        :param fs_name: Get disk usage of the filesystem with the name fs_name
+        :type fs_name: str
+        :return: Dictionary with apparent_size and allocated_size in bytes
+        :rtype: dict
+        """
+        return {
+            'apparent_size': self.get_size(fs_name),
+            'allocated_size': self.get_used_size(fs_name),
+        }
+
+    def get_used_size(self, fs_name):
+        """Get the space used by the user from the usage index. If the user is
+        not indexed yet, the upload directory is scanned once.
+
+        :param fs_name: Get used space of the filesystem with the name fs_name
+        :type fs_name: str
+        :return: Used space in bytes
+        :rtype: int
+        """
+        with self._usage_lock:
+            if fs_name in self._usage:
+                return self._usage[fs_name]
+        used = self.scan_usage(fs_name)
+        with self._usage_lock:
+            return self._usage.setdefault(fs_name, used)
+
+    def get_free_size(self, fs_name):
+        """Get the space left until the storage limit of the user is reached.
+
+        :param fs_name: Get free space of the filesystem with the name fs_name
+        :type fs_name: str
+        :return: Free space in bytes
+        :rtype: int
+        """
+        return max(self.get_size(fs_name) - self.get_used_size(fs_name), 0)
+
+    def scan_usage(self, fs_name):
+        """Sums up the size of all files in the upload directory of the user.
+
+        :param fs_name: Scan the filesystem with the name fs_name
+        :type fs_name: str
+        :return: Used space in bytes
+        :rtype: int
+        """
+        used = 0
+        for root, _, files in os.walk(self.get_mountpoint(fs_name)):
+            for filename in files:
+                try:
+                    used += os.lstat(os.path.join(root, filename)).st_size
+                except FileNotFoundError:
+                    pass
+        return used
+
+    def refresh_usage(self, fs_name):
+        """Rescans the upload directory, e.g. after changes made via SFTP.
+
+        :param fs_name: Name of the filesystem
+        :type fs_name: str
+        """
+        used = self.scan_usage(fs_name)
+        with self._usage_lock:
+            self._usage[fs_name] = used
+
+    def account(self, fs_name, delta):
+        """Account a change of the stored data in the usage index. Changes that
+        would exceed the storage limit are rejected and not accounted.
+
+        :param fs_name: Name of the filesystem that changed
+        :type fs_name: str
+        :param delta: Number of bytes that were added (positive) or removed (negative)
+        :type delta: int
+        :return: Returns True if the change fits into the storage limit
+        :rtype: bool
+        """
+        limit = self.get_size(fs_name)
+        used = self.get_used_size(fs_name)
+        with self._usage_lock:
+            used = self._usage.get(fs_name, used)
+            if delta > 0 and used + delta > limit:
+                return False
+            self._usage[fs_name] = max(used + delta, 0)
+        return True
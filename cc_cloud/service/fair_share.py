@@ -0,0 +1,290 @@
+import time
+import threading
+
+from werkzeug.exceptions import TooManyRequests
+
+LIMIT_FIELDS = ('max_transfers', 'upload_rate_limit', 'download_rate_limit')
+
+
+class TokenBucket:
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        """Create a new instance of TokenBucket. The bucket is refilled with rate
+        tokens (bytes) per second up to burst tokens. Tokens can be borrowed, the
+        borrower has to wait until the debt is paid back by the refill.
+
+        :param rate: Tokens added per second
+        :type rate: float
+        :param burst: Maximum number of tokens in the bucket, defaults to None (rate)
+        :type burst: float, optional
+        :param clock: Function returning the current time in seconds, defaults to time.monotonic
+        :type clock: callable, optional
+        """
+        self.rate = rate
+        self.burst = burst or rate
+        self.clock = clock
+        self.tokens = self.burst
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+
+    def reserve(self, amount):
+        """Takes amount tokens from the bucket.
+
+        :param amount: Number of tokens
+        :type amount: int
+        :return: Seconds the caller has to wait before using the tokens
+        :rtype: float
+        """
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class Transfer:
+
+    def __init__(self, scheduler=None, username=None, direction=None, bucket=None, max_transfers=None):
+        """Create a new instance of Transfer. A transfer holds a transfer slot of the
+        user until it is released and limits the bandwidth with the bucket of the user.
+        A transfer without scheduler is neither counted nor limited.
+
+        :param scheduler: The scheduler that started the transfer, defaults to None
+        :type scheduler: FairShareScheduler, optional
+        :param username: The user that transfers data, defaults to None
+        :type username: str, optional
+        :param direction: 'upload' or 'download', defaults to None
+        :type direction: str, optional
+        :param bucket: Bucket that limits the bandwidth, defaults to None (unlimited)
+        :type bucket: TokenBucket, optional
+        :param max_transfers: Maximal number of concurrent transfers of the user, defaults to None (unlimited)
+        :type max_transfers: int, optional
+        """
+        self.scheduler = scheduler
+        self.username = username
+        self.direction = direction
+        self.bucket = bucket
+        self.max_transfers = max_transfers
+        self._released = False
+
+
+    @property
+    def is_limited(self):
+        return self.bucket is not None
+
+
+    @property
+    def is_restricted(self):
+        # limited bandwidth or a limited number of concurrent transfers
+        return self.scheduler is not None and (self.is_limited or bool(self.max_transfers))
+
+
+    def consume(self, amount):
+        """Accounts amount transferred bytes and waits if the user exceeds the bandwidth limit.
+
+        :param amount: Number of bytes that will be transferred
+        :type amount: int
+        """
+        if self.scheduler is None:
+            return
+        wait = self.bucket.reserve(amount) if self.bucket is not None else 0
+        if wait > 0:
+            self.scheduler.sleep(wait)
+        self.scheduler.record(self.username, f'{self.direction}_bytes', amount)
+        self.scheduler.record(self.username, 'throttled_seconds', wait)
+
+
+    def iterate(self, iterable):
+        """Wraps the chunks of a response, so sending them is limited. The transfer
+        is not released by the generator, because it never runs if the body is not
+        sent (e.g. HEAD requests), register release as close hook of the response.
+
+        :param iterable: The chunks of the response
+        :type iterable: collections.abc.Iterable[bytes]
+        :return: Generator yielding the chunks
+        :rtype: collections.abc.Iterator[bytes]
+        """
+        for chunk in iterable:
+            self.consume(len(chunk))
+            yield chunk
+
+
+    def release(self):
+        """Frees the transfer slot. Only the first call has an effect.
+        """
+        if self._released or self.scheduler is None:
+            return
+        self._released = True
+        self.scheduler.release(self)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class ThrottledStream:
+
+    def __init__(self, stream, transfer):
+        """Create a new instance of ThrottledStream. Reading from the stream is limited
+        by the transfer, so the bandwidth of an upload is limited while the request body
+        is received and not when it is written to the storage.
+
+        :param stream: The stream to read from, e.g. the input stream of the request
+        :type stream: io.RawIOBase
+        :param transfer: The transfer of the upload
+        :type transfer: Transfer
+        """
+        self.stream = stream
+        self.transfer = transfer
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.transfer.consume(len(data))
+        return data
+
+
+class FairShareScheduler:
+
+    def __init__(self, conf, mongo, clock=time.monotonic, sleep=time.sleep):
+        """Create a new instance of FairShareScheduler. The scheduler limits the number
+        of concurrent transfers and the bandwidth of each user, so a single user can't
+        use up the disk and the network of the host. The defaults are read from the
+        configuration, admins can override them per user in the cloud_users collection.
+        Transfers up to small_transfer_size bytes are never limited.
+
+        :param conf: Configuration to load values from
+        :type conf: cc_agency.commons.conf.Conf
+        :param mongo: The database
+        :type mongo: cc_agency.commons.db.Mongo
+        :param clock: Function returning the current time in seconds, defaults to time.monotonic
+        :type clock: callable, optional
+        :param sleep: Function used to wait, defaults to time.sleep
+        :type sleep: callable, optional
+        """
+        self.mongo = mongo
+        self.defaults = {
+            'max_transfers': conf.d.get('max_transfers_per_user'),
+            'upload_rate_limit': conf.d.get('upload_rate_limit'),
+            'download_rate_limit': conf.d.get('download_rate_limit'),
+        }
+        self.burst_size = conf.d.get('rate_limit_burst', 4 * 1024 * 1024)
+        self.small_transfer_size = conf.d.get('small_transfer_size', 1024 * 1024)
+        self.retry_after = conf.d.get('transfer_retry_after', 5)
+        self.limits_ttl = conf.d.get('transfer_limits_ttl', 60)
+        self.clock = clock
+        self.sleep = sleep
+        self._limits = {}
+        self._buckets = {}
+        self._active = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+
+    def get_limits(self, username):
+        """Get the limits of the user. Overrides are cached for limits_ttl seconds.
+
+        :param username: Name of the cc-agency user
+        :type username: str
+        :return: max_transfers, upload_rate_limit and download_rate_limit, None or 0 if unlimited
+        :rtype: dict
+        """
+        now = self.clock()
+        with self._lock:
+            cached = self._limits.get(username)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        row = self.mongo.db['cloud_users'].find_one({'username': username}, {field: 1 for field in LIMIT_FIELDS}) or {}
+        limits = {field: row.get(field, self.defaults[field]) for field in LIMIT_FIELDS}
+        with self._lock:
+            self._limits[username] = (now + self.limits_ttl, limits)
+        return limits
+
+
+    def invalidate(self, username):
+        """Forget the cached limits and the buckets of the user, e.g. because an admin changed the limits.
+
+        :param username: Name of the cc-agency user
+        :type username: str
+        """
+        with self._lock:
+            self._limits.pop(username, None)
+            self._buckets.pop((username, 'upload'), None)
+            self._buckets.pop((username, 'download'), None)
+
+
+    def start(self, username, direction, size=None):
+        """Start a transfer of the user.
+
+        :param username: Name of the cc-agency user
+        :type username: str
+        :param direction: 'upload' or 'download'
+        :type direction: str
+        :param size: Number of bytes if known in advance, defaults to None
+        :type size: int, optional
+        :raises werkzeug.exceptions.TooManyRequests: if the user reached the limit of concurrent transfers
+        :return: The transfer, must be released when it is done
+        :rtype: Transfer
+        """
+        if size is not None and size <= self.small_transfer_size:
+            return Transfer()
+
+        limits = self.get_limits(username)
+        rate = limits[f'{direction}_rate_limit']
+        with self._lock:
+            active = self._active.get(username, 0)
+            if limits['max_transfers'] and active >= limits['max_transfers']:
+                self._record(username, 'rejected_transfers', 1)
+                raise TooManyRequests(
+                    description=f'too many concurrent transfers, at most {limits["max_transfers"]} are allowed',
+                    retry_after=self.retry_after
+                )
+            self._active[username] = active + 1
+            bucket = None
+            if rate:
+                bucket = self._buckets.get((username, direction))
+                if bucket is None or bucket.rate != rate:
+                    bucket = TokenBucket(rate, max(self.burst_size, rate), self.clock)
+                    self._buckets[(username, direction)] = bucket
+        return Transfer(self, username, direction, bucket, limits['max_transfers'])
+
+
+    def release(self, transfer):
+        with self._lock:
+            active = self._active.get(transfer.username, 0) - 1
+            if active > 0:
+                self._active[transfer.username] = active
+            else:
+                self._active.pop(transfer.username, None)
+
+
+    def record(self, username, metric, value):
+        with self._lock:
+            self._record(username, metric, value)
+
+
+    def _record(self, username, metric, value):
+        metrics = self._metrics.setdefault(username, {})
+        metrics[metric] = metrics.get(metric, 0) + value
+
+
+    def metrics(self):
+        """Get the throttling metrics of all users since the start of the process.
+
+        :return: Per user active_transfers, rejected_transfers, throttled_seconds, upload_bytes and download_bytes
+        :rtype: dict
+        """
+        with self._lock:
+            users = {username: dict(metrics) for username, metrics in self._metrics.items()}
+            for username, active in self._active.items():
+                users.setdefault(username, {})['active_transfers'] = active
+        return users
@@ -1,16 +1,32 @@
 import os
 import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from cc_cloud.service.digest_index import HashingWriter, hash_file
+from cc_cloud.service.delta import compute_signature, apply_delta
 
 class FileService:
     
-    def __init__(self, conf):
+    def __init__(self, conf, storage=None, digest_index=None):
         """Create a new instance of FileService
 
         :param conf: The cc-cloud configuration file
         :type conf: cc_agency.commons.conf.Conf
+        :param storage: Storage that accounts the written and deleted data, defaults to None
+        :type storage: cc_cloud.service.filesystem_service.FilesystemService, optional
+        :param digest_index: Index that stores the digests of the files, defaults to None
+        :type digest_index: cc_cloud.service.digest_index.DigestIndex, optional
         """
         self.upload_directory_name = conf.d.get('upload_directory_name', 'cloud')
         self.userhome_directory = conf.d.get('userhome_directory', '/var/lib/cc_cloud/home')
+        self.digest_algorithms = conf.d.get('digest_algorithms', ['sha256'])
+        self.delta_block_size = conf.d.get('delta_block_size', 65536)
+        self.storage = storage
+        self.digest_index = digest_index
+        self.hash_executor = ThreadPoolExecutor(max_workers=conf.d.get('checksum_workers', 2))
+        self.upload_executor = ThreadPoolExecutor(max_workers=conf.d.get('upload_workers', 4))
+        self.upload_fsync = conf.d.get('upload_fsync', False)
     
     def download_file(self, user_ref, path):
         """Checks if the user is allowed to access the file. If the path is available and
@@ -31,33 +47,444 @@ class FileService:
     
     
     def upload_file(self, user_ref, files):
-        """Saves multiple files to the users storage.
+        """Saves multiple files to the users storage. All paths are validated and
+        the missing directories are created before the files are written concurrently
+        by the upload workers. The digests of each file are computed while the file
+        is written. If a part contains an If-None-Match header with the digest of
+        the existing file, the part is not written again. If upload_fsync is set,
+        the files are synced before they replace existing files and each directory
+        is synced once after all files were written.
 
         :param user_ref: The user that wants to upload the files
         :type user_ref: str
         :param files: One or multiple files that should be saved
         :type files: werkzeug.datastructures.structures.ImmutableMultiDict
+        :return: Status ('saved', 'unchanged' or 'error') with digests or the error of each file
+        :rtype: dict
+        """
+        results = {}
+        parts = {}
+        if not files:
+            return results
+        
+        for filename, file in files.items():
+            if not file:
+                results[filename] = {'status': 'error', 'error': 'no file'}
+                continue
+            if filename == '':
+                filename = file.filename
+            
+            filepath = self.get_full_filepath(user_ref, filename)
+            if not self.is_secure_path(user_ref, filename) or os.path.isdir(filepath):
+                results[filename] = {'status': 'error', 'error': 'invalid path'}
+            elif filename in parts or filepath in {path for _, path in parts.values()}:
+                results[filename] = {'status': 'error', 'error': 'duplicate path'}
+            else:
+                parts[filename] = (file, filepath)
+        
+        failed_dirs = self.create_directories(user_ref, {os.path.dirname(filepath) for _, filepath in parts.values()})
+        if self.storage is not None:
+            # builds the usage index of the storage before any temporary file exists
+            self.storage.get_free_size(user_ref)
+        
+        futures = {}
+        for filename, (file, filepath) in parts.items():
+            if os.path.dirname(filepath) in failed_dirs:
+                results[filename] = {'status': 'error', 'error': 'could not create directory'}
+                continue
+            futures[filename] = self.upload_executor.submit(self.upload_part, user_ref, file, filepath)
+        
+        for filename, future in futures.items():
+            results[filename] = future.result()
+        
+        if self.upload_fsync:
+            for directory in {os.path.dirname(parts[filename][1]) for filename in futures}:
+                self.sync_directory(directory)
+        return results
+    
+    
+    def upload_part(self, user_ref, file, filepath):
+        """Saves a single part of a multipart upload.
+
+        :param user_ref: The user that wants to upload the file
+        :type user_ref: str
+        :param file: The file that should be saved
+        :type file: werkzeug.datastructures.FileStorage
+        :param filepath: Absolute path of the file
+        :type filepath: str
+        :return: Status ('saved', 'unchanged' or 'error') with the digests or the error of the file
+        :rtype: dict
         """
-        if files:
-            for filename, file in files.items():
-                
-                if file.filename == '':
-                    continue
-                if filename == '':
-                    filename = file.filename
-                
-                if not self.is_secure_path(user_ref, filename):
-                    continue
-                
-                if file:
-                    filepath = self.get_full_filepath(user_ref, filename)
+        expected_digests = self.parse_expected_digests(file.headers.get('If-None-Match', ''))
+        if expected_digests and self.compare_file(user_ref, filepath, file.content_length or None, expected_digests) == 'match':
+            return {'status': 'unchanged', 'digests': self.get_file_digests(user_ref, filepath)}
+        
+        digests = self.save_file(user_ref, file, filepath)
+        if digests is None:
+            return {'status': 'error', 'error': 'could not save file'}
+        try:
+            shutil.chown(filepath, user_ref, user_ref)
+        except (OSError, LookupError):
+            return {'status': 'error', 'error': 'could not set owner'}
+        self.set_mtime(user_ref, filepath, file.headers.get('X-Mtime'), digests)
+        return {'status': 'saved', 'digests': digests}
+    
+    
+    def set_mtime(self, user_ref, filepath, mtime, digests):
+        """Sets the modification time of an uploaded file, so clients can compare
+        it with the modification time of their copy.
+
+        :param user_ref: The user that uploaded the file
+        :type user_ref: str
+        :param filepath: Absolute path of the file
+        :type filepath: str
+        :param mtime: Modification time in seconds since the epoch, as sent by the client
+        :type mtime: str or None
+        :param digests: Digests of the file
+        :type digests: dict
+        """
+        if not mtime:
+            return
+        try:
+            mtime_ns = int(float(mtime) * 1e9)
+            os.utime(filepath, ns=(mtime_ns, mtime_ns))
+        except (ValueError, OverflowError, OSError):
+            return
+        if self.digest_index is not None:
+            self.digest_index.put(user_ref, filepath, os.stat(filepath), digests)
+    
+    
+    def create_directories(self, user_ref, directories):
+        """Creates the directories inside the users storage. Only the directories
+        that did not exist before are handed over to the user.
+
+        :param user_ref: The user that owns the directories
+        :type user_ref: str
+        :param directories: Absolute paths of the directories
+        :type directories: set[str]
+        :return: The directories that could not be created
+        :rtype: set[str]
+        """
+        failed = set()
+        for directory in sorted(directories):
+            if os.path.isdir(directory):
+                continue
+            missing = []
+            parent = directory
+            while not os.path.isdir(parent) and parent != os.path.dirname(parent):
+                missing.append(parent)
+                parent = os.path.dirname(parent)
+            try:
+                for path in reversed(missing):
                     try:
-                        os.makedirs(os.path.dirname(filepath))
-                        os.system(f"chown -R {user_ref}:{user_ref} {self.get_user_upload_directory(user_ref)}")
-                    except OSError:
-                        pass
-                    file.save(filepath)
-                    shutil.chown(filepath, user_ref, user_ref)
+                        os.mkdir(path)
+                    except FileExistsError:
+                        # created by a concurrent upload
+                        if not os.path.isdir(path):
+                            raise
+                        continue
+                    shutil.chown(path, user_ref, user_ref)
+            except (OSError, LookupError):
+                failed.add(directory)
+        return failed
+    
+    
+    def sync_directory(self, directory):
+        """Syncs the directory, so renamed files inside are persisted.
+
+        :param directory: Absolute path of the directory
+        :type directory: str
+        """
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+    
+    
+    def save_file(self, user_ref, file, filepath):
+        """Saves the file, if it fits into the storage limit of the user.
+
+        :param user_ref: The user that wants to upload the file
+        :type user_ref: str
+        :param file: The file that should be saved
+        :type file: werkzeug.datastructures.FileStorage
+        :param filepath: Absolute path of the file
+        :type filepath: str
+        :return: Digests of the saved file or None if the file was not saved
+        :rtype: dict or None
+        """
+        return self.write_file(user_ref, filepath, file.save, file.content_length, fsync=self.upload_fsync)
+    
+    
+    def write_file(self, user_ref, filepath, write, expected_size=None, expected_digests=None, fsync=False):
+        """Writes a file, if it fits into the storage limit of the user.
+        The content is written to a temporary file first, so an existing file
+        is only replaced if the new content is accepted. Writing is aborted as soon
+        as the content exceeds the free space of the user. The digests of the
+        content are computed while writing and stored in the digest index.
+
+        :param user_ref: The user that wants to write the file
+        :type user_ref: str
+        :param filepath: Absolute path of the file
+        :type filepath: str
+        :param write: Function that writes the content to the given file object
+        :type write: callable
+        :param expected_size: Size of the content if known in advance, defaults to None
+        :type expected_size: int, optional
+        :param expected_digests: The file is only replaced if the content has these digests, defaults to None
+        :type expected_digests: dict, optional
+        :param fsync: Sync the content before the file is replaced, defaults to False
+        :type fsync: bool, optional
+        :return: Digests of the written file or None if the file was not written
+        :rtype: dict or None
+        """
+        old_size = self.get_element_size(filepath)
+        max_size = None
+        if self.storage is not None:
+            # the written bytes are counted, so the upload is aborted as soon as it exceeds the free space
+            max_size = self.storage.get_free_size(user_ref) + old_size
+            if expected_size and expected_size > max_size:
+                return None
+        
+        try:
+            fd, temp_path = tempfile.mkstemp(prefix='.', suffix='.upload', dir=os.path.dirname(filepath))
+        except OSError:
+            return None
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                writer = HashingWriter(temp_file, self.digest_algorithms, max_size)
+                write(writer)
+                if fsync:
+                    temp_file.flush()
+                    os.fsync(temp_file.fileno())
+            digests = writer.hexdigests()
+            if expected_digests and any(digests.get(algorithm) != value.lower() for algorithm, value in expected_digests.items()):
+                raise ValueError('content does not match the expected digests')
+            if self.storage is not None and not self.storage.account(user_ref, os.path.getsize(temp_path) - old_size):
+                raise ValueError('content exceeds the storage limit')
+            os.replace(temp_path, filepath)
+        except BaseException as e:
+            # errors of the request stream (e.g. a disconnected client) are raised again after the cleanup
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            if not isinstance(e, (OSError, ValueError)):
+                raise
+            return None
+        
+        if self.digest_index is not None:
+            self.digest_index.put(user_ref, filepath, os.stat(filepath), digests)
+        return digests
+    
+    
+    def get_signature(self, user_ref, path, block_size=None):
+        """Get the block signature of a file for a delta upload. The signature is
+        read from the digest index, only if the file is unknown or changed it is
+        computed on the thread pool.
+
+        :param user_ref: The user that wants to get the signature
+        :type user_ref: str
+        :param path: Path to the file
+        :type path: str
+        :param block_size: Block size of the signature, defaults to None (delta_block_size)
+        :type block_size: int, optional
+        :return: The signature or None if the path is invalid or no file
+        :rtype: dict or None
+        """
+        if not self.is_secure_path(user_ref, path):
+            return None
+        block_size = min(max(block_size or self.delta_block_size, 1024), 16 * 1024 * 1024)
+        
+        filepath = self.get_full_filepath(user_ref, path)
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        if not os.path.isfile(filepath):
+            return None
+        
+        if self.digest_index is not None:
+            signature = self.digest_index.get_signature(user_ref, filepath, stat, block_size)
+            if signature is not None:
+                return signature
+        
+        signature = self.hash_executor.submit(compute_signature, filepath, block_size).result()
+        if self.digest_index is not None and os.stat(filepath).st_mtime_ns == stat.st_mtime_ns:
+            self.digest_index.put_signature(user_ref, filepath, stat, signature)
+        return signature
+    
+    
+    def upload_delta(self, user_ref, path, delta, block_size, expected_digests=None):
+        """Reconstructs a new version of a file from the existing file and a delta.
+        The new version is written to a temporary file inside the users storage
+        and replaces the existing file afterwards.
+
+        :param user_ref: The user that uploads the delta
+        :type user_ref: str
+        :param path: Path to the file
+        :type path: str
+        :param delta: Binary stream with the delta, see cc_cloud.service.delta.compute_delta
+        :type delta: io.RawIOBase
+        :param block_size: Block size of the signature the delta is based on
+        :type block_size: int
+        :param expected_digests: The file is only replaced if the new version has these digests, defaults to None
+        :type expected_digests: dict, optional
+        :return: Digests of the new version or None if the delta was not applied
+        :rtype: dict or None
+        """
+        if not self.is_secure_path(user_ref, path) or not block_size or block_size <= 0:
+            return None
+        
+        filepath = self.get_full_filepath(user_ref, path)
+        old_filepath = filepath if os.path.isfile(filepath) else None
+        if self.create_directories(user_ref, {os.path.dirname(filepath)}):
+            return None
+        
+        digests = self.write_file(
+            user_ref,
+            filepath,
+            lambda new_file: apply_delta(old_filepath, delta, new_file, block_size),
+            expected_digests=expected_digests)
+        if digests is not None:
+            try:
+                shutil.chown(filepath, user_ref, user_ref)
+            except (OSError, LookupError):
+                return None
+        return digests
+    
+    
+    def get_checksum(self, user_ref, path):
+        """Get the digests of a file. The digests are read from the digest index,
+        only if the file is unknown or changed it is hashed on the thread pool.
+
+        :param user_ref: The user that wants to get the checksum
+        :type user_ref: str
+        :param path: Path to the file
+        :type path: str
+        :return: Digests of the file or None if the path is invalid or no file
+        :rtype: dict or None
+        """
+        if not self.is_secure_path(user_ref, path):
+            return None
+        
+        return self.get_file_digests(user_ref, self.get_full_filepath(user_ref, path))
+    
+    
+    def get_file_digests(self, user_ref, filepath, stat=None):
+        """Get the digests of a file from the digest index or hash it on the thread pool.
+
+        :param user_ref: The user the file belongs to
+        :type user_ref: str
+        :param filepath: Absolute path of the file
+        :type filepath: str
+        :param stat: Stat result of the file, defaults to None
+        :type stat: os.stat_result, optional
+        :return: Digests of the file or None if the path is no file
+        :rtype: dict or None
+        """
+        try:
+            if stat is None:
+                stat = os.stat(filepath)
+        except OSError:
+            return None
+        if not os.path.isfile(filepath):
+            return None
+        
+        if self.digest_index is not None:
+            digests = self.digest_index.get(user_ref, filepath, stat, self.digest_algorithms)
+            if digests is not None:
+                return digests
+        
+        digests = self.hash_executor.submit(hash_file, filepath, self.digest_algorithms).result()
+        if self.digest_index is not None and os.stat(filepath).st_mtime_ns == stat.st_mtime_ns:
+            self.digest_index.put(user_ref, filepath, stat, digests)
+        return digests
+    
+    
+    def compare_file(self, user_ref, filepath, size, expected_digests):
+        """Compares an existing file with the expected size and digests. The size is
+        compared first, so the file is only hashed if the size matches.
+
+        :param user_ref: The user the file belongs to
+        :type user_ref: str
+        :param filepath: Absolute path of the file
+        :type filepath: str
+        :param size: Expected size of the file or None if unknown
+        :type size: int or None
+        :param expected_digests: Expected hex digest for one or more algorithms
+        :type expected_digests: dict
+        :return: 'match', 'differs' or 'missing'
+        :rtype: str
+        """
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return 'missing'
+        if not os.path.isfile(filepath):
+            return 'missing'
+        if size is not None and stat.st_size != size:
+            return 'differs'
+        
+        digests = self.get_file_digests(user_ref, filepath, stat)
+        if digests is None:
+            return 'missing'
+        return 'match' if all(digests.get(algorithm) == value.lower() for algorithm, value in expected_digests.items()) else 'differs'
+    
+    
+    def check_files(self, user_ref, entries):
+        """Checks which files already exist with the expected size and digests,
+        so the client only has to upload the other files.
+
+        :param user_ref: The user that wants to check the files
+        :type user_ref: str
+        :param entries: Entries containing path, optional size and the hex digest of at least one of the digest_algorithms
+        :type entries: list[dict]
+        :return: path and status ('match', 'differs', 'missing' or 'invalid') for each entry
+        :rtype: list[dict]
+        """
+        results = []
+        for entry in entries:
+            path = entry.get('path') if isinstance(entry, dict) else None
+            expected_digests = {
+                algorithm: entry[algorithm] for algorithm in self.digest_algorithms
+                if isinstance(entry, dict) and isinstance(entry.get(algorithm), str)
+            }
+            if not isinstance(path, str) or not expected_digests or not self.is_secure_path(user_ref, path):
+                results.append({'path': path, 'status': 'invalid'})
+                continue
+            
+            filepath = self.get_full_filepath(user_ref, path)
+            status = self.compare_file(user_ref, filepath, entry.get('size'), expected_digests)
+            results.append({'path': path, 'status': status})
+        return results
+    
+    
+    def parse_expected_digests(self, value):
+        """Parses the value of an If-None-Match header. The value is either a hex
+        digest of the first digest algorithm or "<algorithm>:<hex digest>".
+
+        :param value: Header value, e.g. '"sha256:9f86d081..."'
+        :type value: str
+        :return: Expected hex digest for the algorithm or None if the algorithm is unknown
+        :rtype: dict or None
+        """
+        value = value.strip()
+        if value.startswith('W/'):
+            value = value[2:]
+        value = value.strip('"')
+        algorithm, _, digest = value.rpartition(':')
+        if not algorithm:
+            algorithm = self.digest_algorithms[0]
+        if algorithm not in self.digest_algorithms or not digest:
+            return None
+        return {algorithm: digest}
     
     
     def delete_file(self, user_ref, path):
@@ -74,6 +501,7 @@ class FileService:
             return False
         
         filepath = self.get_full_filepath(user_ref, path)
+        size = self.get_element_size(filepath) if self.storage is not None else 0
         if os.path.isfile(filepath):
             try:
                 os.remove(filepath)
@@ -85,9 +513,76 @@ class FileService:
             except (OSError, FileNotFoundError):
                 return False
         
+        if self.storage is not None:
+            self.storage.account(user_ref, -size)
+        if self.digest_index is not None:
+            self.digest_index.remove(user_ref, filepath)
         return True
     
     
+    def list_files(self, user_ref, path=''):
+        """Lists the files inside a directory of the users storage recursively.
+        Temporary files of running uploads are not listed.
+
+        :param user_ref: The user whose files are listed
+        :type user_ref: str
+        :param path: Path to a directory or a file, defaults to '' (all files)
+        :type path: str, optional
+        :return: path, size and mtime of each file, None if the path is invalid or does not exist
+        :rtype: list[dict] or None
+        """
+        path = path or ''
+        if not self.is_secure_path(user_ref, path):
+            return None
+        
+        upload_dir = self.get_user_upload_directory(user_ref)
+        filepath = self.get_full_filepath(user_ref, path)
+        if os.path.isfile(filepath):
+            candidates = [filepath]
+        elif os.path.isdir(filepath):
+            candidates = (
+                os.path.join(root, filename)
+                for root, _, files in os.walk(filepath)
+                for filename in files
+                if not (filename.startswith('.') and filename.endswith('.upload'))
+            )
+        else:
+            return None
+        
+        entries = []
+        for candidate in candidates:
+            try:
+                stat = os.stat(candidate)
+            except FileNotFoundError:
+                continue
+            entries.append({
+                'path': os.path.relpath(candidate, upload_dir),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns / 1e9,
+            })
+        return entries
+    
+    
+    def get_element_size(self, path):
+        """Get the size of a file or the size of all files inside a directory.
+
+        :param path: Path to the file or directory
+        :type path: str
+        :return: Size in bytes, 0 if the path does not exist
+        :rtype: int
+        """
+        if os.path.isfile(path):
+            return os.path.getsize(path)
+        size = 0
+        for root, _, files in os.walk(path):
+            for filename in files:
+                try:
+                    size += os.lstat(os.path.join(root, filename)).st_size
+                except FileNotFoundError:
+                    pass
+        return size
+    
+    
     def is_secure_path(self, user_ref, path):
         """Checks if the given path is within the users storage space.
 
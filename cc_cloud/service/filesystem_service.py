@@ -1,6 +1,11 @@
 import os
+import re
 import shutil
 import pwd
+import threading
+from contextlib import contextmanager
+
+from werkzeug.exceptions import ServiceUnavailable
 
 class FilesystemService:
     
@@ -18,6 +23,10 @@ class FilesystemService:
         self.userhome_directory = conf.d.get('userhome_directory', '/var/lib/cc_cloud/home')
         self.filesystem_dir = conf.d.get('filesystem_directory', '/var/lib/cc_cloud/filesystems')
         self.user_storage_limit = conf.d.get('user_storage_limit', 52428800)
+        self.mount_options = conf.d.get('filesystem_mount_options', 'discard')
+        self.lock_timeout = conf.d.get('filesystem_lock_timeout', 30)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
         
     def create(self, fs_name, size=None):
         """Creates a new File image and reserves storage space for it.
@@ -77,7 +86,8 @@ class FilesystemService:
             elements = os.listdir(self.filesystem_dir)
             for el in elements:
                 el_path = os.path.join(self.filesystem_dir, el)
-                if os.path.isfile(el_path):
+                # hidden files are temporary copies, e.g. of a running restore
+                if os.path.isfile(el_path) and not el.startswith('.'):
                     filesystems.append(el)
         except FileNotFoundError:
             pass
@@ -105,7 +115,8 @@ class FilesystemService:
         """
         filepath = self.get_filepath(fs_name)
         mountpoint = self.get_mountpoint(fs_name)
-        os.system(f"mount '{filepath}' '{mountpoint}'")
+        options = f"-o '{self.mount_options}' " if self.mount_options else ''
+        os.system(f"mount {options}'{filepath}' '{mountpoint}'")
         self.set_directory_owner(fs_name)
     
     def umount(self, fs_name):
@@ -113,9 +124,25 @@ class FilesystemService:
 
         :param fs_name: Umount the filesystem with the name fs_name
         :type fs_name: str
+        :return: Returns True if the filesystem was unmounted
+        :rtype: bool
         """
         filepath = self.get_filepath(fs_name)
-        os.system(f"umount '{filepath}'")
+        return os.system(f"umount '{filepath}'") == 0
+    
+    def trim(self, fs_name):
+        """Discard the unused blocks of the mounted filesystem, so the space
+        is released in the image file on the host.
+
+        :param fs_name: Trim the filesystem with the name fs_name
+        :type fs_name: str
+        :return: Return True if the filesystem was trimmed
+        :rtype: bool
+        """
+        if not self.is_mounted(fs_name):
+            return False
+        mountpoint = self.get_mountpoint(fs_name)
+        return os.system(f"fstrim '{mountpoint}'") == 0
     
     def is_mounted(self, fs_name):
         """Check if the filesystem is mounted.
@@ -129,20 +156,116 @@ class FilesystemService:
         exitcode = os.system(f"mountpoint -q '{mountpoint}'") # returns 0 if the directory is a mountpoint
         return not exitcode
     
+    def find_mounted_filesystems(self):
+        """Get all filesystems that are mounted at a mountpoint of a user.
+        The mount table is read once from /proc/self/mountinfo.
+
+        :return: Names of the mounted filesystems
+        :rtype: list[str]
+        """
+        mounted = []
+        try:
+            with open('/proc/self/mountinfo') as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            return mounted
+        for line in lines:
+            # the mountpoint is the fifth field, special characters are escaped as octal numbers
+            mountpoint = re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), line.split()[4])
+            user_dir, upload_dir = os.path.split(mountpoint)
+            if upload_dir == self.upload_directory_name and os.path.dirname(user_dir) == self.userhome_directory:
+                mounted.append(os.path.basename(user_dir))
+        return mounted
+    
+    def is_in_use(self, fs_name):
+        """Check if processes of the cloud user are running, e.g. a SFTP session
+        that holds the chroot of the user.
+
+        :param fs_name: Check the user of the filesystem with the name fs_name
+        :type fs_name: str
+        :return: Return True if the filesystem is in use
+        :rtype: bool
+        """
+        exitcode = os.system(f"pgrep -u '{fs_name}' > /dev/null 2>&1") # returns 0 if a process was found
+        return not exitcode
+    
     def increse_size(self, fs_name, size):
-        """Increses the size of the filesystem.
+        """Increses the size of the filesystem. A mounted filesystem is grown online
+        through its loop device, an unmounted image is checked and grown directly.
 
         :param fs_name: Increse size of the filesystem with the name fs_name
         :type fs_name: str
         :param size: The size of the file system is set to the specified size
         :type size: int
+        :return: Returns True if the filesystem was grown
+        :rtype: bool
         """
         filepath = self.get_filepath(fs_name)
+        mounted = self.is_mounted(fs_name)
         with open(filepath, 'a') as file:
             file.truncate(size)
-        lo_device = self.get_loop_device(filepath)
-        os.system(f"losetup -c '{lo_device}'")
-        os.system(f"resize2fs '{lo_device}'")
+        if mounted:
+            lo_device = self.get_loop_device(filepath)
+            return bool(lo_device) \
+                and os.system(f"losetup -c '{lo_device}'") == 0 \
+                and os.system(f"resize2fs '{lo_device}'") == 0
+        # e2fsck exits with 1 if errors were corrected, everything above is a failure
+        return os.system(f"e2fsck -f -y '{filepath}'") >> 8 <= 1 \
+            and os.system(f"resize2fs '{filepath}'") == 0
+    
+    def shrink_size(self, fs_name, size):
+        """Shrinks the filesystem without losing data. The filesystem is
+        unmounted, checked and resized. It is not mounted again, the caller
+        mounts it through the mount manager if it was mounted before.
+
+        :param fs_name: Shrink the filesystem with the name fs_name
+        :type fs_name: str
+        :param size: The size of the file system is set to the specified size
+        :type size: int
+        :return: Returns True if the filesystem was shrunk
+        :rtype: bool
+        """
+        if self.get_used_size(fs_name) > size:
+            return False
+        
+        filepath = self.get_filepath(fs_name)
+        size = size // 1024 * 1024
+        
+        if self.is_mounted(fs_name):
+            self.umount(fs_name)
+            if self.is_mounted(fs_name):
+                return False
+        
+        # e2fsck exits with 1 if errors were corrected, everything above is a failure
+        resized = os.system(f"e2fsck -f -y '{filepath}'") >> 8 <= 1 \
+            and os.system(f"resize2fs '{filepath}' {size // 1024}K") == 0
+        if resized:
+            with open(filepath, 'a') as file:
+                file.truncate(size)
+        return resized
+    
+    def resize(self, fs_name, size):
+        """Sets the filesystem to the given size. Growing is done online,
+        shrinking keeps the data of the filesystem but leaves it unmounted.
+        The user lock is held during the resize, so other requests of the
+        user wait for it.
+
+        :param fs_name: Resize the filesystem with the name fs_name
+        :type fs_name: str
+        :param size: The size of the file system is set to the specified size
+        :type size: int
+        :return: Returns True if the filesystem was resized
+        :rtype: bool
+        """
+        with self.lock(fs_name):
+            if not self.filessystem_exists(fs_name):
+                return False
+            current_size = self.get_size(fs_name)
+            if size > current_size:
+                return self.increse_size(fs_name, size)
+            elif size < current_size:
+                return self.shrink_size(fs_name, size)
+            return True
     
     def reduce_size(self, fs_name, size):
         """Reduces the size of the filesystem.
@@ -169,6 +292,67 @@ class FilesystemService:
         filepath = self.get_filepath(fs_name)
         return os.path.getsize(filepath)
     
+    def get_disk_usage(self, fs_name):
+        """Get the apparent size of the image file and the space it
+        allocates on the host.
+
+        :param fs_name: Get disk usage of the filesystem with the name fs_name
+        :type fs_name: str
+        :return: Dictionary with apparent_size and allocated_size in bytes
+        :rtype: dict
+        """
+        stat = os.stat(self.get_filepath(fs_name))
+        return {
+            'apparent_size': stat.st_size,
+            'allocated_size': stat.st_blocks * 512,
+        }
+    
+    def get_used_size(self, fs_name):
+        """Get the space used inside the mounted filesystem.
+
+        :param fs_name: Get used space of the filesystem with the name fs_name
+        :type fs_name: str
+        :return: Used space in bytes, 0 if the filesystem is not mounted
+        :rtype: int
+        """
+        if not self.is_mounted(fs_name):
+            return 0
+        stat = os.statvfs(self.get_mountpoint(fs_name))
+        return (stat.f_blocks - stat.f_bfree) * stat.f_frsize
+    
+    def get_free_size(self, fs_name):
+        """Get the space left inside the mounted filesystem.
+
+        :param fs_name: Get free space of the filesystem with the name fs_name
+        :type fs_name: str
+        :return: Free space in bytes
+        :rtype: int
+        """
+        stat = os.statvfs(self.get_mountpoint(fs_name))
+        return stat.f_bavail * stat.f_frsize
+    
+    def account(self, fs_name, delta):
+        """Account a change of the stored data. The size of an image is enforced
+        by the filesystem itself, so every change is accepted.
+
+        :param fs_name: Name of the filesystem that changed
+        :type fs_name: str
+        :param delta: Number of bytes that were added (positive) or removed (negative)
+        :type delta: int
+        :return: Returns True if the change fits into the filesystem
+        :rtype: bool
+        """
+        return True
+    
+    def refresh_usage(self, fs_name):
+        """The used space of an image is read from the filesystem itself,
+        there is no usage index to refresh.
+
+        :param fs_name: Name of the filesystem
+        :type fs_name: str
+        """
+        pass
+    
     def get_loop_device(self, filepath):
         """Get the loop device of the mounted filesystem.
 
@@ -201,6 +385,24 @@ class FilesystemService:
         """
         return os.path.join(self.userhome_directory, fs_name, self.upload_directory_name)
     
+    @contextmanager
+    def lock(self, fs_name):
+        """Holds the lock of the filesystem. If the lock is not released within
+        lock_timeout seconds, ServiceUnavailable is raised.
+
+        :param fs_name: Lock the filesystem with the name fs_name
+        :type fs_name: str
+        :raise ServiceUnavailable: if the filesystem is locked for too long
+        """
+        with self._locks_lock:
+            fs_lock = self._locks.setdefault(fs_name, threading.RLock())
+        if not fs_lock.acquire(timeout=self.lock_timeout):
+            raise ServiceUnavailable(description=f'filesystem {fs_name} is busy')
+        try:
+            yield
+        finally:
+            fs_lock.release()
+    
     def exists_or_create(self, fs_name):
         """Checks if the filesystem already exists is mounted.
         If not a new filesystem will be created and mounted.
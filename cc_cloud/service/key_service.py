@@ -0,0 +1,193 @@
+import os
+import time
+import base64
+import binascii
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+KEY_TYPES = {
+    'ssh-rsa', 'ssh-dss', 'ssh-ed25519',
+    'ecdsa-sha2-nistp256', 'ecdsa-sha2-nistp384', 'ecdsa-sha2-nistp521',
+    'sk-ssh-ed25519@openssh.com', 'sk-ecdsa-sha2-nistp256@openssh.com',
+}
+
+
+def normalize_key(key):
+    """Checks that the key is a single public ssh-key in the authorized_keys format
+    (without options) and removes surrounding whitespace.
+
+    :param key: The public ssh-key, e.g. 'ssh-ed25519 AAAA... user@host'
+    :type key: str
+    :return: The normalized key or None if the key is invalid
+    :rtype: str or None
+    """
+    if not isinstance(key, str) or '\n' in key.strip() or '\r' in key:
+        return None
+    parts = key.strip().split(None, 2)
+    if len(parts) < 2 or parts[0] not in KEY_TYPES:
+        return None
+    try:
+        blob = base64.b64decode(parts[1], validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    # the blob starts with the length prefixed key type
+    if blob[4:4 + len(parts[0])] != parts[0].encode():
+        return None
+    return ' '.join(parts)
+
+
+class KeyService:
+
+    def __init__(self, conf, mongo):
+        """Create a new instance of KeyService. The public ssh-keys of the cloud users
+        are stored in the authorized_keys list of the cloud_users collection. Lookups
+        are served from a local SQLite snapshot, which is refreshed from the database
+        after cache_ttl seconds, so SFTP logins usually don't query the database.
+
+        :param conf: Configuration to load values from
+        :type conf: cc_agency.commons.conf.Conf
+        :param mongo: The database
+        :type mongo: cc_agency.commons.db.Mongo
+        """
+        self.mongo = mongo
+        self.cache_file = conf.d.get('authorized_keys_cache_file', '/var/lib/cc_cloud/authorized_keys.sqlite')
+        self.cache_ttl = conf.d.get('authorized_keys_cache_ttl', 60)
+        self.max_keys = conf.d.get('max_authorized_keys', 20)
+        self._local = threading.local()
+
+
+    def _connect(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.cache_file) or '.', exist_ok=True)
+            connection = sqlite3.connect(self.cache_file, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS authorized_keys (ssh_user TEXT, key TEXT, PRIMARY KEY (ssh_user, key))')
+            connection.execute('CREATE TABLE IF NOT EXISTS snapshot (id INTEGER PRIMARY KEY, refreshed REAL)')
+            self._local.connection = connection
+        return connection
+
+
+    def _is_stale(self, connection):
+        row = connection.execute('SELECT refreshed FROM snapshot WHERE id = 0').fetchone()
+        return row is None or time.time() - row[0] > self.cache_ttl
+
+
+    def refresh(self, force=False):
+        """Replaces the snapshot with the keys of all users from the database, if the snapshot
+        is older than cache_ttl seconds. Concurrent refreshes are serialized by SQLite and
+        only the first one queries the database.
+
+        :param force: Refresh even if the snapshot is not stale, defaults to False
+        :type force: bool, optional
+        """
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if force or self._is_stale(connection):
+                rows = self.mongo.db['cloud_users'].find(
+                    {'authorized_keys': {'$exists': True, '$ne': []}},
+                    {'ssh_user': 1, 'authorized_keys': 1}
+                )
+                connection.execute('DELETE FROM authorized_keys')
+                connection.executemany(
+                    'INSERT OR IGNORE INTO authorized_keys VALUES (?, ?)',
+                    ((row['ssh_user'], key) for row in rows if row.get('ssh_user') for key in row['authorized_keys'])
+                )
+                connection.execute('INSERT OR REPLACE INTO snapshot VALUES (0, ?)', (time.time(),))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+
+    def lookup(self, ssh_user):
+        """Get the keys of the local user for sshd's AuthorizedKeysCommand. If the snapshot
+        is stale it is refreshed first. If the database is not reachable the stale snapshot is used.
+
+        :param ssh_user: Name of the local Linux user
+        :type ssh_user: str
+        :return: The public ssh-keys of the user
+        :rtype: list[str]
+        """
+        connection = self._connect()
+        if self._is_stale(connection):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('refreshing the authorized keys failed, using the cached keys')
+        rows = connection.execute('SELECT key FROM authorized_keys WHERE ssh_user = ?', (ssh_user,)).fetchall()
+        return [row[0] for row in rows]
+
+
+    def get_keys(self, username):
+        """Get the keys of the cloud user from the database.
+
+        :param username: Name of the cc-agency user
+        :type username: str
+        :return: The public ssh-keys of the user
+        :rtype: list[str]
+        """
+        row = self.mongo.db['cloud_users'].find_one({'username': username}, {'authorized_keys': 1})
+        return row.get('authorized_keys', []) if row else []
+
+
+    def add_key(self, username, ssh_user, key):
+        """Adds the key to the keys of the cloud user. The snapshot is updated
+        immediately, so the key can be used for the next login.
+
+        :param username: Name of the cc-agency user
+        :type username: str
+        :param ssh_user: Name of the local Linux user
+        :type ssh_user: str
+        :param key: The public ssh-key
+        :type key: str
+        :return: Returns False if the key is invalid or the user has too many keys
+        :rtype: bool
+        """
+        key = normalize_key(key)
+        if key is None:
+            return False
+        keys = self.get_keys(username)
+        if key not in keys and len(keys) >= self.max_keys:
+            return False
+
+        self.mongo.db['cloud_users'].update_one(
+            {'username': username},
+            {'$set': {'ssh_user': ssh_user}, '$addToSet': {'authorized_keys': key}},
+            upsert=True
+        )
+        self._connect().execute('INSERT OR IGNORE INTO authorized_keys VALUES (?, ?)', (ssh_user, key))
+        return True
+
+
+    def remove_key(self, username, ssh_user, key):
+        """Removes the key from the keys of the cloud user and from the snapshot.
+
+        :param username: Name of the cc-agency user
+        :type username: str
+        :param ssh_user: Name of the local Linux user
+        :type ssh_user: str
+        :param key: The public ssh-key
+        :type key: str
+        :return: Returns False if the user has no such key
+        :rtype: bool
+        """
+        key = normalize_key(key)
+        if key is None:
+            return False
+        result = self.mongo.db['cloud_users'].update_one({'username': username}, {'$pull': {'authorized_keys': key}})
+        self._connect().execute('DELETE FROM authorized_keys WHERE ssh_user = ? AND key = ?', (ssh_user, key))
+        return result.modified_count > 0
+
+
+    def forget(self, ssh_user):
+        """Removes all keys of the local user from the snapshot, e.g. because the user was removed.
+
+        :param ssh_user: Name of the local Linux user
+        :type ssh_user: str
+        """
+        self._connect().execute('DELETE FROM authorized_keys WHERE ssh_user = ?', (ssh_user,))
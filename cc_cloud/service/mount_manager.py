@@ -0,0 +1,159 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class MountManager:
+
+    def __init__(self, backend, max_mounts=None, idle_timeout=None, clock=time.monotonic):
+        """Create a new instance of MountManager. The manager keeps track of the
+        mounted filesystems and unmounts the least recently used ones, if more than
+        max_mounts filesystems are mounted or if a filesystem was not used for
+        idle_timeout seconds. Filesystems that are in use (e.g. by a SFTP session)
+        or pinned by a request are never unmounted. Filesystems that fail to unmount stay tracked.
+
+        :param backend: Backend that mounts the filesystems, usually a FilesystemService
+        :type backend: cc_cloud.service.filesystem_service.FilesystemService
+        :param max_mounts: Maximum number of mounted filesystems, defaults to None (unlimited)
+        :type max_mounts: int, optional
+        :param idle_timeout: Seconds after which an unused filesystem is unmounted, defaults to None (never)
+        :type idle_timeout: float, optional
+        :param clock: Function returning the current time in seconds, defaults to time.monotonic
+        :type clock: callable, optional
+        """
+        self.backend = backend
+        self.max_mounts = max_mounts
+        self.idle_timeout = idle_timeout
+        self.clock = clock
+        self._mounts = OrderedDict()
+        self._pins = {}
+        self._lock = threading.Lock()
+
+
+    def acquire(self, fs_name, pin=False):
+        """Make sure the filesystem is mounted and mark it as recently used.
+        Afterwards idle filesystems and filesystems above the limit are unmounted.
+
+        :param fs_name: Name of the filesystem that will be used
+        :type fs_name: str
+        :param pin: Keep the filesystem mounted until unpin is called, defaults to False
+        :type pin: bool, optional
+        """
+        with self._lock:
+            if fs_name in self._mounts:
+                self._mounts.move_to_end(fs_name)
+            else:
+                self.backend.exists_or_create(fs_name)
+            self._mounts[fs_name] = self.clock()
+            if pin:
+                self._pins[fs_name] = self._pins.get(fs_name, 0) + 1
+            self._release_mounts(keep=fs_name)
+
+
+    def unpin(self, fs_name):
+        """Release a pin of acquire, the filesystem can be unmounted again
+        once all pins are released.
+
+        :param fs_name: Name of the filesystem
+        :type fs_name: str
+        """
+        with self._lock:
+            pins = self._pins.get(fs_name, 0) - 1
+            if pins > 0:
+                self._pins[fs_name] = pins
+            else:
+                self._pins.pop(fs_name, None)
+
+
+    def adopt(self, fs_names):
+        """Track filesystems that were already mounted, e.g. by the startup hook
+        before the workers were forked. They are treated as least recently used.
+
+        :param fs_names: Names of the mounted filesystems
+        :type fs_names: list[str]
+        """
+        with self._lock:
+            now = self.clock()
+            for fs_name in reversed(fs_names):
+                if fs_name not in self._mounts:
+                    self._mounts[fs_name] = now
+                    self._mounts.move_to_end(fs_name, last=False)
+
+
+    def has_capacity(self):
+        """Check if another filesystem can be mounted without unmounting one.
+
+        :return: Returns True if the limit of mounted filesystems is not reached
+        :rtype: bool
+        """
+        with self._lock:
+            return not self.max_mounts or len(self._mounts) < self.max_mounts
+
+
+    def keeps_all_mounted(self):
+        """Check if filesystems are never unmounted by this manager.
+
+        :return: Returns True if neither max_mounts nor idle_timeout is set
+        :rtype: bool
+        """
+        return not self.max_mounts and self.idle_timeout is None
+
+
+    def is_mounted(self, fs_name):
+        """Check if the filesystem is mounted by this manager.
+
+        :param fs_name: Name of the filesystem
+        :type fs_name: str
+        :return: Returns True if the filesystem is mounted
+        :rtype: bool
+        """
+        with self._lock:
+            return fs_name in self._mounts
+
+
+    def mounted_filesystems(self):
+        """Get the filesystems mounted by this manager, least recently used first.
+
+        :return: Names of the mounted filesystems
+        :rtype: list[str]
+        """
+        with self._lock:
+            return list(self._mounts)
+
+
+    def forget(self, fs_name):
+        """Stop tracking the filesystem, e.g. because it was unmounted or deleted.
+
+        :param fs_name: Name of the filesystem
+        :type fs_name: str
+        """
+        with self._lock:
+            self._mounts.pop(fs_name, None)
+
+
+    def unmount_idle(self):
+        """Unmount the filesystems that were idle for more than idle_timeout seconds
+        and the least recently used filesystems above the limit.
+        """
+        with self._lock:
+            self._release_mounts()
+
+
+    def _release_mounts(self, keep=None):
+        now = self.clock()
+        for fs_name, last_used in list(self._mounts.items()):
+            over_limit = self.max_mounts and len(self._mounts) > self.max_mounts
+            idle = self.idle_timeout is not None and now - last_used > self.idle_timeout
+            if not (over_limit or idle):
+                # entries are ordered by last use, all following entries are newer
+                break
+            if fs_name == keep or fs_name in self._pins:
+                continue
+            if self.backend.is_in_use(fs_name):
+                self._mounts[fs_name] = now
+                self._mounts.move_to_end(fs_name)
+                continue
+            if not self.backend.umount(fs_name):
+                # still busy (e.g. an open download), keep tracking it and try again later
+                continue
+            del self._mounts[fs_name]
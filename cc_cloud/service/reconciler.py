@@ -0,0 +1,142 @@
+import pwd
+import time
+import logging
+import threading
+
+from cc_cloud.system.local_user import LocalUser
+from cc_cloud.service.fair_share import LIMIT_FIELDS
+
+
+logger = logging.getLogger(__name__)
+
+
+class Reconciler:
+
+    def __init__(self, cloud_service, interval=None, delete_orphans=False):
+        """Create a new instance of Reconciler. The reconciler compares the cloud
+        users in the database, the local Linux users, the filesystem images and
+        the mount table and repairs the differences.
+
+        :param cloud_service: The cloud service whose state is reconciled
+        :type cloud_service: cc_cloud.service.cloud_service.CloudService
+        :param interval: Seconds between two runs in the background, defaults to None (no background runs)
+        :type interval: float, optional
+        :param delete_orphans: Delete images that belong to no user, defaults to False
+        :type delete_orphans: bool, optional
+        """
+        self.cloud_service = cloud_service
+        self.interval = interval
+        self.delete_orphans = delete_orphans
+        self.last_report = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+
+    def start(self):
+        """Run the reconciler every interval seconds in a background thread.
+        """
+        if not self.interval or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='cc-cloud-reconciler', daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        """Stop the background thread.
+        """
+        self._stop.set()
+
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.reconcile()
+            except Exception:
+                logger.exception('reconciling the cloud state failed')
+
+
+    def reconcile(self):
+        """Reads the four sources of the cloud state in bulk and repairs the differences:
+        stale database rows are removed, missing Linux users are created, orphan images
+        are unmounted (and deleted if delete_orphans is set), missing mounts are mounted
+        and mounts without an image are unmounted. The usage of each user is refreshed,
+        so changes made via SFTP count against the storage limit. Rows that hold
+        authorized keys or transfer limit overrides are never removed, the Linux user
+        is created again instead.
+
+        :return: Report of the found differences
+        :rtype: dict
+        """
+        with self._lock:
+            cloud_service = self.cloud_service
+            filesystem_service = cloud_service.filesystem_service
+            mount_manager = cloud_service.mount_manager
+
+            projection = {'username': 1, 'ssh_user': 1, 'ssh_password': 1, 'authorized_keys': 1}
+            projection.update({field: 1 for field in LIMIT_FIELDS})
+            db_users = {
+                row['ssh_user']: row
+                for row in cloud_service.mongo.db['cloud_users'].find({}, projection)
+                if row.get('ssh_user')
+            }
+            # these rows hold the only copy of the data, they must not be removed
+            keep_rows = {
+                user_ref for user_ref, row in db_users.items()
+                if row.get('authorized_keys') or any(row.get(field) is not None for field in LIMIT_FIELDS)
+            }
+            prefix = cloud_service.user_prefix + '-'
+            local_users = {entry.pw_name for entry in pwd.getpwall() if entry.pw_name.startswith(prefix)}
+            images = set(filesystem_service.find_all_filesystems())
+            mounts = set(filesystem_service.find_mounted_filesystems())
+
+            report = {
+                'time': time.time(),
+                'stale_db_rows': sorted(set(db_users) - local_users - images - keep_rows),
+                'missing_local_users': sorted(((set(db_users) & images) | keep_rows) - local_users),
+                'orphan_images': sorted(images - set(db_users) - local_users),
+                'stale_mounts': sorted(mounts - images),
+            }
+
+            for user_ref in report['stale_db_rows']:
+                cloud_service.mongo.db['cloud_users'].delete_one({'ssh_user': user_ref})
+
+            for user_ref in report['missing_local_users']:
+                local_user = LocalUser(user_ref, cloud_service.home_dir)
+                local_user.create()
+                local_user.set_password(db_users[user_ref].get('ssh_password'))
+                local_users.add(user_ref)
+
+            for user_ref in report['orphan_images']:
+                mount_manager.forget(user_ref)
+                if user_ref in mounts:
+                    filesystem_service.umount(user_ref)
+                if self.delete_orphans:
+                    filesystem_service.delete(user_ref)
+
+            for user_ref in report['stale_mounts']:
+                mount_manager.forget(user_ref)
+                filesystem_service.umount(user_ref)
+
+            tracked = set(mount_manager.mounted_filesystems())
+            for user_ref in tracked - images:
+                mount_manager.forget(user_ref)
+
+            expected = tracked & images
+            if mount_manager.keeps_all_mounted():
+                expected |= images - set(report['orphan_images'])
+            report['missing_mounts'] = sorted(expected - mounts)
+
+            for user_ref in report['missing_mounts']:
+                mount_manager.forget(user_ref)
+                with filesystem_service.lock(user_ref):
+                    mount_manager.acquire(user_ref)
+
+            mount_manager.unmount_idle()
+
+            for user_ref in sorted(images - set(report['orphan_images'])):
+                filesystem_service.refresh_usage(user_ref)
+
+            cloud_service.provisioned = set(db_users) & local_users
+            self.last_report = report
+            return report
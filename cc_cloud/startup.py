@@ -0,0 +1,57 @@
+import sys
+import time
+import cProfile
+import pstats
+from argparse import ArgumentParser
+
+from cc_agency.commons.conf import Conf
+
+from cc_cloud.db import LazyMongo
+from cc_cloud.service.cloud_service import CloudService
+
+
+DESCRIPTION = 'Mounts the CC-Cloud file systems once before the workers of the webinterface are forked.'
+
+
+def profiled(func, enabled, *args, **kwargs):
+    """Calls func and prints the duration and a profile of the call to stderr, if enabled is set.
+
+    :param func: The function to call
+    :type func: callable
+    :param enabled: Profile the call
+    :type enabled: bool
+    :return: result of func
+    """
+    if not enabled:
+        return func(*args, **kwargs)
+
+    profile = cProfile.Profile()
+    start = time.perf_counter()
+    result = profile.runcall(func, *args, **kwargs)
+    print(f'{func.__qualname__} took {time.perf_counter() - start:.3f}s', file=sys.stderr)
+    pstats.Stats(profile, stream=sys.stderr).sort_stats('cumulative').print_stats(30)
+    return result
+
+
+def create_parser():
+    parser = ArgumentParser(description=DESCRIPTION)
+    parser.add_argument(
+        '-c', '--conf-file', action='store', type=str, metavar='CONF_FILE',
+        help='CONF_FILE (yaml) as local path.'
+    )
+    parser.add_argument(
+        '--profile-startup', action='store_true',
+        help='Print the duration and a profile of the startup to stderr.'
+    )
+    return parser
+
+
+def main(argv=None):
+    args = create_parser().parse_args(argv)
+    conf = Conf(args.conf_file)
+    cloud = CloudService(conf, LazyMongo(conf))
+    profiled(cloud.mount_filesystems, args.profile_startup)
+
+
+if __name__ == '__main__':
+    main()
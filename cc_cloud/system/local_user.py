@@ -77,19 +77,3 @@ class LocalUser:
         except KeyError:
             return False
         return True
-    
-    
-    def set_authorized_key(self, key):
-        """Adds the key to the user's authorized_keys file. If a key already
-        exists in the file, it will be overwritten.
-
-        :param key: public ssh-key, that will be added to the authorized_keys file
-        :type key: str
-        """
-        key_dir = os.path.join(self.base_dir, self.username)
-        os.system(f"mkdir -p {key_dir}/.ssh && echo '{key}' > {key_dir}/.ssh/authorized_keys")
-        os.system(f"chmod 700 {key_dir}/.ssh")
-        os.system(f"chmod 600 {key_dir}/.ssh/authorized_keys")
-        os.system(f"chown -R {self.username}:{self.username} {key_dir}/.ssh")
-        
-        
\ No newline at end of file
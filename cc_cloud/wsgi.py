@@ -0,0 +1,10 @@
+import sys
+
+from cc_cloud.app import create_app
+from cc_cloud.startup import create_parser, profiled
+
+
+args, _ = create_parser().parse_known_args(sys.argv[1:])
+
+app = profiled(create_app, args.profile_startup, args.conf_file)
+application = app
@@ -0,0 +1,187 @@
+import os
+import random
+import requests
+from pytest import fixture
+from unittest.mock import patch, Mock
+from flask import Flask
+from werkzeug.exceptions import Unauthorized, ServiceUnavailable
+
+from cc_agency.broker.auth import Auth
+from cc_cloud.routes.routes import cloud_routes
+from cc_cloud.service.fair_share import FairShareScheduler
+from cc_cloud.client.client import CloudClient, MultipartBody, TransferSlots
+from wsgi_adapter import WSGIAdapter
+
+
+class FakeAuth:
+    tokens_valid_for_seconds = 3600
+
+    def __init__(self):
+        self.password_checks = 0
+
+    def verify_user(self, authorization, cookies, ip):
+        user = Auth.User(username='testuser', is_admin=False)
+        if authorization:
+            self.password_checks += 1
+            if authorization.password != 'secret':
+                raise Unauthorized()
+            user.set_authentication_cookie('token')
+        elif cookies.get('authorization_cookie') != 'token':
+            raise Unauthorized()
+        return user
+
+
+@fixture
+def auth():
+    return FakeAuth()
+
+@fixture
+def app(cloud_service, auth):
+    app = Flask('cc-cloud-test')
+    cloud_routes(app, auth, cloud_service)
+    return app
+
+@fixture
+def cloud_client(app):
+    session = requests.Session()
+    session.mount('http://cc-cloud', WSGIAdapter(app))
+    client = CloudClient('http://cc-cloud', 'testuser', 'secret', workers=4, chunk_size=4096, session=session)
+    yield client
+    client.close()
+
+
+def write_tree(directory):
+    rng = random.Random(0)
+    files = {
+        'small.txt': b'hello',
+        'data/medium.bin': rng.randbytes(3000),
+        'data/large.bin': rng.randbytes(20000),
+        'data/nested/"quoted".txt': b'quoted',
+    }
+    for path, content in files.items():
+        filepath = directory / path
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        filepath.write_bytes(content)
+    return files
+
+
+def test_multipart_body_length(tmp_path):
+    (tmp_path / 'a.txt').write_bytes(b'abc')
+    body = MultipartBody([(str(tmp_path / 'a.txt'), 'dir/a.txt', 3, 1.5)])
+
+    data = b''.join(body)
+
+    assert len(data) == len(body)
+    assert b'name="dir/a.txt"; filename="a.txt"' in data
+    assert b'X-Mtime: 1.5' in data
+
+
+@patch('cc_cloud.service.file_service.shutil.chown', Mock())
+def test_push(cloud_client, auth, tmp_path):
+    local_dir = tmp_path / 'local'
+    files = write_tree(local_dir)
+
+    report = cloud_client.push(str(local_dir), 'backup')
+
+    assert sorted(report['uploaded']) == sorted(files)
+    assert report['failed'] == {}
+    for path, content in files.items():
+        remote_path = tmp_path / 'cloud-testuser' / 'cloud' / 'backup' / path
+        assert remote_path.read_bytes() == content
+        assert abs(os.stat(remote_path).st_mtime - os.stat(local_dir / path).st_mtime) < 0.001
+
+    report = cloud_client.push(str(local_dir), 'backup')
+
+    assert report['uploaded'] == []
+    assert sorted(report['skipped']) == sorted(files)
+    assert auth.password_checks == 1
+
+
+@patch('cc_cloud.service.file_service.shutil.chown', Mock())
+def test_push_pull_above_small_transfer_size(cloud_client, cloud_service, tmp_path):
+    content = random.Random(0).randbytes(2 * 1024 * 1024)
+    (tmp_path / 'local').mkdir()
+    (tmp_path / 'local' / 'large.bin').write_bytes(content)
+
+    assert cloud_client.push(str(tmp_path / 'local'), '')['uploaded'] == ['large.bin']
+    assert cloud_client.pull('', str(tmp_path / 'copy'))['downloaded'] == ['large.bin']
+
+    assert (tmp_path / 'copy' / 'large.bin').read_bytes() == content
+    metrics = cloud_service.fair_share.metrics()['testuser']
+    assert metrics['upload_bytes'] >= len(content)
+    assert metrics['download_bytes'] == len(content)
+
+
+def test_pull(cloud_client, tmp_path):
+    remote_dir = tmp_path / 'cloud-testuser' / 'cloud'
+    files = write_tree(remote_dir)
+    local_dir = tmp_path / 'local'
+
+    report = cloud_client.pull('', str(local_dir))
+
+    assert sorted(report['downloaded']) == sorted(files)
+    assert report['failed'] == {}
+    for path, content in files.items():
+        assert (local_dir / path).read_bytes() == content
+        assert abs(os.stat(local_dir / path).st_mtime - os.stat(remote_dir / path).st_mtime) < 0.001
+    assert not list(local_dir.rglob('*.cc-cloud-partial'))
+
+
+@patch('cc_cloud.service.file_service.shutil.chown', Mock())
+def test_sync(cloud_client, tmp_path):
+    remote_dir = tmp_path / 'cloud-testuser' / 'cloud'
+    local_dir = tmp_path / 'local'
+    (remote_dir / 'remote.txt').parent.mkdir(parents=True)
+    (remote_dir / 'remote.txt').write_bytes(b'remote')
+    (remote_dir / 'both.txt').write_bytes(b'old')
+    os.utime(remote_dir / 'both.txt', (1000, 1000))
+    local_dir.mkdir()
+    (local_dir / 'local.txt').write_bytes(b'local')
+    (local_dir / 'both.txt').write_bytes(b'new')
+
+    report = cloud_client.sync(str(local_dir), '')
+
+    assert sorted(report['uploaded']) == ['both.txt', 'local.txt']
+    assert report['downloaded'] == ['remote.txt']
+    assert (remote_dir / 'both.txt').read_bytes() == b'new'
+    assert (remote_dir / 'local.txt').read_bytes() == b'local'
+    assert (local_dir / 'remote.txt').read_bytes() == b'remote'
+
+
+@patch('cc_cloud.client.client.time.sleep', Mock())
+def test_request_retries(app, cloud_client):
+    failures = [ServiceUnavailable(retry_after=1), ServiceUnavailable()]
+
+    @app.before_request
+    def fail():
+        if failures:
+            raise failures.pop(0)
+
+    assert cloud_client.list_remote() == {}
+    assert failures == []
+
+
+def test_transfer_slots_reduce():
+    slots = TransferSlots(8)
+    for _ in range(3):
+        slots.acquire()
+
+    slots.reduce()
+    slots.release()
+
+    assert slots.limit == 2
+    assert slots.active == 2
+
+
+@patch('cc_cloud.client.client.time.sleep', Mock())
+def test_pull_within_transfer_limit(cloud_client, cloud_service, conf, tmp_path):
+    conf.d.update(max_transfers_per_user=1, small_transfer_size=0)
+    cloud_service.fair_share = FairShareScheduler(conf, cloud_service.mongo)
+    remote_dir = tmp_path / 'cloud-testuser' / 'cloud'
+    files = write_tree(remote_dir)
+
+    report = cloud_client.pull('', str(tmp_path / 'local'))
+
+    assert report['failed'] == {}
+    assert sorted(report['downloaded']) == sorted(files)
+    assert 'active_transfers' not in cloud_service.fair_share.metrics().get('testuser', {})
@@ -0,0 +1,81 @@
+import io
+from http.client import HTTPMessage
+from urllib.parse import urlsplit
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+from urllib3 import HTTPResponse
+from werkzeug.test import Client
+
+
+class _OriginalResponse:
+    # the part of http.client.HTTPResponse that requests and urllib3 use to read cookies and to release the connection
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def isclosed(self):
+        return False
+
+    def close(self):
+        pass
+
+
+class WSGIAdapter(BaseAdapter):
+
+    def __init__(self, app, remote_addr='127.0.0.1'):
+        """Create a new instance of WSGIAdapter. The adapter sends the requests of a
+        requests.Session to a WSGI app in the same process, e.g. to test the client
+        against the flask app of cc-cloud:
+
+            session = requests.Session()
+            session.mount('http://cc-cloud', WSGIAdapter(app))
+
+        :param app: The WSGI app
+        :type app: flask.Flask
+        :param remote_addr: Address of the client, defaults to '127.0.0.1'
+        :type remote_addr: str, optional
+        """
+        super().__init__()
+        self.client = Client(app, use_cookies=False)
+        self.remote_addr = remote_addr
+
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        url = urlsplit(request.url)
+        body = request.body or b''
+        if isinstance(body, str):
+            body = body.encode()
+        elif not isinstance(body, bytes):
+            body = b''.join(chunk.encode() if isinstance(chunk, str) else chunk for chunk in body)
+        headers = [
+            (name, value) for name, value in request.headers.items()
+            if name.lower() not in ('content-length', 'transfer-encoding')
+        ]
+
+        response = self.client.open(
+            url.path,
+            base_url=f'{url.scheme}://{url.netloc}',
+            query_string=url.query,
+            method=request.method,
+            headers=headers,
+            data=body,
+            environ_overrides={'REMOTE_ADDR': self.remote_addr},
+        )
+
+        message = HTTPMessage()
+        for name, value in response.headers.items():
+            message.add_header(name, value)
+        raw = HTTPResponse(
+            body=io.BytesIO(response.get_data()),
+            headers=list(response.headers.items()),
+            status=response.status_code,
+            reason=response.status.split(' ', 1)[-1],
+            preload_content=False,
+            original_response=_OriginalResponse(message),
+        )
+        response.close()
+        return HTTPAdapter.build_response(self, request, raw)
+
+
+    def close(self):
+        pass
@@ -0,0 +1,36 @@
+from pytest import fixture
+from unittest.mock import Mock, MagicMock
+
+from cc_cloud.service.cloud_service import CloudService
+from cc_cloud.service.file_service import FileService
+from cc_cloud.service.digest_index import DigestIndex
+from cc_cloud.service.fair_share import FairShareScheduler
+
+
+class FakeConf:
+    def __init__(self, tmp_path):
+        self.d = {
+            'upload_directory_name': 'cloud',
+            'userhome_directory': str(tmp_path),
+        }
+
+
+@fixture
+def conf(tmp_path):
+    return FakeConf(tmp_path)
+
+@fixture
+def cloud_service(conf, tmp_path):
+    """CloudService on tmp_path with mocked filesystems. The user testuser is already provisioned
+    and has no transfer limit overrides, so transfers are limited by the defaults of conf.
+    """
+    cloud_service = CloudService.__new__(CloudService)
+    cloud_service.file_service = FileService(conf, digest_index=DigestIndex(str(tmp_path / 'digests.sqlite')))
+    cloud_service.filesystem_service = MagicMock()
+    cloud_service.mount_manager = MagicMock()
+    cloud_service.mongo = MagicMock()
+    cloud_service.mongo.db['cloud_users'].find_one.return_value = None
+    cloud_service.fair_share = FairShareScheduler(conf, cloud_service.mongo)
+    cloud_service.reconciler = Mock(interval=300)
+    cloud_service.provisioned = {'cloud-testuser'}
+    return cloud_service
@@ -0,0 +1,95 @@
+import gzip
+import hashlib
+import random
+from io import BytesIO
+from pytest import fixture
+from unittest.mock import patch, Mock
+from flask import Flask
+
+from cc_agency.broker.auth import Auth
+from cc_cloud.routes.routes import cloud_routes
+from cc_cloud.service.delta import compute_delta
+
+
+@fixture
+def client(cloud_service):
+    auth = Mock()
+    auth.verify_user.return_value = Auth.User(username='testuser', is_admin=False)
+    app = Flask('cc-cloud-test')
+    cloud_routes(app, auth, cloud_service)
+    return app.test_client()
+
+
+@patch('cc_cloud.service.file_service.shutil.chown', Mock())
+def test_delta_upload(client, tmp_path):
+    old_content = random.Random(0).getrandbits(8 * 20000).to_bytes(20000, 'big')
+    new_content = old_content[:8000] + b'changed' + old_content[8000:]
+    filepath = tmp_path / 'cloud-testuser' / 'cloud' / 'data' / 'file.bin'
+    filepath.parent.mkdir(parents=True)
+    filepath.write_bytes(old_content)
+    
+    signature = client.get('/file/signature?path=data/file.bin&block_size=1024').json
+    assert signature['size'] == 20000
+    assert len(signature['blocks']) == 20
+    
+    delta = b''.join(compute_delta(signature, BytesIO(new_content)))
+    assert len(delta) < 3000
+    sha256 = hashlib.sha256(new_content).hexdigest()
+    response = client.put(f'/file/delta?path=data/file.bin&block_size=1024&sha256={sha256}', data=delta)
+    
+    assert response.json == {'status': 'saved', 'digests': {'sha256': sha256}}
+    assert filepath.read_bytes() == new_content
+    assert [entry.name for entry in filepath.parent.iterdir()] == ['file.bin']
+
+
+@patch('cc_cloud.service.file_service.shutil.chown', Mock())
+def test_delta_upload_digest_mismatch(client, tmp_path):
+    filepath = tmp_path / 'cloud-testuser' / 'cloud' / 'file.bin'
+    filepath.parent.mkdir(parents=True)
+    filepath.write_bytes(b'old content')
+    
+    signature = client.get('/file/signature?path=file.bin&block_size=1024').json
+    delta = b''.join(compute_delta(signature, BytesIO(b'new content')))
+    response = client.put(f'/file/delta?path=file.bin&block_size=1024&sha256={"0" * 64}', data=delta)
+    
+    assert response.json == 'invalid delta'
+    assert filepath.read_bytes() == b'old content'
+
+
+@patch('cc_cloud.service.file_service.shutil.chown')
+def test_delta_upload_new_directory(mock_chown, client, tmp_path):
+    signature = {'block_size': 1024, 'size': 0, 'blocks': []}
+    delta = b''.join(compute_delta(signature, BytesIO(b'new file')))
+    
+    response = client.put('/file/delta?path=new/dir/file.bin&block_size=1024', data=delta)
+    
+    upload_dir = tmp_path / 'cloud-testuser' / 'cloud'
+    assert response.json['status'] == 'saved'
+    assert (upload_dir / 'new' / 'dir' / 'file.bin').read_bytes() == b'new file'
+    mock_chown.assert_any_call(str(upload_dir / 'new' / 'dir'), 'cloud-testuser', 'cloud-testuser')
+
+
+def test_delta_upload_too_large_removes_temporary_file(client, cloud_service, tmp_path):
+    cloud_service.get_free_size = Mock(return_value=16)
+    upload_dir = tmp_path / 'cloud-testuser' / 'cloud'
+    upload_dir.mkdir(parents=True)
+    signature = {'block_size': 1024, 'size': 0, 'blocks': []}
+    delta = b''.join(compute_delta(signature, BytesIO(bytes(4096))))
+    
+    response = client.put(
+        '/file/delta?path=file.bin&block_size=1024', data=gzip.compress(delta), headers={'Content-Encoding': 'gzip'}
+    )
+    
+    assert response.status_code == 413
+    assert list(upload_dir.iterdir()) == []
+
+
+@patch('cc_cloud.service.file_service.shutil.chown', Mock(side_effect=LookupError()))
+def test_delta_upload_unknown_owner(client, tmp_path):
+    (tmp_path / 'cloud-testuser' / 'cloud').mkdir(parents=True)
+    signature = {'block_size': 1024, 'size': 0, 'blocks': []}
+    delta = b''.join(compute_delta(signature, BytesIO(b'new file')))
+    
+    response = client.put('/file/delta?path=file.bin&block_size=1024', data=delta)
+    
+    assert response.json == 'invalid delta'
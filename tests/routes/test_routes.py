@@ -0,0 +1,260 @@
+import gzip
+
+from pytest import fixture
+from unittest.mock import Mock, MagicMock
+from types import SimpleNamespace
+from flask import Flask
+from werkzeug.exceptions import TooManyRequests
+
+from cc_agency.broker.auth import Auth
+from cc_cloud.routes.routes import cloud_routes
+from cc_cloud.service.fair_share import Transfer, FairShareScheduler
+
+
+@fixture
+def user():
+    return Auth.User(username='testuser', is_admin=False)
+
+@fixture
+def auth(user):
+    auth = Mock()
+    auth.verify_user.return_value = user
+    return auth
+
+@fixture
+def cloud_service(tmp_path):
+    cloud_service = Mock()
+    cloud_service.home_dir = str(tmp_path)
+    cloud_service.start_transfer.return_value = Transfer()
+    (tmp_path / 'cloud-testuser' / 'cloud').mkdir(parents=True)
+    (tmp_path / 'cloud-testuser' / 'cloud' / 'file.txt').write_bytes(b'content')
+    cloud_service.download_file.side_effect = lambda user, path: str(tmp_path / 'cloud-testuser' / 'cloud' / path)
+    return cloud_service
+
+@fixture
+def app(auth, cloud_service):
+    app = Flask('cc-cloud-test')
+    cloud_routes(app, auth, cloud_service)
+    return app
+
+
+def test_download_file(app):
+    response = app.test_client().get('/file?path=file.txt')
+
+    assert response.data == b'content'
+    assert 'X-Accel-Redirect' not in response.headers
+
+
+def test_download_file_releases_filesystem(app, cloud_service, user):
+    response = app.test_client().get('/file?path=file.txt')
+
+    assert response.data == b'content'
+    cloud_service.release_filesystem.assert_not_called()
+    response.close()
+    cloud_service.release_filesystem.assert_called_once_with(user)
+
+
+def test_download_file_x_accel_redirect(app):
+    app.config['DOWNLOAD_OFFLOAD'] = 'x-accel-redirect'
+    app.config['DOWNLOAD_OFFLOAD_PREFIX'] = '/protected/'
+
+    response = app.test_client().get('/file?path=file.txt')
+
+    assert response.data == b''
+    assert response.headers['X-Accel-Redirect'] == '/protected/cloud-testuser/cloud/file.txt'
+    assert response.headers['Content-Disposition'] == 'attachment; filename=file.txt'
+
+
+def test_download_file_x_sendfile(app, tmp_path):
+    app.config['DOWNLOAD_OFFLOAD'] = 'x-sendfile'
+    app.config['USE_X_SENDFILE'] = True
+
+    response = app.test_client().get('/file?path=file.txt')
+
+    assert response.data == b''
+    assert response.headers['X-Sendfile'] == str(tmp_path / 'cloud-testuser' / 'cloud' / 'file.txt')
+
+
+def test_download_file_offload_not_found(app):
+    app.config['DOWNLOAD_OFFLOAD'] = 'x-accel-redirect'
+
+    response = app.test_client().get('/file?path=missing.txt')
+
+    assert response.json == 'file not found'
+
+
+def test_check_files(app, cloud_service):
+    cloud_service.check_files.return_value = [{'path': 'file.txt', 'status': 'match'}]
+    entries = [{'path': 'file.txt', 'size': 7, 'sha256': '00'}]
+
+    response = app.test_client().post('/files/check', json=entries)
+
+    assert response.json == [{'path': 'file.txt', 'status': 'match'}]
+    assert cloud_service.check_files.call_args[0][1] == entries
+
+
+def test_check_files_invalid(app):
+    response = app.test_client().post('/files/check', data='no json')
+
+    assert response.json == 'invalid request'
+
+
+def test_download_file_gzip(app):
+    app.config['COMPRESSION_ENABLED'] = True
+
+    response = app.test_client().get('/file?path=file.txt', headers={'Accept-Encoding': 'gzip'})
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(response.data) == b'content'
+
+
+def test_download_file_offload_not_compressed(app):
+    app.config['COMPRESSION_ENABLED'] = True
+    app.config['DOWNLOAD_OFFLOAD'] = 'x-accel-redirect'
+    app.config['DOWNLOAD_OFFLOAD_PREFIX'] = '/protected'
+
+    response = app.test_client().get('/file?path=file.txt', headers={'Accept-Encoding': 'gzip'})
+
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['X-Accel-Redirect'] == '/protected/cloud-testuser/cloud/file.txt'
+
+
+def test_download_file_range_not_compressed(app):
+    app.config['COMPRESSION_ENABLED'] = True
+
+    response = app.test_client().get('/file?path=file.txt', headers={'Accept-Encoding': 'gzip', 'Range': 'bytes=0-2'})
+
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == b'con'
+
+
+def test_upload_file_gzip(app, cloud_service, user):
+    uploaded = {}
+    cloud_service.get_free_size.return_value = 1024
+    cloud_service.upload_file.side_effect = lambda user, files: uploaded.update(
+        {name: file.read() for name, file in files.items()}
+    )
+    body = (
+        b'--boundary\r\n'
+        b'Content-Disposition: form-data; name="file.txt"; filename="file.txt"\r\n\r\n'
+        b'content\r\n'
+        b'--boundary--\r\n'
+    )
+
+    app.test_client().put(
+        '/file', data=gzip.compress(body),
+        headers={'Content-Encoding': 'gzip', 'Content-Type': 'multipart/form-data; boundary=boundary'}
+    )
+
+    assert uploaded == {'file.txt': b'content'}
+    cloud_service.start_transfer.assert_called_once_with(user, 'upload', None)
+
+
+def test_upload_file_gzip_too_large(app, cloud_service):
+    cloud_service.get_free_size.return_value = 16
+
+    response = app.test_client().put(
+        '/file', data=gzip.compress(bytes(1024)),
+        headers={'Content-Encoding': 'gzip', 'Content-Type': 'multipart/form-data; boundary=boundary'}
+    )
+
+    assert response.status_code == 413
+    cloud_service.upload_file.assert_not_called()
+
+
+def test_upload_file_unsupported_encoding(app, cloud_service):
+    response = app.test_client().put('/file', data=b'data', headers={'Content-Encoding': 'br'})
+
+    assert response.json == 'unsupported content encoding'
+    cloud_service.upload_file.assert_not_called()
+
+
+def test_add_authorized_key(app, cloud_service, user):
+    cloud_service.set_local_user_authorized_key.return_value = True
+
+    response = app.test_client().post('/authorized_keys', json={'key': 'ssh-ed25519 AAAA'})
+
+    assert response.json == 'key added'
+    cloud_service.set_local_user_authorized_key.assert_called_once_with(user, 'ssh-ed25519 AAAA')
+
+
+def test_remove_authorized_key_invalid(app, cloud_service):
+    response = app.test_client().delete('/authorized_keys', json=['ssh-ed25519 AAAA'])
+
+    assert response.json == 'invalid request'
+    cloud_service.remove_authorized_key.assert_not_called()
+
+
+def test_upload_file_too_many_transfers(app, cloud_service):
+    cloud_service.start_transfer.side_effect = TooManyRequests(retry_after=5)
+
+    response = app.test_client().put('/file', data=b'data')
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '5'
+    cloud_service.upload_file.assert_not_called()
+
+
+def test_download_file_limited(app, cloud_service):
+    scheduler = FairShareScheduler(SimpleNamespace(d={'download_rate_limit': 1024 ** 3, 'small_transfer_size': 0}), MagicMock())
+    scheduler.mongo.db['cloud_users'].find_one.return_value = None
+    cloud_service.start_transfer.side_effect = lambda user, direction, size: scheduler.start(user.username, direction, size)
+
+    response = app.test_client().get('/file?path=file.txt')
+    assert response.data == b'content'
+    response.close()
+
+    assert scheduler.metrics()['testuser'] == {'download_bytes': 7, 'throttled_seconds': 0}
+
+
+def test_download_file_x_sendfile_restricted(app, cloud_service):
+    app.config['DOWNLOAD_OFFLOAD'] = 'x-sendfile'
+    app.config['USE_X_SENDFILE'] = True
+    scheduler = FairShareScheduler(SimpleNamespace(d={'max_transfers_per_user': 1, 'small_transfer_size': 0}), MagicMock())
+    scheduler.mongo.db['cloud_users'].find_one.return_value = None
+    cloud_service.start_transfer.side_effect = lambda user, direction, size: scheduler.start(user.username, direction, size)
+
+    response = app.test_client().get('/file?path=file.txt')
+
+    assert 'X-Sendfile' not in response.headers
+    assert response.data == b'content'
+    assert scheduler.metrics()['testuser']['active_transfers'] == 1
+    response.close()
+    assert 'active_transfers' not in scheduler.metrics()['testuser']
+
+
+def test_download_file_head_releases_transfer(app, cloud_service):
+    scheduler = FairShareScheduler(SimpleNamespace(d={'max_transfers_per_user': 2, 'small_transfer_size': 0}), MagicMock())
+    scheduler.mongo.db['cloud_users'].find_one.return_value = None
+    cloud_service.start_transfer.side_effect = lambda user, direction, size: scheduler.start(user.username, direction, size)
+
+    for _ in range(3):
+        response = app.test_client().head('/file?path=file.txt')
+        response.close()
+        assert response.status_code == 200
+
+    assert 'active_transfers' not in scheduler.metrics().get('testuser', {})
+
+
+def test_upload_file_limited_while_reading(app, cloud_service):
+    sleeps = []
+    scheduler = FairShareScheduler(
+        SimpleNamespace(d={'upload_rate_limit': 100, 'rate_limit_burst': 100, 'small_transfer_size': 0}),
+        MagicMock(), clock=lambda: 0, sleep=sleeps.append
+    )
+    scheduler.mongo.db['cloud_users'].find_one.return_value = None
+    cloud_service.start_transfer.side_effect = lambda user, direction, size: scheduler.start(user.username, direction, size)
+    cloud_service.upload_file.side_effect = lambda user, files: {name: 'saved' for name in files}
+    body = (
+        b'--boundary\r\n'
+        b'Content-Disposition: form-data; name="file.txt"; filename="file.txt"\r\n\r\n'
+        + b'x' * 300 + b'\r\n'
+        b'--boundary--\r\n'
+    )
+
+    response = app.test_client().put('/file', data=body, headers={'Content-Type': 'multipart/form-data; boundary=boundary'})
+
+    assert response.json == {'file.txt': 'saved'}
+    assert sum(sleeps) >= 2
+    assert scheduler.metrics()['testuser']['upload_bytes'] == len(body)
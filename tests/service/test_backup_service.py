@@ -0,0 +1,117 @@
+import io
+import tarfile
+import os
+from pytest import fixture
+from unittest.mock import patch, call, Mock, MagicMock
+from types import SimpleNamespace
+
+from cc_cloud.service.backup_service import BackupService, copy_sparse
+
+
+@fixture
+def filesystem_service(tmp_path):
+    filesystem_service = MagicMock()
+    filesystem_service.get_filepath.side_effect = lambda fs_name: str(tmp_path / 'filesystems' / fs_name)
+    filesystem_service.get_mountpoint.side_effect = lambda fs_name: f'/test/users/{fs_name}/cloud'
+    filesystem_service.find_all_filesystems.return_value = ['cloud-a', 'cloud-b']
+    filesystem_service.is_mounted.return_value = False
+    filesystem_service.is_in_use.return_value = False
+    (tmp_path / 'filesystems').mkdir()
+    for fs_name in ['cloud-a', 'cloud-b']:
+        write_sparse_image(tmp_path / 'filesystems' / fs_name, fs_name.encode())
+    return filesystem_service
+
+@fixture
+def backup_service(tmp_path, filesystem_service):
+    conf = SimpleNamespace(d={'backup_directory': str(tmp_path / 'backups')})
+    return BackupService(conf, filesystem_service, Mock())
+
+
+def write_sparse_image(path, data):
+    with open(path, 'wb') as file:
+        file.truncate(16 * 1024 * 1024)
+        file.write(data)
+        file.seek(8 * 1024 * 1024)
+        file.write(data)
+
+
+def test_copy_sparse(tmp_path):
+    write_sparse_image(tmp_path / 'image', b'data')
+    os.utime(tmp_path / 'image', ns=(0, 1000))
+
+    copy_sparse(str(tmp_path / 'image'), str(tmp_path / 'copy'))
+
+    assert (tmp_path / 'copy').read_bytes() == (tmp_path / 'image').read_bytes()
+    stat = os.stat(tmp_path / 'copy')
+    assert stat.st_mtime_ns == 1000
+    assert stat.st_blocks * 512 <= os.stat(tmp_path / 'image').st_blocks * 512
+    assert not (tmp_path / '.copy.partial').exists()
+
+
+def test_backup_incremental(backup_service, tmp_path):
+    assert backup_service.backup_all() == {'cloud-a': 'copied', 'cloud-b': 'copied'}
+    write_sparse_image(tmp_path / 'filesystems' / 'cloud-b', b'changed')
+    os.utime(tmp_path / 'filesystems' / 'cloud-b', ns=(0, 1000))
+
+    assert backup_service.backup_all() == {'cloud-a': 'unchanged', 'cloud-b': 'copied'}
+    assert backup_service.backup('cloud-a', incremental=False) == 'copied'
+    assert (tmp_path / 'backups' / 'cloud-b').read_bytes().startswith(b'changed')
+    assert backup_service.backup('cloud-missing') == 'failed'
+
+
+@patch('cc_cloud.service.backup_service.os.system', return_value=0)
+def test_backup_freezes_mounted_filesystem(mock_system, backup_service, filesystem_service):
+    filesystem_service.is_mounted.return_value = True
+
+    assert backup_service.backup('cloud-a') == 'copied'
+    assert mock_system.call_args_list == [
+        call("fsfreeze -f '/test/users/cloud-a/cloud'"),
+        call("fsfreeze -u '/test/users/cloud-a/cloud'"),
+    ]
+
+
+def test_restore(backup_service, filesystem_service, tmp_path):
+    assert not backup_service.restore('cloud-a')
+    backup_service.backup('cloud-a')
+    write_sparse_image(tmp_path / 'filesystems' / 'cloud-a', b'changed')
+    filesystem_service.is_mounted.side_effect = [True, False]
+
+    assert backup_service.restore('cloud-a')
+    assert (tmp_path / 'filesystems' / 'cloud-a').read_bytes().startswith(b'cloud-a')
+    filesystem_service.umount.assert_called_once_with('cloud-a')
+    backup_service.mount_manager.acquire.assert_called_once_with('cloud-a')
+
+
+def test_restore_busy(backup_service, filesystem_service, tmp_path):
+    backup_service.backup('cloud-a')
+    write_sparse_image(tmp_path / 'filesystems' / 'cloud-a', b'changed')
+    filesystem_service.is_mounted.return_value = True
+
+    assert not backup_service.restore('cloud-a')
+    assert (tmp_path / 'filesystems' / 'cloud-a').read_bytes().startswith(b'changed')
+    backup_service.mount_manager.acquire.assert_called_once_with('cloud-a')
+
+
+@patch('cc_cloud.service.backup_service.os.system', side_effect=[256, 256])
+def test_backup_fails_if_not_frozen(mock_system, backup_service, filesystem_service, tmp_path):
+    filesystem_service.is_mounted.return_value = True
+
+    assert backup_service.backup('cloud-a') == 'failed'
+    assert not (tmp_path / 'backups' / 'cloud-a').exists()
+
+
+def test_restore_in_use(backup_service, filesystem_service):
+    backup_service.backup('cloud-a')
+    filesystem_service.is_in_use.return_value = True
+
+    assert not backup_service.restore('cloud-a')
+    filesystem_service.umount.assert_not_called()
+
+
+def test_stream_archive(backup_service, tmp_path):
+    backup_service.backup('cloud-a')
+
+    archive = b''.join(backup_service.stream_archive('cloud-a'))
+
+    with tarfile.open(fileobj=io.BytesIO(archive), mode='r:gz') as tar:
+        assert tar.extractfile('cloud-a').read() == (tmp_path / 'backups' / 'cloud-a').read_bytes()
@@ -0,0 +1,117 @@
+import time
+import threading
+from pytest import fixture
+from unittest.mock import patch, Mock, MagicMock
+
+from cc_agency.broker.auth import Auth
+from cc_cloud.service.cloud_service import CloudService
+from cc_cloud.service.mount_manager import MountManager
+
+
+@fixture
+def user():
+    return Auth.User(username='testuser', is_admin=False)
+
+@fixture
+def admin():
+    return Auth.User(username='admin', is_admin=True)
+
+
+def test_resize_user_remounts_through_mount_manager(cloud_service, admin):
+    cloud_service.filesystem_service.is_mounted.side_effect = [True, False]
+    cloud_service.filesystem_service.resize.return_value = True
+
+    assert cloud_service.resize_user(admin, 'testuser', 20480) == True
+
+    cloud_service.mount_manager.forget.assert_called_once_with('cloud-testuser')
+    cloud_service.mount_manager.acquire.assert_called_once_with('cloud-testuser')
+    cloud_service.mongo.db['cloud_users'].update_one.assert_called_once()
+
+
+def test_resize_user_keeps_unmounted(cloud_service, admin):
+    cloud_service.filesystem_service.is_mounted.return_value = False
+    cloud_service.filesystem_service.resize.return_value = True
+
+    assert cloud_service.resize_user(admin, 'testuser', 20480) == True
+
+    cloud_service.mount_manager.acquire.assert_not_called()
+
+
+def test_resize_user_failed(cloud_service, admin):
+    cloud_service.filesystem_service.is_mounted.return_value = True
+    cloud_service.filesystem_service.resize.return_value = False
+
+    assert cloud_service.resize_user(admin, 'testuser', 20480) == False
+
+    cloud_service.mongo.db['cloud_users'].update_one.assert_not_called()
+
+
+def test_file_action_waits_for_remount_after_shrink(cloud_service, admin, user):
+    fs_lock = threading.RLock()
+    mounted = {'cloud-testuser'}
+    backend = Mock(is_in_use=Mock(return_value=False))
+    backend.exists_or_create.side_effect = mounted.add
+    cloud_service.filesystem_service.lock.return_value = fs_lock
+    # checking the mount takes a moment, requests that got the lock early would see the unmounted filesystem
+    cloud_service.filesystem_service.is_mounted.side_effect = lambda fs_name: time.sleep(0.05) or fs_name in mounted
+    cloud_service.mount_manager = MountManager(backend)
+    cloud_service.mount_manager.adopt(['cloud-testuser'])
+    seen = []
+    request = threading.Thread(
+        target=cloud_service.file_action, args=(user, lambda user_ref: seen.append(user_ref in mounted))
+    )
+
+    def shrink(fs_name, size):
+        with fs_lock:
+            mounted.discard(fs_name)
+            request.start()
+            time.sleep(0.05)
+        return True
+    cloud_service.filesystem_service.resize.side_effect = shrink
+
+    assert cloud_service.resize_user(admin, 'testuser', 20480) == True
+    request.join()
+
+    assert seen == [True]
+
+
+def test_file_action_checks_once_with_reconciler(cloud_service, user):
+    cloud_service.provisioned.clear()
+    func = Mock()
+    with patch.object(CloudService, 'local_user_exists_or_create') as mock_exists_or_create:
+        cloud_service.file_action(user, func, 'path')
+        cloud_service.file_action(user, func, 'path')
+
+    mock_exists_or_create.assert_called_once_with(user)
+    cloud_service.filesystem_service.is_mounted.assert_not_called()
+    func.assert_called_with('cloud-testuser', 'path')
+
+
+def test_file_action_checks_each_request_without_reconciler(cloud_service, user):
+    cloud_service.provisioned.clear()
+    cloud_service.reconciler.interval = None
+    cloud_service.filesystem_service.is_mounted.return_value = False
+    with patch.object(CloudService, 'local_user_exists_or_create') as mock_exists_or_create:
+        cloud_service.file_action(user, Mock())
+        cloud_service.file_action(user, Mock())
+
+    assert mock_exists_or_create.call_count == 2
+    assert cloud_service.mount_manager.forget.call_count == 2
+    assert cloud_service.mount_manager.acquire.call_count == 2
+
+
+def test_file_action_pins_filesystem(cloud_service, user):
+    func = Mock(side_effect=lambda user_ref: cloud_service.mount_manager.unpin.assert_not_called())
+
+    cloud_service.file_action(user, func)
+
+    cloud_service.mount_manager.acquire.assert_called_once_with('cloud-testuser', pin=True)
+    cloud_service.mount_manager.unpin.assert_called_once_with('cloud-testuser')
+
+
+def test_file_action_keeps_pinned(cloud_service, user):
+    assert cloud_service.file_action(user, Mock(return_value='/path'), keep_pinned=True) == '/path'
+    cloud_service.mount_manager.unpin.assert_not_called()
+
+    assert cloud_service.file_action(user, Mock(return_value=None), keep_pinned=True) is None
+    cloud_service.mount_manager.unpin.assert_called_once_with('cloud-testuser')
@@ -0,0 +1,53 @@
+import io
+import gzip
+
+from pytest import raises
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+
+from cc_cloud.service.compression import supported_encodings, is_compressible, compress_file, DecompressingStream
+
+
+def test_supported_encodings():
+    assert 'gzip' in supported_encodings()
+
+
+def test_is_compressible():
+    assert is_compressible('/data/table.csv')
+    assert not is_compressible('/data/archive.tar.GZ')
+
+
+def test_compress_file(tmp_path):
+    filepath = tmp_path / 'file.txt'
+    filepath.write_bytes(b'content' * 1000)
+
+    data = b''.join(compress_file(str(filepath), 'gzip', 6))
+
+    assert gzip.decompress(data) == b'content' * 1000
+
+
+def test_decompressing_stream():
+    stream = DecompressingStream(io.BytesIO(gzip.compress(b'content' * 1000)), 'gzip', 7000)
+
+    assert stream.read() == b'content' * 1000
+
+
+def test_decompressing_stream_max_size():
+    stream = DecompressingStream(io.BytesIO(gzip.compress(b'content' * 1000)), 'gzip', 6999)
+
+    with raises(RequestEntityTooLarge):
+        stream.read()
+
+
+def test_decompressing_stream_max_ratio():
+    bomb = gzip.compress(bytes(16 * 1024 * 1024))
+    stream = DecompressingStream(io.BytesIO(bomb), 'gzip', 1024 ** 3, max_ratio=100)
+
+    with raises(RequestEntityTooLarge):
+        stream.read()
+
+
+def test_decompressing_stream_invalid():
+    stream = DecompressingStream(io.BytesIO(b'no gzip data'), 'gzip', 1024)
+
+    with raises(BadRequest):
+        stream.read()
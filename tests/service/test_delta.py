@@ -0,0 +1,51 @@
+import random
+from io import BytesIO
+from pytest import mark, raises
+
+from cc_cloud.service.delta import compute_signature, compute_delta, apply_delta, encode_copy, COPY_INSTRUCTION
+
+
+def random_bytes(size):
+    return random.Random(0).getrandbits(8 * size).to_bytes(size, 'big')
+
+
+def apply(old_filepath, delta, block_size):
+    new_file = BytesIO()
+    apply_delta(old_filepath, BytesIO(b''.join(delta)), new_file, block_size)
+    return new_file.getvalue()
+
+
+@mark.parametrize('change', ['none', 'insert', 'replace', 'truncate', 'append'])
+def test_delta_roundtrip(change, tmp_path):
+    block_size = 1024
+    old_content = random_bytes(10 * block_size + 100)
+    new_content = {
+        'none': old_content,
+        'insert': old_content[:3000] + b'inserted' + old_content[3000:],
+        'replace': old_content[:5000] + b'x' * 2000 + old_content[7000:],
+        'truncate': old_content[:4500],
+        'append': old_content + b'appended',
+    }[change]
+    old_filepath = tmp_path / 'old'
+    old_filepath.write_bytes(old_content)
+    
+    signature = compute_signature(str(old_filepath), block_size)
+    delta = list(compute_delta(signature, BytesIO(new_content)))
+    
+    assert apply(str(old_filepath), delta, block_size) == new_content
+    literal_size = sum(len(instruction) for instruction in delta if not instruction.startswith(COPY_INSTRUCTION))
+    assert literal_size < 2 * block_size + 2100
+
+
+def test_delta_without_old_file():
+    delta = list(compute_delta({'block_size': 1024, 'size': 0, 'blocks': []}, BytesIO(b'new content')))
+    
+    assert apply(None, delta, 1024) == b'new content'
+
+
+def test_apply_delta_invalid_block(tmp_path):
+    old_filepath = tmp_path / 'old'
+    old_filepath.write_bytes(b'content')
+    
+    with raises(ValueError):
+        apply(str(old_filepath), [encode_copy(1)], 1024)
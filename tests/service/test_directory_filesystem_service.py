@@ -0,0 +1,113 @@
+import os
+from pytest import fixture
+from unittest.mock import patch, Mock
+from werkzeug.datastructures import FileStorage
+from io import BytesIO
+
+from cc_cloud.service.directory_filesystem_service import DirectoryFilesystemService
+from cc_cloud.service.file_service import FileService
+
+
+class FakeConf:
+    def __init__(self, tmp_path):
+        self.d = {
+            'upload_directory_name': 'cloud',
+            'userhome_directory': str(tmp_path / 'users'),
+            'filesystem_directory': str(tmp_path / 'filesystems'),
+            'user_storage_limit': 100
+        }
+
+@fixture
+def conf(tmp_path):
+    return FakeConf(tmp_path)
+
+@fixture
+def fs_service(conf):
+    return DirectoryFilesystemService(conf)
+
+@fixture
+def file_service(conf, fs_service):
+    return FileService(conf, fs_service)
+
+@fixture
+def fs_name():
+    return 'testuser'
+
+
+@patch.object(DirectoryFilesystemService, 'set_directory_owner', Mock())
+def test_exists_or_create(fs_service, fs_name):
+    fs_service.exists_or_create(fs_name)
+    
+    assert fs_service.filessystem_exists(fs_name)
+    assert fs_service.is_mounted(fs_name)
+    assert fs_service.get_size(fs_name) == 100
+    assert fs_service.get_used_size(fs_name) == 0
+
+
+def test_resize(fs_service, fs_name):
+    fs_service.create(fs_name)
+    
+    assert fs_service.resize(fs_name, 200) == True
+    assert fs_service.get_size(fs_name) == 200
+
+
+def test_account(fs_service, fs_name):
+    fs_service.create(fs_name)
+    
+    assert fs_service.account(fs_name, 60) == True
+    assert fs_service.account(fs_name, 60) == False
+    assert fs_service.account(fs_name, -60) == True
+    assert fs_service.get_used_size(fs_name) == 0
+
+
+@patch('cc_cloud.service.file_service.shutil.chown', Mock())
+def test_upload_within_limit(file_service, fs_service, fs_name):
+    fs_service.create(fs_name)
+    files = {
+        'small.txt': FileStorage(stream=BytesIO(b'x' * 60), filename='small.txt'),
+        'large.txt': FileStorage(stream=BytesIO(b'x' * 60), filename='large.txt'),
+    }
+    
+    file_service.upload_file(fs_name, files)
+    
+    upload_directory = file_service.get_user_upload_directory(fs_name)
+    assert (fs_service.get_mountpoint(fs_name) == upload_directory)
+    assert fs_service.get_used_size(fs_name) == 60
+    assert fs_service.scan_usage(fs_name) == 60
+
+
+@patch('cc_cloud.service.file_service.shutil.chown', Mock())
+def test_delete_releases_usage(file_service, fs_service, fs_name):
+    fs_service.create(fs_name)
+    files = {'dir/file.txt': FileStorage(stream=BytesIO(b'x' * 60), filename='file.txt')}
+    
+    file_service.upload_file(fs_name, files)
+    file_service.delete_file(fs_name, 'dir')
+    
+    assert fs_service.get_used_size(fs_name) == 0
+
+
+@patch('cc_cloud.service.file_service.shutil.chown', Mock())
+def test_upload_aborted_above_limit(file_service, fs_service, fs_name):
+    fs_service.create(fs_name)
+    stream = BytesIO(b'x' * 1024 * 1024)
+    files = {'large.txt': FileStorage(stream=stream, filename='large.txt')}
+    
+    results = file_service.upload_file(fs_name, files)
+    
+    assert results['large.txt']['status'] == 'error'
+    assert stream.tell() < 1024 * 1024
+    assert fs_service.get_used_size(fs_name) == 0
+    assert fs_service.scan_usage(fs_name) == 0
+
+
+@patch('cc_cloud.service.file_service.shutil.chown', Mock())
+def test_refresh_usage(file_service, fs_service, fs_name):
+    fs_service.create(fs_name)
+    assert fs_service.get_used_size(fs_name) == 0
+    with open(os.path.join(fs_service.get_mountpoint(fs_name), 'sftp.txt'), 'wb') as file:
+        file.write(b'x' * 40)
+    
+    fs_service.refresh_usage(fs_name)
+    
+    assert fs_service.get_used_size(fs_name) == 40
@@ -0,0 +1,85 @@
+from pytest import fixture, raises
+from unittest.mock import MagicMock
+from types import SimpleNamespace
+from werkzeug.exceptions import TooManyRequests
+
+from cc_cloud.service.fair_share import FairShareScheduler, TokenBucket
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@fixture
+def clock():
+    return FakeClock()
+
+@fixture
+def mongo():
+    mongo = MagicMock()
+    mongo.db['cloud_users'].find_one.return_value = {'username': 'heavy', 'max_transfers': 1}
+    return mongo
+
+@fixture
+def scheduler(mongo, clock):
+    conf = SimpleNamespace(d={
+        'max_transfers_per_user': 2,
+        'upload_rate_limit': 1000,
+        'rate_limit_burst': 1000,
+        'small_transfer_size': 100,
+        'transfer_retry_after': 3,
+    })
+    return FairShareScheduler(conf, mongo, clock=clock, sleep=clock.sleep)
+
+
+def test_token_bucket(clock):
+    bucket = TokenBucket(100, 200, clock)
+
+    assert bucket.reserve(150) == 0
+    assert bucket.reserve(100) == 0.5
+    clock.now = 2
+    assert bucket.reserve(100) == 0
+
+
+def test_max_transfers(scheduler, mongo):
+    transfer = scheduler.start('heavy', 'download', 1000)
+
+    with raises(TooManyRequests) as error:
+        scheduler.start('heavy', 'download', 1000)
+    assert error.value.get_headers()[-1] == ('Retry-After', '3')
+
+    # small transfers are never limited
+    scheduler.start('heavy', 'download', 100)
+    transfer.release()
+    transfer.release()
+    scheduler.start('heavy', 'download', 1000)
+
+    assert scheduler.metrics()['heavy'] == {'rejected_transfers': 1, 'active_transfers': 1}
+    mongo.db['cloud_users'].find_one.assert_called_once()
+
+
+def test_bandwidth_limit(scheduler, clock):
+    with scheduler.start('heavy', 'upload') as transfer:
+        for _ in range(3):
+            transfer.consume(1000)
+
+    assert clock.now == 2
+    assert scheduler.metrics()['heavy'] == {'upload_bytes': 3000, 'throttled_seconds': 2}
+
+
+def test_invalidate(scheduler, mongo):
+    scheduler.start('heavy', 'upload')
+    mongo.db['cloud_users'].find_one.return_value = {'username': 'heavy', 'max_transfers': 0, 'upload_rate_limit': 0}
+
+    scheduler.invalidate('heavy')
+    transfer = scheduler.start('heavy', 'upload')
+
+    assert not transfer.is_limited
@@ -1,10 +1,14 @@
+import os
+import hashlib
+from io import BytesIO
 from pytest import fixture, mark
 from unittest.mock import patch, Mock
-from werkzeug.datastructures import FileStorage
+from werkzeug.datastructures import FileStorage, MultiDict
 
 from cc_agency.broker.auth import Auth
 from cc_cloud.service.filesystem_service import FilesystemService
 from cc_cloud.service.file_service import FileService
+from cc_cloud.service.digest_index import DigestIndex, hash_file
 
 
 class MockConf:
@@ -20,6 +24,12 @@ def file_service():
     conf = MockConf()
     return FileService(conf)
 
+@fixture
+def tmp_file_service(tmp_path):
+    conf = MockConf()
+    conf.d = dict(MockConf.d, userhome_directory=str(tmp_path))
+    return FileService(conf)
+
 @fixture(autouse=True)
 def user():
     username = 'testuser'
@@ -95,22 +105,99 @@ def test_delete_file_failure_dir(user_ref, file_service):
     
 
 @patch('cc_cloud.service.file_service.shutil.chown', Mock())
-@patch.object(FilesystemService, "exists_or_create", Mock(return_value=True))
-def test_upload_file(user_ref, file_service):
-    file1 = FileStorage(filename='/some/path/file1.txt')
-    file2 = FileStorage(filename='file2.txt')
-    file1.save = Mock()
-    file2.save = Mock()
+def test_upload_file(user_ref, tmp_file_service, tmp_path):
+    file_service = tmp_file_service
+    file_service.digest_index = DigestIndex(str(tmp_path / 'digests.sqlite'))
+    file1 = FileStorage(stream=BytesIO(b'content1'), filename='/some/path/file1.txt')
+    file2 = FileStorage(stream=BytesIO(b'content2'), filename='file2.txt')
     
     files = {
         "file1": file1,
         "file2": file2
     }
     
-    file_service.upload_file(user_ref, files)
+    saved = file_service.upload_file(user_ref, files)
+    
+    upload_directory = tmp_path / 'testuser' / 'cloud'
+    assert (upload_directory / 'file1').read_bytes() == b'content1'
+    assert (upload_directory / 'file2').read_bytes() == b'content2'
+    assert saved['file1'] == {'status': 'saved', 'digests': {'sha256': hashlib.sha256(b'content1').hexdigest()}}
+    assert saved['file2'] == {'status': 'saved', 'digests': {'sha256': hashlib.sha256(b'content2').hexdigest()}}
+    assert file_service.get_checksum(user_ref, 'file1') == saved['file1']['digests']
+
 
-    file1.save.assert_called_once()
-    file2.save.assert_called_once()
+
+@patch('cc_cloud.service.file_service.shutil.chown', Mock())
+def test_upload_file_empty_field_name(user_ref, tmp_file_service, tmp_path):
+    files = MultiDict([
+        ('', FileStorage(stream=BytesIO(b'a'), filename='a.txt')),
+        ('b.txt', FileStorage(stream=BytesIO(b'b'), filename='other.txt')),
+        ('empty', FileStorage(stream=BytesIO(b''), filename='')),
+    ])
+    
+    results = tmp_file_service.upload_file(user_ref, files)
+    
+    upload_directory = tmp_path / 'testuser' / 'cloud'
+    assert results['a.txt']['status'] == 'saved'
+    assert results['b.txt']['status'] == 'saved'
+    assert results['empty'] == {'status': 'error', 'error': 'no file'}
+    assert (upload_directory / 'a.txt').read_bytes() == b'a'
+    assert (upload_directory / 'b.txt').read_bytes() == b'b'
+
+
+@patch('cc_cloud.service.file_service.os.fsync')
+@patch('cc_cloud.service.file_service.shutil.chown')
+def test_upload_file_pipeline(mock_chown, mock_fsync, user_ref, tmp_file_service, tmp_path):
+    file_service = tmp_file_service
+    file_service.upload_fsync = True
+    upload_directory = tmp_path / 'testuser' / 'cloud'
+    (upload_directory / 'existing').mkdir(parents=True)
+    
+    files = {
+        'existing/new/a.txt': FileStorage(stream=BytesIO(b'a'), filename='a.txt'),
+        'existing/new/b.txt': FileStorage(stream=BytesIO(b'b'), filename='b.txt'),
+        'existing/c.txt': FileStorage(stream=BytesIO(b'c'), filename='c.txt'),
+        '../escape.txt': FileStorage(stream=BytesIO(b'd'), filename='escape.txt'),
+        'existing/./c.txt': FileStorage(stream=BytesIO(b'e'), filename='c.txt'),
+    }
+    
+    results = file_service.upload_file(user_ref, files)
+    
+    assert [results[name]['status'] for name in files] == ['saved', 'saved', 'saved', 'error', 'error']
+    assert results['../escape.txt']['error'] == 'invalid path'
+    assert results['existing/./c.txt']['error'] == 'duplicate path'
+    assert (upload_directory / 'existing' / 'new' / 'b.txt').read_bytes() == b'b'
+    assert (upload_directory / 'existing' / 'c.txt').read_bytes() == b'c'
+    
+    chowned_dirs = [call.args[0] for call in mock_chown.call_args_list if os.path.isdir(call.args[0])]
+    assert chowned_dirs == [str(upload_directory / 'existing' / 'new')]
+    # one fsync per file and one per directory
+    assert mock_fsync.call_count == 5
+
+def test_get_checksum(user_ref, tmp_file_service, tmp_path):
+    file_service = tmp_file_service
+    file_service.digest_index = DigestIndex(str(tmp_path / 'digests.sqlite'))
+    file_service.digest_algorithms = ['sha256', 'blake2b']
+    filepath = tmp_path / 'testuser' / 'cloud' / 'file.txt'
+    filepath.parent.mkdir(parents=True)
+    filepath.write_bytes(b'content')
+    
+    with patch('cc_cloud.service.file_service.hash_file', wraps=hash_file) as mock_hash_file:
+        digests = file_service.get_checksum(user_ref, 'file.txt')
+        assert file_service.get_checksum(user_ref, 'file.txt') == digests
+        mock_hash_file.assert_called_once()
+        
+        filepath.write_bytes(b'changed content')
+        os.utime(filepath, ns=(0, 0))
+        assert file_service.get_checksum(user_ref, 'file.txt')['sha256'] == hashlib.sha256(b'changed content').hexdigest()
+        assert mock_hash_file.call_count == 2
+    
+    assert digests == {
+        'sha256': hashlib.sha256(b'content').hexdigest(),
+        'blake2b': hashlib.blake2b(b'content').hexdigest(),
+    }
+    assert file_service.get_checksum(user_ref, '../other/file.txt') is None
+    assert file_service.get_checksum(user_ref, 'missing.txt') is None
 
 
 @patch.object(FilesystemService, "exists_or_create", Mock(return_value=True))
@@ -118,3 +205,47 @@ def test_download_file(user_ref, file_service):
     filepath = '/some/path/file1.txt'
     result = file_service.download_file(user_ref, filepath)
     assert result == '/test/users/testuser/cloud/some/path/file1.txt'
+
+
+@patch('cc_cloud.service.file_service.shutil.chown', Mock())
+def test_upload_file_if_none_match(user_ref, tmp_file_service, tmp_path):
+    file_service = tmp_file_service
+    filepath = tmp_path / 'testuser' / 'cloud' / 'file.txt'
+    filepath.parent.mkdir(parents=True)
+    filepath.write_bytes(b'content')
+    digest = hashlib.sha256(b'content').hexdigest()
+    
+    unchanged = FileStorage(stream=BytesIO(b'content'), filename='file.txt', headers={'If-None-Match': f'"sha256:{digest}"'})
+    unchanged.save = Mock()
+    saved = file_service.upload_file(user_ref, {'file.txt': unchanged})
+    
+    unchanged.save.assert_not_called()
+    assert saved['file.txt'] == {'status': 'unchanged', 'digests': {'sha256': digest}}
+    
+    new_digest = hashlib.sha256(b'new content').hexdigest()
+    changed = FileStorage(stream=BytesIO(b'new content'), filename='file.txt', headers={'If-None-Match': new_digest})
+    saved = file_service.upload_file(user_ref, {'file.txt': changed})
+    
+    assert saved['file.txt']['status'] == 'saved'
+    assert filepath.read_bytes() == b'new content'
+
+
+def test_check_files(user_ref, tmp_file_service, tmp_path):
+    file_service = tmp_file_service
+    filepath = tmp_path / 'testuser' / 'cloud' / 'file.txt'
+    filepath.parent.mkdir(parents=True)
+    filepath.write_bytes(b'content')
+    digest = hashlib.sha256(b'content').hexdigest()
+    
+    with patch('cc_cloud.service.file_service.hash_file', wraps=hash_file) as mock_hash_file:
+        results = file_service.check_files(user_ref, [
+            {'path': 'file.txt', 'size': 7, 'sha256': digest},
+            {'path': 'file.txt', 'size': 8, 'sha256': digest},
+            {'path': 'file.txt', 'sha256': hashlib.sha256(b'other').hexdigest()},
+            {'path': 'missing.txt', 'size': 7, 'sha256': digest},
+            {'path': '../file.txt', 'size': 7, 'sha256': digest},
+            {'path': 'file.txt', 'size': 7},
+        ])
+    
+    assert [result['status'] for result in results] == ['match', 'differs', 'differs', 'missing', 'invalid', 'invalid']
+    assert mock_hash_file.call_count == 2
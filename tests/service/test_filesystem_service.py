@@ -56,7 +56,7 @@ def test_delete(mock_remove, fs_service, fs_name):
 @patch('os.system')
 def test_mount(mock_system, mock_set_directory_owner, fs_service, fs_name):        
     fs_service.mount(fs_name)
-    mock_system.assert_called_once_with("mount '/test/filesystems/testuser' '/test/users/testuser/cloud'")
+    mock_system.assert_called_once_with("mount -o 'discard' '/test/filesystems/testuser' '/test/users/testuser/cloud'")
     mock_set_directory_owner.assert_called_once_with(fs_name)
 
 
@@ -76,17 +76,38 @@ def test_is_mounted_when_unmounted(fs_service, fs_name):
     assert fs_service.is_mounted(fs_name) == False
 
 
-@patch('os.system')
+@patch('os.system', return_value=0)
 @patch('builtins.open', create=True)
 def test_increase_size(mock_open, mock_system, fs_service, fs_name):
-    with patch.object(fs_service, 'get_loop_device', return_value='/dev/loop0'):
-        fs_service.increse_size(fs_name, 104857600)
+    with patch.object(fs_service, 'is_mounted', return_value=True), \
+         patch.object(fs_service, 'get_loop_device', return_value='/dev/loop0'):
+        assert fs_service.increse_size(fs_name, 104857600) == True
         
         mock_open.assert_called_once_with('/test/filesystems/testuser', 'a')
         mock_system.assert_any_call("losetup -c '/dev/loop0'")
         mock_system.assert_any_call("resize2fs '/dev/loop0'")
 
 
+@patch('os.system', return_value=0)
+@patch('builtins.open', create=True)
+def test_increase_size_unmounted(mock_open, mock_system, fs_service, fs_name):
+    with patch.object(fs_service, 'is_mounted', return_value=False), \
+         patch.object(fs_service, 'get_loop_device') as mock_get_loop_device:
+        assert fs_service.increse_size(fs_name, 104857600) == True
+        
+        mock_get_loop_device.assert_not_called()
+        mock_system.assert_any_call("e2fsck -f -y '/test/filesystems/testuser'")
+        mock_system.assert_any_call("resize2fs '/test/filesystems/testuser'")
+
+
+@patch('os.system', return_value=256)
+@patch('builtins.open', create=True)
+def test_increase_size_failed(mock_open, mock_system, fs_service, fs_name):
+    with patch.object(fs_service, 'is_mounted', return_value=True), \
+         patch.object(fs_service, 'get_loop_device', return_value='/dev/loop0'):
+        assert fs_service.increse_size(fs_name, 104857600) == False
+
+
 def test_reduce_size(fs_service, fs_name):
     with patch.object(fs_service, 'is_mounted', return_value=True), \
          patch.object(fs_service, 'umount'), \
@@ -150,4 +171,85 @@ def test_filesystem_exists_or_create_True(mock_mount, mock_is_mounted, mock_crea
     mock_filesystem_exists.assert_called_once_with(fs_name)
     mock_create.assert_not_called()
     mock_is_mounted.assert_called_once_with(fs_name)
-    mock_mount.assert_not_called()
\ No newline at end of file
+    mock_mount.assert_not_called()
+
+def test_resize_grow(fs_service, fs_name):
+    with patch.object(fs_service, 'filessystem_exists', return_value=True), \
+         patch.object(fs_service, 'get_size', return_value=10000), \
+         patch.object(fs_service, 'increse_size', return_value=True) as mock_increse_size, \
+         patch.object(fs_service, 'shrink_size') as mock_shrink_size:
+        
+        assert fs_service.resize(fs_name, 20000) == True
+        
+        mock_increse_size.assert_called_once_with(fs_name, 20000)
+        mock_shrink_size.assert_not_called()
+
+
+def test_resize_shrink(fs_service, fs_name):
+    with patch.object(fs_service, 'filessystem_exists', return_value=True), \
+         patch.object(fs_service, 'get_size', return_value=20000), \
+         patch.object(fs_service, 'increse_size') as mock_increse_size, \
+         patch.object(fs_service, 'shrink_size', return_value=True) as mock_shrink_size:
+        
+        assert fs_service.resize(fs_name, 10000) == True
+        
+        mock_shrink_size.assert_called_once_with(fs_name, 10000)
+        mock_increse_size.assert_not_called()
+
+
+@patch('os.system', return_value=0)
+@patch('builtins.open', create=True)
+def test_shrink_size(mock_open, mock_system, fs_service, fs_name):
+    with patch.object(fs_service, 'get_used_size', return_value=4096), \
+         patch.object(fs_service, 'is_mounted', side_effect=[True, False]), \
+         patch.object(fs_service, 'umount') as mock_umount, \
+         patch.object(fs_service, 'mount') as mock_mount:
+        
+        assert fs_service.shrink_size(fs_name, 20480) == True
+        
+        mock_umount.assert_called_once_with(fs_name)
+        mock_system.assert_any_call("e2fsck -f -y '/test/filesystems/testuser'")
+        mock_system.assert_any_call("resize2fs '/test/filesystems/testuser' 20K")
+        mock_open.assert_called_once_with('/test/filesystems/testuser', 'a')
+        mock_mount.assert_not_called()
+
+
+@patch('os.system')
+def test_shrink_size_too_small(mock_system, fs_service, fs_name):
+    with patch.object(fs_service, 'get_used_size', return_value=40960):
+        assert fs_service.shrink_size(fs_name, 20480) == False
+        mock_system.assert_not_called()
+
+
+@patch('os.system', return_value=0)
+def test_trim(mock_system, fs_service, fs_name):
+    with patch.object(fs_service, 'is_mounted', return_value=True):
+        assert fs_service.trim(fs_name) == True
+        mock_system.assert_called_once_with("fstrim '/test/users/testuser/cloud'")
+
+
+@patch('os.stat', return_value=Mock(st_size=52428800, st_blocks=2048))
+def test_get_disk_usage(mock_stat, fs_service, fs_name):
+    usage = fs_service.get_disk_usage(fs_name)
+    
+    mock_stat.assert_called_once_with('/test/filesystems/testuser')
+    assert usage == {'apparent_size': 52428800, 'allocated_size': 1048576}
+
+
+@patch('os.system', Mock(return_value=0))
+def test_is_in_use(fs_service, fs_name):
+    assert fs_service.is_in_use(fs_name) == True
+
+
+@patch('os.system', Mock(return_value=256))
+def test_is_not_in_use(fs_service, fs_name):
+    assert fs_service.is_in_use(fs_name) == False
+
+
+def test_find_all_filesystems_skips_temporary_files(tmp_path):
+    conf = FakeConf()
+    conf.d = dict(FakeConf.d, filesystem_directory=str(tmp_path))
+    (tmp_path / 'testuser').write_bytes(b'')
+    (tmp_path / '.testuser.partial').write_bytes(b'')
+    
+    assert FilesystemService(conf).find_all_filesystems() == ['testuser']
@@ -0,0 +1,78 @@
+from pytest import fixture
+from unittest.mock import MagicMock
+from types import SimpleNamespace
+
+from cc_cloud.service.key_service import KeyService, normalize_key
+
+
+KEY = 'ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAILrKMWl6ORsbtIrvKkRiWv4itpIhlP8hd47Xp5AhTM7G test@host'
+OTHER_KEY = 'ssh-ed25519 AAAAC3NzaC1lZDI1NTE5AAAAILrKMWl6ORsbtIrvKkRiWv4itpIhlP8hd47Xp5AhTM7H'
+
+
+@fixture
+def mongo():
+    mongo = MagicMock()
+    mongo.db['cloud_users'].find.return_value = [
+        {'ssh_user': 'cloud-a', 'authorized_keys': [KEY, OTHER_KEY]},
+        {'ssh_user': 'cloud-b', 'authorized_keys': [OTHER_KEY]},
+    ]
+    mongo.db['cloud_users'].find_one.return_value = {'authorized_keys': [KEY]}
+    return mongo
+
+@fixture
+def key_service(tmp_path, mongo):
+    conf = SimpleNamespace(d={'authorized_keys_cache_file': str(tmp_path / 'keys.sqlite'), 'max_authorized_keys': 2})
+    return KeyService(conf, mongo)
+
+
+def test_normalize_key():
+    assert normalize_key('  ' + KEY + '\n') == KEY
+    assert normalize_key('ssh-ed25519 AAAA') is None
+    assert normalize_key('ssh-rsa AAAAC3NzaC1lZDI1NTE5AAAAILrKMWl6ORsbtIrvKkRiWv4itpIhlP8hd47Xp5AhTM7G') is None
+    assert normalize_key(KEY + '\n' + OTHER_KEY) is None
+    assert normalize_key('command="sh" ' + KEY) is None
+
+
+def test_lookup_uses_snapshot(key_service, mongo):
+    assert set(key_service.lookup('cloud-a')) == {KEY, OTHER_KEY}
+    assert key_service.lookup('cloud-b') == [OTHER_KEY]
+    assert key_service.lookup('cloud-unknown') == []
+
+    mongo.db['cloud_users'].find.assert_called_once()
+
+
+def test_lookup_database_unavailable(key_service, mongo):
+    key_service.lookup('cloud-a')
+    key_service.cache_ttl = -1
+    mongo.db['cloud_users'].find.side_effect = ConnectionError()
+
+    assert key_service.lookup('cloud-b') == [OTHER_KEY]
+
+
+def test_add_key(key_service, mongo):
+    key_service.lookup('cloud-b')
+    mongo.db['cloud_users'].find.side_effect = ConnectionError()
+
+    assert key_service.add_key('c', 'cloud-c', OTHER_KEY)
+    assert key_service.lookup('cloud-c') == [OTHER_KEY]
+    mongo.db['cloud_users'].update_one.assert_called_once_with(
+        {'username': 'c'},
+        {'$set': {'ssh_user': 'cloud-c'}, '$addToSet': {'authorized_keys': OTHER_KEY}},
+        upsert=True
+    )
+
+
+def test_add_key_invalid_or_too_many(key_service, mongo):
+    mongo.db['cloud_users'].find_one.return_value = {'authorized_keys': ['key1', 'key2']}
+
+    assert not key_service.add_key('a', 'cloud-a', 'invalid')
+    assert not key_service.add_key('a', 'cloud-a', KEY)
+    mongo.db['cloud_users'].update_one.assert_not_called()
+
+
+def test_remove_key(key_service, mongo):
+    key_service.lookup('cloud-a')
+    mongo.db['cloud_users'].update_one.return_value.modified_count = 1
+
+    assert key_service.remove_key('a', 'cloud-a', KEY)
+    assert key_service.lookup('cloud-a') == [OTHER_KEY]
@@ -0,0 +1,145 @@
+from pytest import fixture
+
+from cc_cloud.service.mount_manager import MountManager
+
+
+class FakeMountBackend:
+
+    def __init__(self):
+        self.mounted = set()
+        self.in_use = set()
+        self.busy = set()
+        self.mount_calls = 0
+
+    def exists_or_create(self, fs_name):
+        self.mount_calls += 1
+        self.mounted.add(fs_name)
+
+    def umount(self, fs_name):
+        if fs_name in self.busy:
+            return False
+        self.mounted.discard(fs_name)
+        return True
+
+    def is_in_use(self, fs_name):
+        return fs_name in self.in_use
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+@fixture
+def backend():
+    return FakeMountBackend()
+
+@fixture
+def clock():
+    return FakeClock()
+
+
+def test_acquire_mounts_once(backend, clock):
+    manager = MountManager(backend, clock=clock)
+
+    manager.acquire('cloud-a')
+    manager.acquire('cloud-a')
+
+    assert backend.mounted == {'cloud-a'}
+    assert backend.mount_calls == 1
+    assert manager.is_mounted('cloud-a')
+
+
+def test_least_recently_used_is_unmounted(backend, clock):
+    manager = MountManager(backend, max_mounts=2, clock=clock)
+
+    manager.acquire('cloud-a')
+    manager.acquire('cloud-b')
+    manager.acquire('cloud-a')
+    manager.acquire('cloud-c')
+
+    assert backend.mounted == {'cloud-a', 'cloud-c'}
+    assert manager.mounted_filesystems() == ['cloud-a', 'cloud-c']
+
+
+def test_in_use_is_not_unmounted(backend, clock):
+    manager = MountManager(backend, max_mounts=1, clock=clock)
+    backend.in_use.add('cloud-a')
+
+    manager.acquire('cloud-a')
+    manager.acquire('cloud-b')
+
+    assert backend.mounted == {'cloud-a', 'cloud-b'}
+
+
+def test_unmount_idle(backend, clock):
+    manager = MountManager(backend, idle_timeout=60, clock=clock)
+
+    manager.acquire('cloud-a')
+    clock.now = 50
+    manager.acquire('cloud-b')
+    clock.now = 100
+    manager.unmount_idle()
+
+    assert backend.mounted == {'cloud-b'}
+    assert not manager.is_mounted('cloud-a')
+
+
+def test_remount_on_demand(backend, clock):
+    manager = MountManager(backend, max_mounts=1, clock=clock)
+
+    manager.acquire('cloud-a')
+    manager.acquire('cloud-b')
+    manager.acquire('cloud-a')
+
+    assert backend.mounted == {'cloud-a'}
+    assert backend.mount_calls == 3
+
+
+def test_adopt(backend, clock):
+    manager = MountManager(backend, max_mounts=2)
+    manager.adopt(['cloud-a', 'cloud-b'])
+    clock.now = 1
+
+    manager.acquire('cloud-c')
+
+    assert backend.mount_calls == 1
+    assert manager.mounted_filesystems() == ['cloud-b', 'cloud-c']
+
+
+def test_failed_umount_stays_tracked(backend, clock):
+    manager = MountManager(backend, max_mounts=1, clock=clock)
+
+    manager.acquire('cloud-a')
+    backend.busy.add('cloud-a')
+    manager.acquire('cloud-b')
+
+    assert backend.mounted == {'cloud-a', 'cloud-b'}
+    assert manager.mounted_filesystems() == ['cloud-a', 'cloud-b']
+
+    backend.busy.clear()
+    manager.unmount_idle()
+
+    assert backend.mounted == {'cloud-b'}
+    assert manager.mounted_filesystems() == ['cloud-b']
+
+
+def test_pinned_is_not_unmounted(backend, clock):
+    manager = MountManager(backend, max_mounts=1, clock=clock)
+
+    manager.acquire('cloud-a', pin=True)
+    manager.acquire('cloud-a', pin=True)
+    manager.acquire('cloud-b')
+    manager.unpin('cloud-a')
+    manager.acquire('cloud-b')
+
+    assert backend.mounted == {'cloud-a', 'cloud-b'}
+
+    manager.unpin('cloud-a')
+    manager.acquire('cloud-b')
+
+    assert backend.mounted == {'cloud-b'}
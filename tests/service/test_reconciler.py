@@ -0,0 +1,92 @@
+from pytest import fixture
+from unittest.mock import patch, Mock, MagicMock
+from types import SimpleNamespace
+
+from cc_cloud.service.mount_manager import MountManager
+from cc_cloud.service.reconciler import Reconciler
+
+
+@fixture
+def cloud_service():
+    filesystem_service = MagicMock()
+    filesystem_service.find_all_filesystems.return_value = ['cloud-a', 'cloud-b', 'cloud-orphan']
+    filesystem_service.find_mounted_filesystems.return_value = ['cloud-a', 'cloud-orphan', 'cloud-deleted']
+    filesystem_service.is_in_use.return_value = False
+
+    mongo = MagicMock()
+    mongo.db['cloud_users'].find.return_value = [
+        {'username': 'a', 'ssh_user': 'cloud-a', 'ssh_password': 'secret'},
+        {'username': 'b', 'ssh_user': 'cloud-b', 'ssh_password': 'secret'},
+        {'username': 'stale', 'ssh_user': 'cloud-stale', 'ssh_password': 'secret'},
+        {'username': 'keys', 'ssh_user': 'cloud-keys', 'ssh_password': 'secret', 'authorized_keys': ['ssh-ed25519 AAAA']},
+    ]
+
+    return SimpleNamespace(
+        filesystem_service=filesystem_service,
+        mount_manager=MountManager(filesystem_service),
+        mongo=mongo,
+        user_prefix='cloud',
+        home_dir='/test/users',
+        provisioned=set(),
+    )
+
+
+@fixture
+def local_users():
+    return [SimpleNamespace(pw_name=name) for name in ['root', 'cloud-a', 'cloud-b', 'cloud-keys']]
+
+
+def test_reconcile(cloud_service, local_users):
+    reconciler = Reconciler(cloud_service)
+
+    with patch('cc_cloud.service.reconciler.pwd.getpwall', return_value=local_users):
+        report = reconciler.reconcile()
+
+    assert report['stale_db_rows'] == ['cloud-stale']
+    assert report['missing_local_users'] == []
+    assert report['orphan_images'] == ['cloud-orphan']
+    assert report['stale_mounts'] == ['cloud-deleted']
+    assert report['missing_mounts'] == ['cloud-b']
+    assert reconciler.last_report == report
+
+    filesystem_service = cloud_service.filesystem_service
+    cloud_service.mongo.db['cloud_users'].delete_one.assert_called_once_with({'ssh_user': 'cloud-stale'})
+    filesystem_service.umount.assert_any_call('cloud-orphan')
+    filesystem_service.umount.assert_any_call('cloud-deleted')
+    filesystem_service.delete.assert_not_called()
+    filesystem_service.exists_or_create.assert_called_once_with('cloud-b')
+    assert [c.args for c in filesystem_service.refresh_usage.call_args_list] == [('cloud-a',), ('cloud-b',)]
+    assert cloud_service.provisioned == {'cloud-a', 'cloud-b', 'cloud-keys'}
+
+
+def test_reconcile_missing_local_user(cloud_service, local_users):
+    reconciler = Reconciler(cloud_service, delete_orphans=True)
+    local_user = Mock()
+
+    with patch('cc_cloud.service.reconciler.pwd.getpwall', return_value=local_users[:2]), \
+         patch('cc_cloud.service.reconciler.LocalUser', return_value=local_user) as mock_local_user:
+        report = reconciler.reconcile()
+
+    assert report['missing_local_users'] == ['cloud-b', 'cloud-keys']
+    assert 'cloud-keys' not in report['stale_db_rows']
+    mock_local_user.assert_any_call('cloud-b', '/test/users')
+    mock_local_user.assert_any_call('cloud-keys', '/test/users')
+    assert local_user.create.call_count == 2
+    local_user.set_password.assert_called_with('secret')
+    cloud_service.filesystem_service.delete.assert_called_once_with('cloud-orphan')
+
+
+@patch('builtins.open')
+def test_find_mounted_filesystems(mock_open):
+    from cc_cloud.service.filesystem_service import FilesystemService
+
+    class FakeConf:
+        d = {'userhome_directory': '/test/users', 'upload_directory_name': 'cloud'}
+
+    mock_open.return_value.__enter__.return_value.readlines.return_value = [
+        '22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw\n',
+        '90 22 7:0 / /test/users/cloud-a/cloud rw,relatime shared:2 - ext4 /dev/loop0 rw\n',
+        '91 22 7:1 / /test/users/cloud-b\\040c/cloud rw,relatime shared:3 - ext4 /dev/loop1 rw\n',
+    ]
+
+    assert FilesystemService(FakeConf()).find_mounted_filesystems() == ['cloud-a', 'cloud-b c']
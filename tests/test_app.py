@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from cc_cloud.app import create_app
+
+
+conf = SimpleNamespace(d={
+    'broker': {'auth': {'num_login_attempts': 3, 'block_for_seconds': 30, 'tokens_valid_for_seconds': 86400}},
+    'mongo': {'db': 'ccagency', 'username': 'ccadmin', 'password': 'SECRET'},
+    'digest_index_file': '/nonexistent/digests.sqlite',
+})
+
+
+@patch('cc_cloud.service.filesystem_service.os.system')
+@patch('cc_cloud.db.Mongo')
+def test_create_app_has_no_side_effects(mock_mongo, mock_system):
+    app = create_app(conf=conf)
+
+    assert 'get_root' in app.view_functions
+    mock_mongo.assert_not_called()
+    mock_system.assert_not_called()
+
+
+@patch('cc_cloud.service.filesystem_service.FilesystemService.find_mounted_filesystems', return_value=['cloud-a'])
+@patch('cc_cloud.db.Mongo')
+def test_first_request_starts_cloud_service(mock_mongo, mock_find_mounted):
+    app = create_app(conf=conf)
+
+    client = app.test_client()
+    assert client.get('/').json == {'Hello': 'World'}
+    client.get('/')
+
+    mock_find_mounted.assert_called_once()
+    mock_mongo.assert_not_called()
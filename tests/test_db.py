@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from cc_cloud.db import LazyMongo
+
+
+CONF = SimpleNamespace(d={'mongo': {'host': 'mongo', 'db': 'ccagency', 'username': 'user', 'password': 'pw'}})
+
+
+@patch('cc_cloud.db.Mongo')
+def test_connect_on_first_use(mock_mongo):
+    mongo = LazyMongo(CONF)
+    mock_mongo.assert_not_called()
+
+    assert mongo.db is mock_mongo.return_value.db
+    assert mongo.db is mock_mongo.return_value.db
+    mock_mongo.assert_called_once_with(CONF)
+
+
+@patch('cc_cloud.db.pymongo.MongoClient')
+def test_server_selection_timeout(mock_client):
+    mongo = LazyMongo(CONF, server_selection_timeout=2)
+
+    assert mongo.db is mock_client.return_value['ccagency']
+    mock_client.assert_called_once_with(
+        host='mongo', port=27017, username='user', password='pw', authSource='ccagency', serverSelectionTimeoutMS=2000
+    )